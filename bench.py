@@ -0,0 +1,142 @@
+import sys
+import time
+import random
+import argparse
+
+from ocsn.backend import open_backend
+from ocsn.ocsn_types import OCSNDataFlowEntity, OCSNDirectionalFlow, OCSNSymmetricFlow
+from ocsn.flowmatch import OCSNFlowMatcher
+from ocsn.flowverify import OCSNFlowVerifier
+
+import json
+
+
+def timed(fn):
+    start = time.perf_counter()
+    n = fn()
+    return n, time.perf_counter() - start
+
+
+class BenchCommand:
+
+    def _parse(self):
+        parser = argparse.ArgumentParser(
+            description='OCSN benchmarks',
+            usage='''bench.py <benchmark> [<args>]
+
+The benchmarks are:
+   read                 Compare read throughput of storage backends
+   verify               Compare pure-python and vectorized flow verification
+''')
+        parser.add_argument('benchmark', help='Benchmark to run')
+        args = parser.parse_args(sys.argv[1:2])
+        if not hasattr(self, args.benchmark) or args.benchmark[0] == '_':
+            print('Unrecognized benchmark:', args.benchmark)
+            parser.print_help()
+            exit(1)
+        return getattr(self, args.benchmark)
+
+    def _read_backend(self, url, count, batch_size):
+        client = open_backend(url)
+
+        prefix = 'bench/'
+        keys = [ prefix + '%08d' % i for i in range(count) ]
+        doc = json.dumps({'id': 'x', 'name': 'bench', 'region': 'r', 'endpoint': 'http://localhost'})
+
+        for i in range(0, count, batch_size):
+            client.put_many([ (k, doc) for k in keys[i:i + batch_size] ])
+
+        def single():
+            for k in keys:
+                client.get(k)
+            return count
+
+        def batched():
+            for i in range(0, count, batch_size):
+                client.get_many(keys[i:i + batch_size])
+            return count
+
+        def scan():
+            return sum(1 for _ in client.list(prefix))
+
+        result = {'backend': url}
+        for name, fn in [ ('get', single), ('get_many', batched), ('list', scan) ]:
+            n, elapsed = timed(fn)
+            result[name + '_ops_per_sec'] = round(n / elapsed) if elapsed else None
+
+        client.unlink_many(client.keys(prefix), batch_size)
+
+        return result
+
+    def read(self):
+        parser = argparse.ArgumentParser(
+            description='Compare read throughput of storage backends',
+            usage='bench.py read [--backend URL ...]')
+
+        parser.add_argument('--backend', action = 'append')
+        parser.add_argument('--count', type = int, default = 10000)
+        parser.add_argument('--batch-size', type = int, default = 500)
+
+        args = parser.parse_args(sys.argv[2:])
+
+        backends = args.backend or [ 'redis://localhost:6379/0', 'sqlite://:memory:' ]
+
+        result = [ self._read_backend(url, args.count, args.batch_size) for url in backends ]
+
+        print(json.dumps(result, indent=2))
+
+    def verify(self):
+        parser = argparse.ArgumentParser(
+            description='Compare pure-python and vectorized flow verification',
+            usage='bench.py verify [--vbuckets N] [--endpoints N] [--flows N]')
+
+        parser.add_argument('--vbuckets', type = int, default = 5000)
+        parser.add_argument('--endpoints', type = int, default = 500)
+        parser.add_argument('--flows', type = int, default = 5000)
+        parser.add_argument('--per-vbucket', type = int, default = 4)
+        parser.add_argument('--seed', type = int, default = 1)
+
+        args = parser.parse_args(sys.argv[2:])
+
+        rnd = random.Random(args.seed)
+
+        endpoints = [ OCSNDataFlowEntity('svc%d' % (i % 50), 'bucket%d' % i, None) for i in range(args.endpoints) ]
+
+        matcher = OCSNFlowMatcher()
+        for i in range(args.flows):
+            s, d = rnd.sample(endpoints, 2)
+            matcher.add('f%d' % i, OCSNDirectionalFlow(s, d))
+        for i in range(args.flows // 100):
+            matcher.add_symmetric('g%d' % i, OCSNSymmetricFlow(entities = rnd.sample(endpoints, 5)))
+
+        verifier = OCSNFlowVerifier(matcher)
+        for i in range(args.vbuckets):
+            verifier.add(i, rnd.sample(endpoints, rnd.randint(2, args.per_vbucket)))
+
+        def count(results):
+            return sum(len(missing) for _, _, missing in results)
+
+        (py_missing, py_time) = timed(lambda: count(verifier.run()))
+        (np_missing, np_time) = timed(lambda: count(verifier.run_vectorized()))
+
+        result = {
+            'vbuckets': args.vbuckets,
+            'endpoints': args.endpoints,
+            'flows': args.flows,
+            'missing': py_missing,
+            'consistent': py_missing == np_missing,
+            'python_sec': round(py_time, 4),
+            'vectorized_sec': round(np_time, 4),
+            'speedup': round(py_time / np_time, 2) if np_time else None,
+        }
+
+        print(json.dumps(result, indent=2))
+
+
+def main():
+    cmd = BenchCommand()._parse()
+    cmd()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,64 @@
+import os
 import sys
+import time
+import keyword
+import datetime
 import argparse
 import random
 import string
+import itertools
 
 from ocsn.ocsn_err import *
 from ocsn.service import *
 from ocsn.tenant import *
 from ocsn.dataflow import *
+from ocsn.index import *
+from ocsn.ids import *
+from ocsn.changefeed import *
+from ocsn.profiling import OCSNProfiler
+from ocsn.output import OCSNOutput, OUTPUT_FORMATS
+from ocsn.loadgen import OCSNLoadGen, parse_mix
+from ocsn.gen import OCSNCatalogGen, parse_range
+from ocsn.snapshot import *
+from ocsn.coninfo import *
+from ocsn.flowmatch import *
+from ocsn.flowgraph import *
+from ocsn.flowverify import *
 from ocsn.redis_client import *
 from ocsn.ocsn_types import *
+from ocsn.backend import open_backend
 
 import json
 
 
+# OCSN_BACKEND selects the catalog store, e.g. redis://host:6379/0 or
+# sqlite:///var/lib/ocsn/catalog.db
+redis_client = open_backend(os.environ.get('OCSN_BACKEND'))
+
+
+# set from --format by OCSNEnv
+output = OCSNOutput()
+
 def dump_json(x):
-    return json.dumps(x, indent=2)
+    return output.dumps(x)
+
+def parse_time_arg(arg):
+    # epoch seconds or ISO 8601, returned in ms
+    if arg is None:
+        return None
+
+    try:
+        return int(float(arg) * 1000)
+    except ValueError:
+        pass
+
+    try:
+        return int(datetime.datetime.fromisoformat(arg).timestamp() * 1000)
+    except ValueError:
+        raise OCSNException(OCSNError.ERROR, 'invalid time: ' + arg)
 
-def gen_id(entity_str):
-    return entity_str + '-' + ''.join(random.choices(string.ascii_lowercase, k=7))
+def format_time_ms(ms):
+    return datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc).isoformat()
 
 def split_list_arg(arg):
     if not arg:
@@ -41,6 +82,7 @@ The subcommands are:
    create                        Create a new service
    modify                        Modify an existing service
    remove                        Remove a service
+   instances                     List service instances of a service
 ''')
         parser.add_argument('subcommand', help='Subcommand to run')
         # parse_args defaults to [1:] for args, but you need to
@@ -60,9 +102,7 @@ The subcommands are:
 
         svc = OCSNServiceCtl(redis_client)
 
-        result = ([ e.encode() for e in svc.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in svc.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -86,7 +126,10 @@ The subcommands are:
             svc.load(redis_client)
 
         svc.apply(name = args.name, region = args.region, endpoint = args.endpoint)
-        svc.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            svc.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, svc, None if args.svc_id else 'svc')
 
         print(dump_json(svc.encode()))
 
@@ -124,6 +167,19 @@ The subcommands are:
         svc = OCSNService(id = args.svc_id)
         svc.remove(redis_client)
 
+    def instances(self):
+
+        parser = argparse.ArgumentParser(
+            description='List service instances of a service',
+            usage='ocsn svc instances')
+
+        parser.add_argument('--svc-id', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+
+        print(dump_json(idx.svcis_of_svc(args.svc_id)))
 
 
 class SvciCommand:
@@ -142,6 +198,8 @@ The subcommands are:
    modify                        Modify an existing service instancce
    info                          Show service instance info
    remove                        Remove a service instance
+   bis                           List bucket instances of a service instance
+   creds                         List credentials of a service instance
 ''')
         parser.add_argument('subcommand', help='Subcommand to run')
         # parse_args defaults to [1:] for args, but you need to
@@ -161,9 +219,7 @@ The subcommands are:
 
         svci = OCSNServiceInstanceCtl(redis_client)
 
-        result = ([ e.encode() for e in svci.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in svci.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -191,7 +247,10 @@ The subcommands are:
             svci.load(redis_client)
 
         svci.apply(name = args.name, svc_id = args.svc_id, buckets = buckets, creds = creds)
-        svci.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            svci.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, svci, None if args.svci_id else 'svci')
 
         print(dump_json(svci.encode()))
 
@@ -223,12 +282,50 @@ The subcommands are:
             usage='ocsn svci remove')
 
         parser.add_argument('--svci-id', required = True)
+        parser.add_argument('--cascade', action = 'store_true',
+                            help = 'also remove bucket instances and credentials')
+        parser.add_argument('--batch-size', type = int, default = 1000)
+        parser.add_argument('--throttle', type = float,
+                            help = 'seconds to sleep between delete batches')
 
         args = parser.parse_args(sys.argv[3:])
 
+        if args.cascade:
+            svci = OCSNServiceInstanceCtl(redis_client)
+            print(dump_json(svci.remove_cascade(args.svci_id, args.batch_size, args.throttle)))
+            return
+
         svci = OCSNServiceInstance(id = args.svci_id)
         svci.remove(redis_client)
 
+    def bis(self):
+
+        parser = argparse.ArgumentParser(
+            description='List bucket instances of a service instance',
+            usage='ocsn svci bis')
+
+        parser.add_argument('--svci-id', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+
+        print(dump_json(idx.bis_of_svci(args.svci_id)))
+
+    def creds(self):
+
+        parser = argparse.ArgumentParser(
+            description='List credentials of a service instance',
+            usage='ocsn svci creds')
+
+        parser.add_argument('--svci-id', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+
+        print(dump_json(idx.creds_of_svci(args.svci_id)))
+
 
 class CredsCommand:
     def __init__(self, env, args):
@@ -245,6 +342,8 @@ The subcommands are:
    create                        Create new credentials
    modify                        Modify credentials
    remove                        Remove credentials
+   bis                           List bucket instances using credentials
+   lookup                        Find credentials by access key
 ''')
         parser.add_argument('subcommand', help='Subcommand to run')
         # parse_args defaults to [1:] for args, but you need to
@@ -268,9 +367,7 @@ The subcommands are:
 
         creds = OCSNS3CredsCtl(redis_client, args.svci_id)
 
-        result = ([ e.encode() for e in creds.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in creds.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -292,7 +389,10 @@ The subcommands are:
             creds.load(redis_client)
 
         creds.apply(access_key = args.access_key, secret = args.secret)
-        creds.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            creds.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, creds, None if args.creds_id else 's3creds')
 
         print(dump_json(creds.encode()))
 
@@ -316,6 +416,35 @@ The subcommands are:
         creds = OCSNS3Creds(args.svci_id, id = args.creds_id)
         creds.remove(redis_client)
 
+    def bis(self):
+
+        parser = argparse.ArgumentParser(
+            description='List bucket instances using credentials',
+            usage='ocsn creds bis')
+
+        parser.add_argument('--svci-id', required = True)
+        parser.add_argument('--creds-id', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+
+        print(dump_json(idx.bis_of_creds(args.svci_id, args.creds_id)))
+
+    def lookup(self):
+
+        parser = argparse.ArgumentParser(
+            description='Find credentials by access key',
+            usage='ocsn creds lookup')
+
+        parser.add_argument('--access-key', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        cl = OCSNS3CredsLookup(redis_client)
+
+        self.env.output.records(e.encode() for e in cl.lookup(args.access_key))
+
 
 class BucketInstance:
     def __init__(self, env, args):
@@ -330,6 +459,7 @@ class BucketInstance:
 The subcommands are:
    list                          List bucket instances
    create                        Create a bucket instance
+   vbuckets                      List vbuckets mapping a bucket instance
 ''')
         parser.add_argument('subcommand', help='Subcommand to run')
         # parse_args defaults to [1:] for args, but you need to
@@ -353,9 +483,7 @@ The subcommands are:
 
         bis = OCSNBucketInstanceCtl(redis_client, args.svci_id)
 
-        result = ([ e.encode() for e in bis.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in bis.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -379,7 +507,10 @@ The subcommands are:
             bi.load(redis_client)
 
         bi.apply(bucket = args.bucket, obj_prefix = args.obj_prefix, creds_id = args.creds_id)
-        bi.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            bi.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, bi, None if args.bi_id else 'bi')
 
         print(dump_json(bi.encode()))
 
@@ -416,9 +547,26 @@ The subcommands are:
 
         args = parser.parse_args(sys.argv[3:])
 
-        bi = OCSNS3Creds(args.svci_id, id = args.bi_id)
+        bi = OCSNBucketInstance(args.svci_id, id = args.bi_id)
         bi.remove(redis_client)
 
+    def vbuckets(self):
+
+        parser = argparse.ArgumentParser(
+            description='List vbuckets mapping a bucket instance',
+            usage='ocsn bi vbuckets')
+
+        parser.add_argument('--svci-id', required = True)
+        parser.add_argument('--bi-id', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+
+        self.env.output.records({'tenant_id': vb.tenant_id,
+                                 'user_id': vb.user_id,
+                                 'vbucket_id': vb.id } for vb in idx.vbuckets_of_bi(args.svci_id, args.bi_id))
+
 
 class TenantCommand:
     def __init__(self, env, args):
@@ -455,9 +603,7 @@ The subcommands are:
 
         tc = OCSNTenantCtl(redis_client)
 
-        result = ([ e.encode() for e in tc.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in tc.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -484,7 +630,10 @@ The subcommands are:
             tenant.load(redis_client)
 
         tenant.apply(name = args.name, policy = policy)
-        tenant.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            tenant.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, tenant, None if args.tenant_id else 'tenant')
 
         print(dump_json(tenant.encode()))
 
@@ -516,9 +665,19 @@ The subcommands are:
             usage='ocsn tenant remove')
 
         parser.add_argument('--tenant-id', required = True)
+        parser.add_argument('--cascade', action = 'store_true',
+                            help = 'also remove users and vbuckets')
+        parser.add_argument('--batch-size', type = int, default = 1000)
+        parser.add_argument('--throttle', type = float,
+                            help = 'seconds to sleep between delete batches')
 
         args = parser.parse_args(sys.argv[3:])
 
+        if args.cascade:
+            tc = OCSNTenantCtl(redis_client)
+            print(dump_json(tc.remove_cascade(args.tenant_id, args.batch_size, args.throttle)))
+            return
+
         svc = OCSNTenant(id = args.tenant_id)
         svc.remove(redis_client)
 
@@ -561,9 +720,7 @@ The subcommands are:
 
         uc = OCSNUserCtl(redis_client, args.tenant_id)
 
-        result = ([ e.encode() for e in uc.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in uc.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -584,7 +741,10 @@ The subcommands are:
             u.load(redis_client)
 
         u.apply(name = args.name)
-        u.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            u.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, u, None if args.user_id else 'user')
 
         print(dump_json(u.encode()))
 
@@ -609,14 +769,6 @@ The subcommands are:
         u.remove(redis_client)
 
 
-class OCSNBucketInstanceMappingAlt(OCSNEntity):
-    def __init__(self, bis):
-        self.bis = bis
-
-    def encode(self):
-        return {'bis': [ x for x in self.bis] }
-
-
 class VBucketCommand:
     def __init__(self, env, args):
         self.env = env
@@ -659,9 +811,7 @@ The subcommands are:
 
         uvb = OCSNVBucketCtl(redis_client, args.tenant_id, args.user_id)
 
-        result = ([ e.encode() for e in uvb.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in uvb.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -683,7 +833,10 @@ The subcommands are:
             u.load(redis_client)
 
         u.apply(name = args.name)
-        u.store(redis_client, exclusive = not only_modify, only_modify = only_modify)
+        if only_modify:
+            u.store(redis_client, only_modify = True)
+        else:
+            store_new(redis_client, u, None if args.vbucket_id else 'vbucket-id')
 
         print(dump_json(u.encode()))
 
@@ -706,32 +859,42 @@ The subcommands are:
         args = parser.parse_args(sys.argv[3:])
 
         vb = OCSNVBucket(args.tenant_id, args.user_id, id = args.vbucket_id)
-        vb.load(redis_client)
-
-        new_bis = []
-        for k, item in vb.mappings.bis.items():
-            bi = OCSNBucketInstance(item.svci_id, id = item.bi_id)
-            bi.load(redis_client)
-
-            svci = OCSNServiceInstance(id = item.svci_id)
-            svci.load(redis_client)
-
-            svc = OCSNService(id = svci.svc_id)
-            svc.load(redis_client)
-
-            new_bi = {'endpoint': svc.endpoint,
-                      'svc_name': svc.name,
-                      'svci_name': svci.name,
-                      'bucket': bi.bucket,
-                      'obj_prefix': bi.obj_prefix,
-                      'creds_id': bi.creds_id }
-
-            new_bis.append(new_bi)
-
-
-        vb.mappings = OCSNBucketInstanceMappingAlt(new_bis)
-
-        print(dump_json(vb.encode()))
+        if vb.load(redis_client) is None:
+            raise OCSNException(OCSNError.ERROR, 'no such vbucket: ' + vb.get_key())
+
+        # one record per mapping, resolved and written a batch at a time
+        # so that a hashed vbucket with many mappings is never held whole
+        svcis = {}
+        svcs = {}
+
+        def entries():
+            for batch in vb.mapping_batches(redis_client):
+                bis = redis_client.get_many([ OCSNBucketInstance(item.svci_id, id = item.bi_id).get_key() for _, item in batch ])
+                for (k, item), v in zip(batch, bis):
+                    bi = OCSNBucketInstance(item.svci_id, id = item.bi_id)
+                    bi.decode_json(v)
+
+                    svci = svcis.get(item.svci_id)
+                    if not svci:
+                        svci = svcis[item.svci_id] = OCSNServiceInstance(id = item.svci_id)
+                        svci.load(redis_client)
+
+                    # a mapping left dangling by a cascade has no svci
+                    svc = svcs.get(svci.svc_id)
+                    if not svc:
+                        svc = svcs[svci.svc_id] = OCSNService(id = svci.svc_id)
+                        if svci.svc_id:
+                            svc.load(redis_client)
+
+                    yield {'entry_id': k,
+                           'endpoint': svc.endpoint,
+                           'svc_name': svc.name,
+                           'svci_name': svci.name,
+                           'bucket': bi.bucket,
+                           'obj_prefix': bi.obj_prefix,
+                           'creds_id': bi.creds_id }
+
+        self.env.output.records(entries())
 
     def remove(self):
 
@@ -772,10 +935,9 @@ The subcommands are:
         bi = OCSNBucketInstance(args.svci_id, id = args.bi_id)
         bi.load(redis_client)
 
-        vb.map(id, bi)
-        vb.store(redis_client)
+        vb.map_entry(redis_client, id, bi)
 
-        print(dump_json(vb.encode()))
+        print(dump_json(dict(OCSNBucketInstanceID(bi.svci, bi.id).encode(), entry_id = id)))
 
     def unmap(self):
 
@@ -793,10 +955,11 @@ The subcommands are:
         vb = OCSNVBucket(args.tenant_id, args.user_id, id = args.vbucket_id)
         vb.load(redis_client)
 
-        vb.unmap(args.entry_id)
-        vb.store(redis_client)
+        old = vb.unmap_entry(redis_client, args.entry_id)
+        if old is None:
+            raise OCSNException(OCSNError.ERROR, 'no such entry: ' + args.entry_id)
 
-        print(dump_json(vb.encode()))
+        print(dump_json(dict(old.encode(), entry_id = args.entry_id)))
 
     def coninfo(self):
 
@@ -810,44 +973,9 @@ The subcommands are:
 
         args = parser.parse_args(sys.argv[3:])
 
-        tenant = OCSNTenant(args.tenant_id)
-        tenant.load(redis_client)
-
-        vb = OCSNVBucket(args.tenant_id, args.user_id, id = args.vbucket_id)
-        vb.load(redis_client)
-
-        result = []
-
-        for _, bid in vb.mappings.bis.items():
-            d = {}
-
-            svci = OCSNServiceInstance(id = bid.svci_id)
-            svci.load(redis_client)
-
-            if not tenant.check_policy(svci.svc_id):
-                continue
-
-            svc = OCSNService(id = svci.svc_id)
-            svc.load(redis_client)
-
-            bi = OCSNBucketInstance(bid.svci_id, id = bid.bi_id)
-            bi.load(redis_client)
-
-            creds = OCSNS3Creds(svci.id, bi.creds_id)
-            creds.load(redis_client)
-
-            conn = {
-                     'endpoint': svc.endpoint,
-                     'creds': {
-                         'access_key': creds.access_key,
-                         'secret': creds.secret,
-                      },
-                   }
-            d['connection'] = conn
-            d['bucket'] = bi.bucket
-            d['obj_prefix'] = bi.obj_prefix
+        ci = OCSNConInfoCtl(redis_client)
 
-            result.append(d)
+        result = ci.get(args.tenant_id, args.user_id, args.vbucket_id)
 
         if len(result) > 0:
             print(dump_json(result))
@@ -880,9 +1008,13 @@ class FlowCommand:
 The subcommands are:
    list                          List data flows
    create                        Declare a new data flow
+   symmetric                     Declare a symmetric (n-way) data flow
    modify                        Modify a data flow
    info                          Show data flow info
    remove                        Remove data flow
+   verify                        Verify flows match vbucket requirements
+   reach                         List endpoints downstream of a source
+   cycles                        List replication cycles
 ''')
         parser.add_argument('subcommand', help='Subcommand to run')
         # parse_args defaults to [1:] for args, but you need to
@@ -907,9 +1039,7 @@ The subcommands are:
 
         df = OCSNDataFlowInstanceCtl(redis_client)
 
-        result = ([ e.encode() for e in df.list() ])
-
-        print(dump_json(result))
+        self.env.output.records(e.encode() for e in df.list())
 
     def _do_store(self, only_modify, desc, usage):
 
@@ -935,17 +1065,39 @@ The subcommands are:
 
         id = args.group_id or gen_id('flowgroup')
 
-        df = OCSNDataFlowInstance(id)
-        df.load(redis_client)
+        f = OCSNDataFlowInstanceCtl(redis_client).append(id, flow, flow_id = args.flow_id)
 
-        df.append(flow, flow_id = args.flow_id)
-        df.store(redis_client)
-
-        print(dump_json(df.encode()))
+        print(dump_json(f.encode()))
 
     def create(self):
         self._do_store(False, 'Declare a new data flow', 'ocsn flow create')
 
+    def symmetric(self):
+
+        parser = argparse.ArgumentParser(
+            description='Declare a symmetric (n-way) data flow',
+            usage='ocsn flow symmetric --endpoint <svc-id>[:<bucket>[:<obj-prefix>]] ...')
+
+        parser.add_argument('--group-id')
+        parser.add_argument('--flow-id')
+        parser.add_argument('--endpoint', action = 'append', required = True)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        entities = []
+        for ep in args.endpoint:
+            parts = ep.split(':', 2) + [ None, None ]
+            entities.append(OCSNDataFlowEntity(parts[0], parts[1], parts[2]))
+
+        if len(entities) < 2:
+            raise OCSNException(OCSNError.ERROR, 'a symmetric flow needs at least two endpoints')
+
+        id = args.group_id or gen_id('flowgroup')
+
+        f = OCSNDataFlowInstanceCtl(redis_client).append(id, OCSNSymmetricFlow(entities = entities), flow_id = args.flow_id)
+
+        print(dump_json(f.encode()))
+
     def modify(self):
         self._do_store(True, 'Modify a data flow', 'ocsn flow modify')
 
@@ -959,8 +1111,7 @@ The subcommands are:
 
         args = parser.parse_args(sys.argv[3:])
 
-        df = OCSNDataFlowInstance(id = args.group_id)
-        df.load(redis_client)
+        df = OCSNDataFlowInstanceCtl(redis_client).load_group(args.group_id) or OCSNDataFlowInstance(id = args.group_id)
 
         print(dump_json(df.encode()))
 
@@ -975,25 +1126,20 @@ The subcommands are:
 
         args = parser.parse_args(sys.argv[3:])
 
-        df = OCSNDataFlowInstance(id = args.group_id)
-        df.load(redis_client)
-
-        if df.pop(args.flow_id):
-            df.store(redis_client)
-        else:
-            df.remove(redis_client)
+        OCSNDataFlowInstanceCtl(redis_client).remove(args.group_id, args.flow_id)
 
     def verify(self):
 
         parser = argparse.ArgumentParser(
             description='Verify flows match vbucket requirements',
-            usage='ocsn flow verify')
+            usage='ocsn flow verify [--vectorized]')
 
         # parser.add_argument('--group-id', required = True)
         # parser.add_argument('--flow-id', required = True)
 
         parser.add_argument('--tenant-id')
         parser.add_argument('--user-id')
+        parser.add_argument('--vectorized', action = 'store_true', help = 'compute coverage with numpy array operations')
 
         args = parser.parse_args(sys.argv[3:])
 
@@ -1001,12 +1147,15 @@ The subcommands are:
 
         svc_cache = {}
 
+        matcher = OCSNFlowMatcher()
+        verifier = OCSNFlowVerifier(matcher)
+
         for b in uvb.list_opt():
-            if not b.mappings:
+            if not b.mappings and not b.hashed:
                 continue
 
             needed = []
-            for _, bid in b.mappings.bis.items():
+            for _, bid in itertools.chain.from_iterable(b.mapping_batches(redis_client)):
                 bi = OCSNBucketInstance(bid.svci_id, id = bid.bi_id)
                 bi.load(redis_client)
 
@@ -1030,30 +1179,17 @@ The subcommands are:
             if len(needed) < 2:
                 continue
 
-            missing = []
-
-            for subset in itertools.combinations(needed, 2):
-                missing.append([subset[0], subset[1]])
-                missing.append([subset[1], subset[0]])
+            verifier.add(b, needed)
 
-            exists = []
+        # only the flows leaving the endpoints being checked are needed
+        for df in OCSNDataFlowInstanceCtl(redis_client).list_from(e.svc_id for e in verifier.nodes):
+            matcher.add_instance(df)
 
-            df = OCSNDataFlowInstanceCtl(redis_client)
-            for f in df.list():
-                new_missing = []
+        results = verifier.run_vectorized() if args.vectorized else verifier.run()
 
-                for pair in missing:
-                    new_s = OCSNDataFlowEntityAlt(pair[0], svc_cache)
-                    new_d = OCSNDataFlowEntityAlt(pair[1], svc_cache)
-                    new_pair = [new_s, new_d]
-                    if f.check(pair[0], pair[1]):
-                        exists.append(new_pair)
-                    else:
-                        new_missing.append(new_pair)
-
-                missing = new_missing
-
-            df = OCSNDataFlowInstanceCtl(redis_client)
+        for b, exists, missing in results:
+            exists = [ [OCSNDataFlowEntityAlt(s, svc_cache), OCSNDataFlowEntityAlt(d, svc_cache)] for s, d in exists ]
+            missing = [ [OCSNDataFlowEntityAlt(s, svc_cache), OCSNDataFlowEntityAlt(d, svc_cache)] for s, d in missing ]
 
             print('Existing flows:' + dump_json([ [ s.encode(), d.encode() ] for s,d in exists ]))
             print('Missing flows:' + dump_json([ [ s.encode(), d.encode() ] for s,d in missing ]))
@@ -1064,36 +1200,249 @@ The subcommands are:
         #result = ([ e.encode() for e in uvb.list_opt() ])
         #print(dump_json(result))
 
+    def reach(self):
+
+        parser = argparse.ArgumentParser(
+            description='List endpoints downstream of a source',
+            usage='ocsn flow reach')
+
+        parser.add_argument('--source-svc-id', required = True)
+        parser.add_argument('--source-bucket')
+        parser.add_argument('--source-obj-prefix')
+        parser.add_argument('--dest-svc-id', help = 'only report endpoints on this service')
+
+        args = parser.parse_args(sys.argv[3:])
+
+        g = OCSNFlowGraph.build(OCSNDataFlowInstanceCtl(redis_client).list())
+
+        src = OCSNDataFlowEntity(args.source_svc_id, args.source_bucket, args.source_obj_prefix)
+
+        if args.dest_svc_id:
+            result = g.reaches_svc(src, args.dest_svc_id)
+        else:
+            result = g.downstream_entities(src)
+
+        print(dump_json([ e.encode() for e in result ]))
+
+    def cycles(self):
+
+        parser = argparse.ArgumentParser(
+            description='List replication cycles',
+            usage='ocsn flow cycles')
+
+        args = parser.parse_args(sys.argv[3:])
+
+        g = OCSNFlowGraph.build(OCSNDataFlowInstanceCtl(redis_client).list())
+
+        print(dump_json([ [ e.encode() for e in c ] for c in g.cycles() ]))
+
+
+class IndexCommand:
+    def __init__(self, env, args):
+        self.env = env
+        self.args = args
+
+    def parse(self):
+        parser = argparse.ArgumentParser(
+            description='OCSN control tool',
+            usage='''ocsn index <subcommand> [...]
+
+The subcommands are:
+   rebuild                       Rebuild the reverse reference indexes
+   created                       List entities created since a point in time
+''')
+        parser.add_argument('subcommand', help='Subcommand to run')
+        # parse_args defaults to [1:] for args, but you need to
+        # exclude the rest of the args too, or validation will fail
+        args = parser.parse_args(self.args[0:1])
+        if not hasattr(self, args.subcommand):
+            print('Unrecognized subcommand:', args.subcommand)
+            parser.print_help()
+            exit(1)
+        # use dispatch pattern to invoke method with same name
+        return getattr(self, args.subcommand)
+
+    def rebuild(self):
+
+        parser = argparse.ArgumentParser(
+            description='Rebuild the reverse reference indexes',
+            usage='ocsn index rebuild')
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+        count = idx.rebuild()
+
+        print(dump_json({'indexed': count}))
+
+    def created(self):
+
+        parser = argparse.ArgumentParser(
+            description='List entities created since a point in time',
+            usage='ocsn index created --type <type> [--since <time>] [--until <time>]')
+
+        parser.add_argument('--type', required = True,
+                            choices = [ p.rstrip('/') for p in entity_prefixes if p != 'dataflow/' ],
+                            help = 'entity key prefix (t, u, b, svc, svci, bi, creds, dflow)')
+        parser.add_argument('--since', help = 'epoch seconds or ISO 8601 time')
+        parser.add_argument('--until', help = 'epoch seconds or ISO 8601 time')
+        parser.add_argument('--limit', type = int)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        idx = OCSNIndexCtl(redis_client)
+        self.env.output.records({'created': format_time_ms(created), 'entity': e.encode()}
+                                for created, e in idx.created(args.type + '/', parse_time_arg(args.since),
+                                                              parse_time_arg(args.until), args.limit))
+
+
+class ChangesCommand:
+    def __init__(self, env, args):
+        self.env = env
+        self.args = args
+
+    def parse(self):
+        parser = argparse.ArgumentParser(
+            description='OCSN control tool',
+            usage='''ocsn changes <subcommand> [...]
+
+The subcommands are:
+   list                          List catalog changes since a version
+   follow                        Print catalog changes as they happen
+''')
+        parser.add_argument('subcommand', help='Subcommand to run')
+        # parse_args defaults to [1:] for args, but you need to
+        # exclude the rest of the args too, or validation will fail
+        args = parser.parse_args(self.args[0:1])
+        if not hasattr(self, args.subcommand):
+            print('Unrecognized subcommand:', args.subcommand)
+            parser.print_help()
+            exit(1)
+        # use dispatch pattern to invoke method with same name
+        return getattr(self, args.subcommand)
+
+    def list(self):
+
+        parser = argparse.ArgumentParser(
+            description='List catalog changes since a version',
+            usage='ocsn changes list [--since <version>] [--count N]')
+
+        parser.add_argument('--since')
+        parser.add_argument('--count', type = int, default = 100)
+
+        args = parser.parse_args(sys.argv[3:])
+
+        feed = OCSNChangeFeed(redis_client)
+        self.env.output.records(c.encode() for c in feed.read(args.since, args.count))
+
+    def follow(self):
+
+        parser = argparse.ArgumentParser(
+            description='Print catalog changes as they happen',
+            usage='ocsn changes follow [--since <version>] [--group <name> --consumer <name>]')
+
+        parser.add_argument('--since', default = '$')
+        parser.add_argument('--group')
+        parser.add_argument('--consumer')
+
+        args = parser.parse_args(sys.argv[3:])
+
+        def show(c):
+            print(json.dumps(c.encode()), flush = True)
+
+        if args.group:
+            consumer = OCSNChangeConsumer(redis_client, args.group, args.consumer or args.group,
+                                          start = args.since)
+            consumer.run(show)
+            return
+
+        for c in OCSNChangeFeed(redis_client).follow(args.since):
+            show(c)
+
+
+class OCSNEnv:
+    # options that apply to every command; they may appear anywhere on the
+    # command line and are taken out of sys.argv before the commands parse it
+    #
+    #   --profile[=DIR]   cProfile the command into DIR (or OCSN_PROFILE=DIR)
+    #   --trace           print the backend round trips, keys and bytes of
+    #                     the command, and any N+1 access pattern, to stderr
+    #   --format FORMAT   output as json (default), ndjson, compact or table;
+    #                     listings are streamed in every format
+    #
+    # OCSN_SLOW_MS / OCSN_SLOW_LOG log commands slower than the threshold
+    # together with the keys they touched
+    def __init__(self):
+        self.profile = os.environ.get('OCSN_PROFILE') or None
+        self.profiler = OCSNProfiler.env()
+        self.trace = False
+        self.output = output
+
+    def parse(self, argv):
+        rest = argv[:1]
+        args = iter(argv[1:])
+        for arg in args:
+            if arg == '--profile':
+                self.profile = self.profile or os.environ.get('OCSN_PROFILE_DIR') or 'ocsn-profiles'
+            elif arg.startswith('--profile='):
+                self.profile = arg.split('=', 1)[1]
+            elif arg == '--trace':
+                self.trace = True
+            elif arg == '--format':
+                self.output.format = next(args, None)
+            elif arg.startswith('--format='):
+                self.output.format = arg.split('=', 1)[1]
+            else:
+                rest.append(arg)
+        argv[:] = rest
+
+        if self.output.format not in OUTPUT_FORMATS:
+            print('Unknown output format: %s (one of %s)' % (self.output.format, ', '.join(OUTPUT_FORMATS)))
+            exit(1)
+
+        if self.profile:
+            self.profiler.out_dir = self.profile
+
+        return self
+
 
 class OCSNCommand:
 
     def __init__(self):
-        self.env = None
+        self.env = OCSNEnv()
 
     def _parse(self):
+        self.env.parse(sys.argv)
+
         parser = argparse.ArgumentParser(
             description='OCSN control tool',
-            usage='''ocsn <command> [<args>]
+            usage='''ocsn [--profile[=DIR]] [--trace] [--format {json,ndjson,compact,table}] <command> [<args>]
 
 The commands are:
    svc list             List services
    svc create           Create a service
    svc modify           Modify existing service
    svc remove           Remove a service
+   svc instances        List service instances of a service
    svci list            List service instances
    svci create          Create a service instance
    svci modify          Modify existing service instance
    svci info            Show service instance info
    svci remove          Remove a service instance
+   svci bis             List bucket instances of a service instance
+   svci creds           List credentials of a service instance
    creds list           List credentials
    creds create         Create credentials
    creds modify         Modify credentials
    creds remove         Remove credentials
+   creds bis            List bucket instances using credentials
+   creds lookup         Find credentials by access key
    bi list              List buckets
    bi create            Create a bucket instance
    bi modify            Modify a bucket instance
    bi info              Show bucket instance info
    bi remove            Remove a bucket instance
+   bi vbuckets          List vbuckets mapping a bucket instance
    tenant list          List tenants
    tenant create        Create tenant
    tenant modify        Modify tenant
@@ -1113,20 +1462,35 @@ The commands are:
    vbucket coninfo      Get info needed to create a connection
    flow list            List data flows
    flow create          Declare a new data flow
+   flow symmetric       Declare a symmetric (n-way) data flow
    flow modify          Modify a data flow
    flow info            Show data flow info
    flow remove          Remove data flow
+   flow verify          Verify flows match vbucket requirements
+   flow reach           List endpoints downstream of a source
+   flow cycles          List replication cycles
+   index rebuild        Rebuild the reverse reference indexes
+   index created        List entities created since a point in time
+   changes list         List catalog changes since a version
+   changes follow       Print catalog changes as they happen
+   loadgen              Generate read load against a running server
+   gen                  Generate a synthetic catalog
+   export               Export the catalog to a snapshot file
+   import               Import a catalog snapshot file
 ''')
         parser.add_argument('command', help='Subcommand to run')
         # parse_args defaults to [1:] for args, but you need to
         # exclude the rest of the args too, or validation will fail
         args = parser.parse_args(sys.argv[1:2])
-        if not hasattr(self, args.command) or args.command[0] == '_':
+        command = args.command
+        if keyword.iskeyword(command):
+            command += '_'
+        if not hasattr(self, command) or command[0] == '_':
             print('Unrecognized command:', args.command)
             parser.print_help()
             exit(1)
         # use dispatch pattern to invoke method with same name
-        ret = getattr(self, args.command)
+        ret = getattr(self, command)
         return ret
 
     def svc(self):
@@ -1161,13 +1525,123 @@ The commands are:
         cmd = FlowCommand(self.env, sys.argv[2:]).parse()
         cmd()
 
+    def index(self):
+        cmd = IndexCommand(self.env, sys.argv[2:]).parse()
+        cmd()
+
+    def changes(self):
+        cmd = ChangesCommand(self.env, sys.argv[2:]).parse()
+        cmd()
+
+    def loadgen(self):
+        parser = argparse.ArgumentParser(
+            description='Generate read load against a running server',
+            usage='ocsn loadgen [--url URL] [--rate N] [--duration SECS] [--mix svc=1,svci=1,user=2,coninfo=6]')
+
+        parser.add_argument('--url', default = 'http://127.0.0.1:5000')
+        parser.add_argument('--rate', type = float, default = 1000, help = 'requests per second (open loop)')
+        parser.add_argument('--duration', type = float, default = 10)
+        parser.add_argument('--connections', type = int, default = 64)
+        parser.add_argument('--timeout', type = float, default = 5)
+        parser.add_argument('--mix', default = 'svc=1,svci=1,user=2,coninfo=6')
+        parser.add_argument('--zipf', type = float, default = 1.1, help = 'zipf exponent of the key popularity')
+        parser.add_argument('--seed', type = int, default = 1)
+        parser.add_argument('--max-keys', type = int, default = 100000, help = 'keys sampled per request kind')
+
+        args = parser.parse_args(sys.argv[2:])
+
+        gen = OCSNLoadGen(redis_client, args.url, parse_mix(args.mix), args.zipf, args.seed, args.max_keys)
+        report = gen.run(args.rate, args.duration, args.connections, args.timeout)
+
+        print(dump_json(report))
+
+    def gen(self):
+        parser = argparse.ArgumentParser(
+            description='Generate a synthetic catalog',
+            usage='ocsn gen [--seed N] [--tenants N] [--users A-B] ... [--output FILE]')
+
+        # per-parent counts take a fixed number or a low-high range
+        parser.add_argument('--seed', type = int, default = 1)
+        parser.add_argument('--services', type = int, default = 10)
+        parser.add_argument('--svcis', default = '1-3', help = 'service instances per service')
+        parser.add_argument('--bis', default = '10-100', help = 'bucket instances per service instance')
+        parser.add_argument('--creds', default = '1-2', help = 'credentials per service instance')
+        parser.add_argument('--tenants', type = int, default = 100)
+        parser.add_argument('--users', default = '1-10', help = 'users per tenant')
+        parser.add_argument('--vbuckets', default = '1-10', help = 'vbuckets per user')
+        parser.add_argument('--mappings', default = '1-3', help = 'bucket instance mappings per vbucket')
+        parser.add_argument('--flow-groups', type = int, default = 10)
+        parser.add_argument('--flows', default = '1-20', help = 'flows per flow group')
+        parser.add_argument('--output', help = 'write a snapshot file (- for stdout) instead of the backend')
+        parser.add_argument('--compress', action = 'store_true')
+        parser.add_argument('--batch-size', type = int, default = 1000)
+
+        args = parser.parse_args(sys.argv[2:])
+
+        g = OCSNCatalogGen(seed = args.seed, services = args.services, svcis = parse_range(args.svcis),
+                           bis = parse_range(args.bis), creds = parse_range(args.creds),
+                           tenants = args.tenants, users = parse_range(args.users),
+                           vbuckets = parse_range(args.vbuckets), mappings = parse_range(args.mappings),
+                           flow_groups = args.flow_groups, flows = parse_range(args.flows))
+
+        start = time.time()
+
+        if args.output:
+            with open_snapshot(args.output, 'w', args.compress) as out:
+                count = write_records(out, g.records())
+        else:
+            count = OCSNSnapshot(redis_client).load_records(g.records(), args.batch_size)
+
+        print('generated %d entities in %.2fs' % (count, time.time() - start), file = sys.stderr)
+
+    def export(self):
+        parser = argparse.ArgumentParser(
+            description='Export the catalog to a snapshot file',
+            usage='ocsn export [--output FILE] [--compress]')
+
+        parser.add_argument('--output', default = '-')
+        parser.add_argument('--compress', action = 'store_true')
+        parser.add_argument('--batch-size', type = int, default = 1000)
+
+        args = parser.parse_args(sys.argv[2:])
+
+        start = time.time()
+
+        with open_snapshot(args.output, 'w', args.compress) as out:
+            count = OCSNSnapshot(redis_client).export(out, args.batch_size)
+
+        print('exported %d entities in %.2fs' % (count, time.time() - start), file = sys.stderr)
+
+    def import_(self):
+        parser = argparse.ArgumentParser(
+            description='Import a catalog snapshot file',
+            usage='ocsn import [--input FILE]')
+
+        parser.add_argument('--input', default = '-')
+        parser.add_argument('--batch-size', type = int, default = 1000)
+
+        args = parser.parse_args(sys.argv[2:])
+
+        start = time.time()
+
+        with open_snapshot(args.input, 'r') as f:
+            count = OCSNSnapshot(redis_client).load(f, args.batch_size)
+
+        print('imported %d entities in %.2fs' % (count, time.time() - start), file = sys.stderr)
+
 def main():
-    cmd = OCSNCommand()._parse()
+    ocsn = OCSNCommand()
+    cmd = ocsn._parse()
+    env = ocsn.env
     try:
-        cmd()
+        with env.profiler.run(' '.join(sys.argv[1:3]), profile = bool(env.profile)) as t:
+            cmd()
     except OCSNException as e:
         print('ERROR: ' + e.desc)
 
+    if env.trace:
+        print('trace: ' + dump_json(t.summary()), file = sys.stderr)
+
 
 
 if __name__ == "__main__":
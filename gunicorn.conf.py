@@ -0,0 +1,16 @@
+# gunicorn -c gunicorn.conf.py
+
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count()
+threads = 4
+
+# load the app once in the master; backend connections are opened per
+# worker in post_fork and the catalog is warmed before accepting requests
+preload_app = True
+wsgi_app = 'server:create_app(warm=False)'
+
+
+def post_fork(server, worker):
+    server.app.wsgi().extensions['ocsn'].warm()
@@ -0,0 +1,211 @@
+import time
+
+from abc import abstractmethod
+from urllib.parse import urlparse, parse_qs
+
+from .ocsn_err import *
+
+
+CHANGEFEED_KEY = 'changefeed'
+CHANGEFEED_MAXLEN = 100000
+
+def change_record(key, op):
+    # the version of a change is assigned by the backend when it is appended
+    return {'type': key.split('/', 1)[0], 'key': key, 'op': op}
+
+
+class OCSNBackend:
+
+    @abstractmethod
+    def get(self, key):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_many(self, keys):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def put(self, key, data, exclusive = None, only_modify = None):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def put_many(self, items):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove(self, key):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def unlink(self, keys):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def key_batches(self, prefix = '', batch_size = 1000):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def update_refs(self, add = None, remove = None):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_refs(self, index):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def update_scores(self, add = None, remove = None):
+        # add: (index, member, score) triples, remove: (index, member) pairs
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_scores(self, index, low = None, high = None, limit = None):
+        # (member, score) pairs with low <= score <= high, by ascending score
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_put(self, key, fields):
+        # sets {field: value} in the hash at key
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_get(self, key, fields):
+        # values of fields in the hash at key, None for missing ones
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_remove(self, key, fields):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_swap(self, key, field, value):
+        # sets field to value, or removes it when value is None, and returns
+        # the value it had before, in one atomic step
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_incr(self, key, field, amount = 1, drop = False):
+        # adds amount to the integer value of field, returns the new value;
+        # with drop, a field that ends up at zero or below is removed in the
+        # same atomic step
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_len(self, key):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def hash_batches(self, key, batch_size = 1000):
+        # (field, value) pairs of the hash at key, incrementally; entries
+        # changed while scanning may or may not be seen
+        raise NotImplementedError()
+
+    @abstractmethod
+    def append_changes(self, records):
+        # appends change_record()s to the capped change feed, returns their versions
+        raise NotImplementedError()
+
+    @abstractmethod
+    def last_change(self):
+        # version of the newest change, None if the feed is empty
+        raise NotImplementedError()
+
+    @abstractmethod
+    def read_changes(self, after = None, count = 100, block = None):
+        # (version, record) pairs newer than after (from the oldest retained
+        # change if None), waiting up to block ms for one if there are none
+        raise NotImplementedError()
+
+    @abstractmethod
+    def create_change_group(self, group, start = '$'):
+        # start is '$' (only new changes), '0' (all retained) or a version;
+        # an existing group is left as is
+        raise NotImplementedError()
+
+    @abstractmethod
+    def read_change_group(self, group, consumer, count = 100, block = None, pending_after = None):
+        # next undelivered changes of the group, now pending for consumer; with
+        # pending_after, the changes already pending for consumer past that
+        # version instead
+        raise NotImplementedError()
+
+    @abstractmethod
+    def ack_changes(self, group, versions):
+        raise NotImplementedError()
+
+    def keys(self, prefix = ''):
+        for batch in self.key_batches(prefix):
+            for k in batch:
+                yield k
+
+    def list(self, prefix = ''):
+        for keys in self.key_batches(prefix):
+            for item in self.get_many(keys):
+                if item is not None:
+                    yield item
+
+    def unlink_many(self, keys, batch_size = 1000, throttle = None, op = None):
+        # unlink in batches, optionally sleeping between batches so that a
+        # large delete does not monopolize the server; with op set, each
+        # unlinked key is also published to the change feed
+        count = 0
+        batch = []
+        for k in keys:
+            batch.append(k)
+            if len(batch) < batch_size:
+                continue
+
+            self._unlink_batch(batch, op)
+            count += len(batch)
+            batch = []
+            if throttle:
+                time.sleep(throttle)
+
+        self._unlink_batch(batch, op)
+        return count + len(batch)
+
+    def _unlink_batch(self, keys, op):
+        self.unlink(keys)
+        if op and keys:
+            self.append_changes([ change_record(k, op) for k in keys ])
+
+
+def parse_host_port(s, default_port = 6379):
+    host, _, port = s.partition(':')
+    return host, int(port or default_port)
+
+def open_backend(url = None):
+    # redis://host:port/db (default), redis+cluster://host:port for a
+    # Redis Cluster seed node, or sqlite:///path/to/file.db
+    #
+    # redis URLs may add read replicas and a routing policy:
+    #   redis://primary:6379/0?replica=r1:6379&replica=r2:6379&read_policy=least-latency&sticky=5
+    #
+    # all of them take changefeed_maxlen=N to size the change feed
+    if not url:
+        url = 'redis://localhost:6379/0'
+
+    u = urlparse(url)
+    q = parse_qs(u.query)
+    maxlen = int(q.get('changefeed_maxlen', [ CHANGEFEED_MAXLEN ])[0])
+
+    if u.scheme == 'redis':
+        from .redis_client import RedisClient, STICKY_DEFAULT
+        db = int(u.path.strip('/') or 0)
+        sticky = q.get('sticky')
+        return RedisClient(host = u.hostname or 'localhost', port = u.port or 6379, db = db,
+                           replicas = [ parse_host_port(r) for r in q.get('replica', []) ],
+                           read_policy = q.get('read_policy', [ 'round-robin' ])[0],
+                           sticky = float(sticky[0]) if sticky else STICKY_DEFAULT,
+                           changefeed_maxlen = maxlen)
+
+    if u.scheme == 'redis+cluster':
+        from .cluster_client import RedisClusterClient
+        return RedisClusterClient(host = u.hostname or 'localhost', port = u.port or 6379,
+                                  changefeed_maxlen = maxlen)
+
+    if u.scheme == 'sqlite':
+        from .sqlite_client import SQLiteClient
+        return SQLiteClient(u.path or ':memory:', changefeed_maxlen = maxlen)
+
+    raise OCSNException(OCSNError.ERROR, 'unsupported backend: ' + url)
+
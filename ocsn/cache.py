@@ -0,0 +1,75 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class OCSNCache:
+    def __init__(self, ttl, max_entries = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.deps = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        for dep in entry[2]:
+            keys = self.deps.get(dep)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.deps[dep]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, deps = ()):
+        # deps are the entity keys the value was built from, see invalidate_dep()
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, value, tuple(deps))
+            for dep in deps:
+                self.deps.setdefault(dep, set()).add(key)
+
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate(self, key):
+        with self.lock:
+            self._drop(key)
+
+    def invalidate_dep(self, dep):
+        with self.lock:
+            for key in list(self.deps.get(dep, ())):
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.deps.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': (self.hits / total) if total else 0.0,
+                    }
+
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from .ocsn_types import *
+from .redis_client import *
+from .singleflight import OCSNSingleFlight
+
+
+class OCSNCatalog:
+    # in-process copy of the service and service instance catalog, loaded
+    # in one pipelined pass and reloaded once it is older than ttl seconds;
+    # once attached, entries are also dropped as they change (see attach())
+    def __init__(self, client, ttl = 60):
+        self.client = client
+        self.flight = OCSNSingleFlight()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.services = {}
+        self.service_instances = {}
+        self.loaded = None
+
+    def _load(self, prefix, T, batch_size):
+        result = {}
+        for keys in self.client.key_batches(prefix, batch_size):
+            for k, item in zip(keys, self.client.get_many(keys)):
+                e = T().decode_json(item)
+                if e:
+                    result[e.id] = e
+        return result
+
+    def warm(self, batch_size = 1000):
+        services = self._load(OCSNService.get_prefix(), OCSNService, batch_size)
+        service_instances = self._load(OCSNServiceInstance.get_prefix(), OCSNServiceInstance, batch_size)
+
+        with self.lock:
+            self.services = services
+            self.service_instances = service_instances
+            self.loaded = time.monotonic()
+
+        return len(services) + len(service_instances)
+
+    def _stale(self):
+        return self.loaded is None or time.monotonic() - self.loaded > self.ttl
+
+    def _fresh(self):
+        # one reload per expiry: the other threads wait for it, and a thread
+        # that checked just before it completed does not start another one
+        if self._stale():
+            self.flight.do('catalog', lambda: self.warm() if self._stale() else None)
+
+    def _get(self, attr, e):
+        self._fresh()
+
+        # looked up after _fresh(), which swaps in new dicts on a reload
+        result = getattr(self, attr).get(e.id)
+        if result is None:
+            # a key missing from a fresh catalog is typically being asked
+            # for by many requests at once
+            result = self.flight.do(e.get_key(), lambda: e.load(self.client))
+            if result is not None:
+                with self.lock:
+                    getattr(self, attr)[e.id] = result
+
+        return result
+
+    def service(self, svc_id):
+        return self._get('services', OCSNService(id = svc_id))
+
+    def service_instance(self, svci_id):
+        return self._get('service_instances', OCSNServiceInstance(id = svci_id))
+
+    def attach(self):
+        add_mutation_listener(self._on_mutation)
+        return self
+
+    def detach(self):
+        remove_mutation_listener(self._on_mutation)
+
+    def _on_mutation(self, key, op):
+        # a changed service or service instance is dropped and loaded again
+        # on its next lookup; listeners that rebuild from the catalog have to
+        # be attached after it so that they never see the old copy
+        e = entity_for_key(key)
+        if isinstance(e, (OCSNService, OCSNServiceInstance)):
+            self.invalidate(e)
+
+    def update(self, e):
+        with self.lock:
+            if isinstance(e, OCSNService):
+                self.services[e.id] = e
+            elif isinstance(e, OCSNServiceInstance):
+                self.service_instances[e.id] = e
+
+    def invalidate(self, e):
+        with self.lock:
+            if isinstance(e, OCSNService):
+                self.services.pop(e.id, None)
+            elif isinstance(e, OCSNServiceInstance):
+                self.service_instances.pop(e.id, None)
+
@@ -0,0 +1,158 @@
+import sys
+import threading
+
+from .ocsn_types import *
+
+
+class OCSNChange(OCSNEntity):
+    def __init__(self, version = None, type = None, key = None, op = None):
+        self.version = version
+        self.type = type
+        self.key = key
+        self.op = op
+
+    def encode(self):
+        return {'version': self.version,
+                'type': self.type,
+                'key': self.key,
+                'op': self.op,
+                }
+
+    def decode(self, d):
+        self.version = d.get('version')
+        self.type = d.get('type')
+        self.key = d.get('key')
+        self.op = d.get('op')
+        return self
+
+    def from_record(version, record):
+        return OCSNChange(version, record.get('type'), record.get('key'), record.get('op'))
+
+    def get_key(self):
+        return self.key
+
+
+class OCSNChangeFeed:
+    # Reader of the change feed every store()/remove() appends to. Versions
+    # are opaque, ordered per backend, and resuming from the last version
+    # seen picks up exactly where the reader stopped, as long as the
+    # change was not trimmed from the capped feed yet.
+    def __init__(self, client):
+        self.client = client
+
+    def latest(self):
+        return self.client.last_change()
+
+    def read(self, since = None, count = 100, block = None):
+        return [ OCSNChange.from_record(v, r) for v, r in self.client.read_changes(since, count, block) ]
+
+    def follow(self, since = None, count = 100, block = 1000):
+        # endless generator of changes after since ('$' for only new ones)
+        if since == '$':
+            since = self.latest()
+
+        while True:
+            changes = self.read(since, count, block)
+            for c in changes:
+                since = c.version
+                yield c
+
+
+class OCSNChangeWatcher:
+    # Follows the change feed in a background thread and hands every change
+    # to the mutation listeners (see add_mutation_listener()), so that the
+    # caches of this process are also evicted on writes made by other
+    # processes: CLI runs, other server workers. Writes made by this process
+    # already evicted synchronously and come back as a harmless second
+    # eviction. Feed errors are retried, resuming after the last change seen.
+    def __init__(self, client, block = 1000, retry = 1.0):
+        self.feed = OCSNChangeFeed(client)
+        self.block = block
+        self.retry = retry
+        self.stopped = threading.Event()
+        self.thread = None
+        self.seen = 0
+
+    def start(self):
+        since = self.feed.latest()
+        self.thread = threading.Thread(target = self._run, args = (since,), daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self, since):
+        while not self.stopped.is_set():
+            try:
+                for c in self.feed.read(since, block = self.block):
+                    since = c.version
+                    self.seen += 1
+                    if c.key is not None:
+                        notify_mutation(c.key, c.op)
+            except Exception as e:
+                print('change feed watcher: %s' % e, file = sys.stderr)
+                self.stopped.wait(self.retry)
+
+
+class OCSNChangeConsumer:
+    # Member of a consumer group: each change is handed to one consumer of
+    # the group and stays pending until acked. A consumer that restarts under
+    # the same name first gets back what it had pending, so nothing read
+    # before a crash is lost.
+    def __init__(self, client, group, consumer, start = '$'):
+        self.client = client
+        self.group = group
+        self.consumer = consumer
+        self.pending_after = '0'
+
+        client.create_change_group(group, start)
+
+    def read(self, count = 100, block = None):
+        if self.pending_after is not None:
+            result = self.client.read_change_group(self.group, self.consumer, count,
+                                                   pending_after = self.pending_after)
+            if result:
+                self.pending_after = result[-1][0]
+                return [ OCSNChange.from_record(v, r) for v, r in result ]
+
+            self.pending_after = None
+
+        result = self.client.read_change_group(self.group, self.consumer, count, block)
+        return [ OCSNChange.from_record(v, r) for v, r in result ]
+
+    def ack(self, changes):
+        self.client.ack_changes(self.group, [ c.version for c in changes ])
+
+    def run(self, fn, count = 100, block = 1000):
+        # calls fn(change) for every change and acks it once fn returns
+        while True:
+            changes = self.read(count, block)
+            for c in changes:
+                if c.key is not None:
+                    fn(c)
+            self.ack(changes)
+
+
+class OCSNChangeFilter:
+    # selects changes by key prefix and/or tenant (the tenant itself, its
+    # users and its vbuckets); no criteria matches everything
+    def __init__(self, prefixes = None, tenant_id = None):
+        self.keys = set()
+        self.prefixes = list(prefixes or [])
+
+        if tenant_id:
+            self.keys.add(OCSNTenant(id = tenant_id).get_key())
+            self.prefixes += [ OCSNUser(tenant_id).get_prefix() + '/',
+                               OCSNVBucket(tenant_id, None).get_prefix_opt() ]
+
+        self.prefixes = tuple(self.prefixes)
+
+    def match(self, change):
+        if not self.keys and not self.prefixes:
+            return True
+
+        if change.key is None:
+            return False
+
+        return change.key in self.keys or change.key.startswith(self.prefixes)
@@ -0,0 +1,148 @@
+import queue
+import threading
+
+from redis.cluster import RedisCluster
+
+from .ocsn_err import *
+from .backend import CHANGEFEED_MAXLEN
+from .redis_client import RedisClient
+from .trace import trace_op, trace_recv
+
+
+# position of the key segment that becomes the hash tag: the tenant for
+# t/, u/ and b/, the service instance for svci/, bi/ and creds/, and the
+# owning entity for index keys (idx/<name>/<id>/...), so that a tenant's
+# users, vbuckets and vbucket mapping hashes (bmap/<t>/<u>/<vb>), and a
+# service instance's bis, creds and their indexes all hash to the same slot
+TAG_SEGMENT = { 'idx': 2 }
+DEFAULT_TAG_SEGMENT = 1
+
+
+def tag_segment(parts):
+    return TAG_SEGMENT.get(parts[0], DEFAULT_TAG_SEGMENT)
+
+def tag_key(key, prefix = False):
+    parts = key.split('/')
+    i = tag_segment(parts)
+    if len(parts) <= i or not parts[i]:
+        return key
+
+    if prefix and len(parts) == i + 1:
+        # trailing partial segment of a scan prefix; keep it open so the
+        # match still covers every id starting with it
+        parts[i] = '{' + parts[i]
+    else:
+        parts[i] = '{' + parts[i] + '}'
+
+    return '/'.join(parts)
+
+def untag_key(key):
+    parts = key.split('/')
+    i = tag_segment(parts)
+    if len(parts) > i and parts[i].startswith('{') and parts[i].endswith('}'):
+        parts[i] = parts[i][1:-1]
+
+    return '/'.join(parts)
+
+
+class RedisClusterClient(RedisClient):
+    def __init__(self, host = 'localhost', port = 6379, scan_threads = 8,
+                 changefeed_maxlen = CHANGEFEED_MAXLEN):
+        super().__init__(host = host, port = port, changefeed_maxlen = changefeed_maxlen)
+        # the cluster client routes by slot itself, no replica reads
+        self.client = RedisCluster(host=host, port=port)
+        self.scan_threads = scan_threads
+
+    def physical_key(self, key):
+        return tag_key(key)
+
+    def physical_prefix(self, prefix):
+        return tag_key(prefix, prefix = True)
+
+    def logical_key(self, key):
+        return untag_key(key)
+
+    def unlink(self, keys):
+        if not keys:
+            return
+
+        # a pipeline lets the cluster client group the keys by slot
+        p = self.client.pipeline()
+        for k in keys:
+            p.unlink(self.physical_key(k))
+        p.execute()
+
+    def _scan_nodes(self, prefix):
+        match = self.physical_prefix(prefix)
+        if '}' in match:
+            # the prefix pins the hash tag, only one node can hold the keys
+            return [ self.client.get_node_from_key(match) ]
+
+        return self.client.get_primaries()
+
+    def key_batches(self, prefix = '', batch_size = 1000):
+        nodes = self._scan_nodes(prefix)
+        match = self.physical_prefix(prefix) + '*'
+
+        # scan all nodes in parallel, handing each SCAN page back through a
+        # bounded queue; pages are traced here, in the caller's context.
+        # The scan threads give up once the caller stops iterating.
+        q = queue.Queue(maxsize = len(nodes) * 2)
+        done = object()
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout = 0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def scan(node):
+            try:
+                conn = self.client.get_redis_connection(node)
+                cursor = 0
+                while True:
+                    cursor, keys = conn.scan(cursor, match = match, count = batch_size)
+                    if not put(keys) or cursor == 0:
+                        break
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        pending = list(nodes)
+        running = 0
+        batch = []
+
+        def start_more():
+            nonlocal running
+            while pending and running < self.scan_threads:
+                threading.Thread(target = scan, args = (pending.pop(),), daemon = True).start()
+                running += 1
+
+        try:
+            start_more()
+            while running:
+                item = q.get()
+                if item is done:
+                    running -= 1
+                    start_more()
+                    continue
+
+                if isinstance(item, Exception):
+                    raise OCSNException(OCSNError.ERROR, 'cluster scan failed: ' + str(item))
+
+                trace_op('scan', [ prefix + '*' ])
+                for k in trace_recv(item):
+                    batch.append(self.logical_key(k.decode()))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+
+            if batch:
+                yield batch
+        finally:
+            stop.set()
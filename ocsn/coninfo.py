@@ -0,0 +1,104 @@
+import itertools
+
+from .ocsn_types import *
+from .redis_client import *
+
+
+class OCSNConInfoCtl:
+    # cache, if set, is an OCSNCache holding results in process memory only;
+    # entries carry the keys they were built from and are evicted when any
+    # of them is stored or removed (see attach())
+    def __init__(self, client, cache = None, catalog = None):
+        self.client = client
+        self.cache = cache
+        self.catalog = catalog
+
+    def attach(self):
+        if self.cache:
+            add_mutation_listener(self._on_mutation)
+        return self
+
+    def detach(self):
+        if self.cache:
+            remove_mutation_listener(self._on_mutation)
+
+    def _on_mutation(self, key, op):
+        self.cache.invalidate_dep(key)
+
+    def _service_instance(self, svci_id):
+        if self.catalog:
+            return self.catalog.service_instance(svci_id)
+        return OCSNServiceInstance(id = svci_id).load(self.client)
+
+    def _service(self, svc_id):
+        if self.catalog:
+            return self.catalog.service(svc_id)
+        return OCSNService(id = svc_id).load(self.client)
+
+    def _build(self, tenant_id, user_id, vbucket_id):
+        tenant = OCSNTenant(tenant_id)
+        vb = OCSNVBucket(tenant_id, user_id, id = vbucket_id)
+
+        deps = [ tenant.get_key(), vb.get_key() ]
+        result = []
+
+        if not tenant.load(self.client) or not vb.load(self.client):
+            return result, deps
+
+        if (not vb.mappings or not vb.mappings.bis) and not vb.hashed:
+            return result, deps
+
+        for _, bid in itertools.chain.from_iterable(vb.mapping_batches(self.client)):
+            d = {}
+
+            deps.append(OCSNServiceInstance(id = bid.svci_id).get_key())
+            svci = self._service_instance(bid.svci_id)
+            if not svci:
+                continue
+
+            if not tenant.check_policy(svci.svc_id):
+                continue
+
+            deps.append(OCSNService(id = svci.svc_id).get_key())
+            svc = self._service(svci.svc_id)
+
+            bi = OCSNBucketInstance(bid.svci_id, id = bid.bi_id)
+            deps.append(bi.get_key())
+            if not svc or not bi.load(self.client):
+                continue
+
+            creds = OCSNS3Creds(svci.id, bi.creds_id)
+            if bi.creds_id:
+                deps.append(creds.get_key())
+                creds.load(self.client)
+
+            conn = {
+                     'endpoint': svc.endpoint,
+                     'creds': {
+                         'access_key': creds.access_key,
+                         'secret': creds.secret,
+                      },
+                   }
+            d['connection'] = conn
+            d['bucket'] = bi.bucket
+            d['obj_prefix'] = bi.obj_prefix
+
+            result.append(d)
+
+        return result, deps
+
+    def get(self, tenant_id, user_id, vbucket_id):
+        key = (tenant_id, user_id, vbucket_id)
+
+        if self.cache:
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+        result, deps = self._build(tenant_id, user_id, vbucket_id)
+
+        if self.cache:
+            self.cache.put(key, result, deps)
+
+        return result
+
@@ -0,0 +1,119 @@
+from .ocsn_types import *
+from .redis_client import *
+
+
+class OCSNDataFlowInstanceCtl:
+    # Flow groups are read back as OCSNDataFlowInstance, assembled from the
+    # per-flow records (OCSNDataFlow) listed by the group index. Groups
+    # still stored as a single dataflow/<id> document are read as they are
+    # and moved to per-flow records the first time they are edited.
+    def __init__(self, client):
+        self.client = client
+
+    def _group_ids(self):
+        return set(k[len(DFLOW_GROUP_INDEX_PREFIX):] for k in self.client.keys(DFLOW_GROUP_INDEX_PREFIX))
+
+    def _add_flows(self, keys, groups):
+        keys = sorted(keys)
+        for item in self.client.get_many(keys):
+            if item is None:
+                continue
+
+            f = OCSNDataFlow().decode_json(item)
+            df = groups.get(f.group_id)
+            if df is None:
+                df = groups[f.group_id] = OCSNDataFlowInstance(f.group_id)
+            f.add_to(df)
+
+        return groups
+
+    def load_group(self, group_id):
+        df = OCSNDataFlowInstance(group_id)
+        df.load(self.client)
+
+        keys = self.client.get_refs(dflow_group_index(group_id))
+        self._add_flows(keys, { group_id: df })
+
+        if not df.flows and not df.symmetric:
+            return None
+
+        return df
+
+    def list(self):
+        group_ids = self._group_ids()
+
+        for item in self.client.list(OCSNDataFlowInstance.get_prefix()):
+            df = OCSNDataFlowInstance().decode_json(item)
+            if df.id in group_ids:
+                group_ids.discard(df.id)
+                self._add_flows(self.client.get_refs(dflow_group_index(df.id)), { df.id: df })
+            yield df
+
+        for group_id in sorted(group_ids):
+            df = self.load_group(group_id)
+            if df:
+                yield df
+
+    def list_from(self, svc_ids):
+        # only the flows leaving one of svc_ids (for symmetric flows: having
+        # a member on one of them), grouped; unmigrated groups come whole
+        keys = set()
+        for svc_id in set(svc_ids):
+            keys.update(self.client.get_refs(dflow_source_index(svc_id)))
+
+        for item in self.client.list(OCSNDataFlowInstance.get_prefix()):
+            yield OCSNDataFlowInstance().decode_json(item)
+
+        groups = self._add_flows(keys, {})
+        for group_id in sorted(groups):
+            yield groups[group_id]
+
+    def _migrate(self, group_id):
+        df = OCSNDataFlowInstance(group_id)
+        if df.load(self.client) is None:
+            return
+
+        records = [ OCSNDataFlow(group_id, flow_id, flow)
+                    for flows in (df.flows, df.symmetric) for flow_id, flow in (flows or {}).items() ]
+
+        self.client.put_many([ (f.get_key(), f.encode_json()) for f in records ])
+        self.client.update_refs(add = [ ref for f in records for ref in f.get_refs() ])
+        self.client.append_changes([ change_record(f.get_key(), 'store') for f in records ])
+
+        df.remove(self.client)
+
+    def append(self, group_id, flow, flow_id = None, retries = 5):
+        self._migrate(group_id)
+
+        if flow_id:
+            # an explicit id adds or replaces that flow; it is tried
+            # exclusively first so that a new one gets its created score
+            f = OCSNDataFlow(group_id, flow_id, self._with_id(flow, flow_id))
+            if not f.store(self.client, exclusive = True):
+                f.store(self.client)
+            return f
+
+        # a new flow goes in exclusively, which also gives it its created
+        # score; a collision of the generated id is retried with a fresh one
+        for _ in range(retries + 1):
+            flow_id = group_id + '/' + new_ulid()
+            f = OCSNDataFlow(group_id, flow_id, self._with_id(flow, flow_id))
+            if f.store(self.client, exclusive = True):
+                return f
+
+        raise OCSNException(OCSNError.ERROR, 'could not allocate a unique id for a flow of ' + group_id)
+
+    def _with_id(self, flow, flow_id):
+        if isinstance(flow, OCSNSymmetricFlow):
+            flow.id = flow_id
+        return flow
+
+    def remove(self, group_id, flow_id):
+        self._migrate(group_id)
+
+        f = OCSNDataFlow(group_id, flow_id)
+        if f.load(self.client) is None:
+            return False
+
+        f.remove(self.client)
+        return True
@@ -0,0 +1,265 @@
+from .ocsn_types import *
+from .flowmatch import OCSNFlowMatcher
+
+
+def bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class OCSNFlowGraph:
+    # Replication graph between concrete (svc, bucket, prefix) endpoints.
+    #
+    # Nodes are interned to integers and adjacency is kept as one int
+    # bitset per node. Flows with wildcard sources do not name a node of
+    # their own: they connect every concrete endpoint they match, which is
+    # resolved through OCSNFlowMatcher when the node is first expanded.
+    # Expansion is capped at max_nodes in case wildcard flows keep
+    # producing new endpoints.
+    #
+    # A symmetric group becomes a single virtual hub node linked to and
+    # from each of its members, n edges each way instead of n*(n-1);
+    # hubs never show up in query results.
+    def __init__(self, matcher, max_nodes = 1000000):
+        self.matcher = matcher
+        self.max_nodes = max_nodes
+        self.ids = {}
+        self.nodes = []
+        self.adj = []
+        self.expanded = []
+        self.virtual = 0
+
+    def build(df_list, max_nodes = 1000000):
+        matcher = OCSNFlowMatcher()
+        literal = []
+        for df in df_list:
+            matcher.add_instance(df)
+            for flow in (df.flows or {}).values():
+                for e in (flow.source, flow.dest):
+                    if not e.is_pattern():
+                        literal.append(e)
+            for flow in (df.symmetric or {}).values():
+                literal += [ e for e in (flow.entities or []) if not e.is_pattern() ]
+
+        g = OCSNFlowGraph(matcher, max_nodes)
+        for e in literal:
+            g.intern(e)
+        g.expand_all()
+        return g
+
+    def _hub(self, flow_id):
+        n = self.intern(self.matcher.sym_groups[flow_id], '\1' + flow_id)
+        self.virtual |= 1 << n
+        return n
+
+    def intern(self, entity, k = None):
+        if k is None:
+            k = entity.get_flow_key()
+        n = self.ids.get(k)
+        if n is not None:
+            return n
+
+        if len(self.nodes) >= self.max_nodes:
+            raise OCSNException(OCSNError.ERROR, 'flow graph exceeds %d nodes' % self.max_nodes)
+
+        n = len(self.nodes)
+        self.ids[k] = n
+        self.nodes.append(entity)
+        self.adj.append(0)
+        self.expanded.append(False)
+        return n
+
+    def node_id(self, entity):
+        return self.ids.get(entity.get_flow_key())
+
+    def _expand(self, n):
+        if self.expanded[n]:
+            return self.adj[n]
+
+        self.expanded[n] = True
+        mask = 0
+        node = self.nodes[n]
+
+        if isinstance(node, OCSNSymmetricFlow):
+            for e in (node.entities or []):
+                if not e.is_pattern():
+                    mask |= 1 << self.intern(e)
+        else:
+            for d in self.matcher.dests(node):
+                mask |= 1 << self.intern(d)
+            for flow_id in self.matcher.symmetric_groups(node):
+                mask |= 1 << self._hub(flow_id)
+
+        self.adj[n] = mask
+        return mask
+
+    def expand_all(self):
+        n = 0
+        while n < len(self.nodes):
+            self._expand(n)
+            n += 1
+
+    def downstream(self, source):
+        # bitset of every node reachable from source (not including itself
+        # unless it sits on a cycle)
+        start = self.intern(source)
+        seen = 0
+        frontier = self._expand(start)
+        while frontier:
+            seen |= frontier
+            next_frontier = 0
+            for n in bits(frontier):
+                next_frontier |= self._expand(n)
+            frontier = next_frontier & ~seen
+        return seen
+
+    def downstream_entities(self, source):
+        return [ self.nodes[n] for n in bits(self.downstream(source) & ~self.virtual) ]
+
+    def reaches(self, source, dest):
+        n = self.node_id(dest)
+        if n is None:
+            return False
+        return bool(self.downstream(source) >> n & 1)
+
+    def reaches_svc(self, source, svc_id):
+        return [ e for e in self.downstream_entities(source) if e.svc_id == svc_id ]
+
+    def closure(self):
+        # reachability of every node, computed per strongly connected
+        # component only when one of its nodes is looked up
+        self.expand_all()
+        return OCSNFlowClosure(self)
+
+    def components(self):
+        # iterative Tarjan
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        comps = []
+        comp_of = [ None ] * len(self.nodes)
+        counter = 0
+
+        for root in range(len(self.nodes)):
+            if root in index:
+                continue
+
+            work = [ (root, iter(list(bits(self.adj[root])))) ]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                n, it = work[-1]
+                advanced = False
+                for m in it:
+                    if m not in index:
+                        index[m] = low[m] = counter
+                        counter += 1
+                        stack.append(m)
+                        on_stack.add(m)
+                        work.append((m, iter(list(bits(self.adj[m])))))
+                        advanced = True
+                        break
+                    if m in on_stack:
+                        low[n] = min(low[n], index[m])
+
+                if advanced:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[n])
+
+                if low[n] == index[n]:
+                    members = []
+                    while True:
+                        m = stack.pop()
+                        on_stack.discard(m)
+                        comp_of[m] = len(comps)
+                        members.append(m)
+                        if m == n:
+                            break
+                    comps.append(members)
+
+        return comps, comp_of
+
+    def cycles(self):
+        # strongly connected components that contain a cycle
+        self.expand_all()
+        comps, _ = self.components()
+        result = []
+        for members in comps:
+            if len(members) > 1 or (self.adj[members[0]] >> members[0] & 1):
+                result.append([ self.nodes[n] for n in members if not self.virtual >> n & 1 ])
+        return result
+
+
+
+class OCSNFlowClosure:
+    # Lazy transitive closure of an OCSNFlowGraph. Nodes of a strongly
+    # connected component share a single reach bitset, built on lookup by
+    # walking the condensation in post order. Only components with more
+    # than one predecessor component are kept once computed: a chain is
+    # recomputed instead of storing n bitsets of n bits for it.
+    def __init__(self, graph):
+        self.graph = graph
+        self.comps, self.comp_of = graph.components()
+        self.succ = []
+        self.mask = []
+        preds = [ 0 ] * len(self.comps)
+        for c, members in enumerate(self.comps):
+            mask = 0
+            for n in members:
+                mask |= graph.adj[n]
+            succ = set(self.comp_of[n] for n in bits(mask))
+            succ.discard(c)
+            for oc in succ:
+                preds[oc] += 1
+            self.mask.append(mask)
+            self.succ.append(succ)
+        self.shared = set(c for c, k in enumerate(preds) if k > 1)
+        self.memo = {}
+
+    def __len__(self):
+        return len(self.comp_of)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __getitem__(self, n):
+        return self._reach(self.comp_of[n])
+
+    def _reach(self, c):
+        if c in self.memo:
+            return self.memo[c]
+
+        done = {}
+        stack = [ (c, False) ]
+        while stack:
+            x, ready = stack.pop()
+            if x in done or x in self.memo:
+                continue
+
+            if not ready:
+                stack.append((x, True))
+                for oc in self.succ[x]:
+                    if oc not in done and oc not in self.memo:
+                        stack.append((oc, False))
+                continue
+
+            reach = self.mask[x]
+            for oc in self.succ[x]:
+                r = done.get(oc)
+                reach |= self.memo[oc] if r is None else r
+            done[x] = reach
+            if x in self.shared:
+                self.memo[x] = reach
+
+        return done[c]
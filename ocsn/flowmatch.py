@@ -0,0 +1,145 @@
+from .ocsn_types import *
+
+
+class OCSNFlowTrieNode:
+    __slots__ = ('children', 'star', 'is_star', 'flows')
+
+    def __init__(self, is_star = False):
+        self.children = {}
+        self.star = None        # node reached through a '*' token
+        self.is_star = is_star  # a '*' node absorbs any character but '\0'
+        self.flows = None
+
+
+class OCSNFlowMatcher:
+    # Source patterns of all flows compiled into a single trie over
+    # flow_key() strings, '*' tokens becoming self-looping nodes. A source
+    # obj_prefix covers every prefix starting with it, so once the walk is
+    # past the bucket each node it reaches contributes its flows. Finding
+    # the flows that cover an endpoint costs time proportional to the key
+    # length rather than to the number of flows.
+    def __init__(self, flows = None):
+        self.root = OCSNFlowTrieNode()
+        self.count = 0
+
+        # symmetric groups: scope key -> (obj_prefix, group id) of literal
+        # members, plus the (rare) wildcard members that have to be matched
+        self.sym_groups = {}
+        self.sym_members = {}
+        self.sym_patterns = []
+        for flow_id, flow in (flows or []):
+            self.add(flow_id, flow)
+
+    def add(self, flow_id, flow):
+        self.count += 1
+
+        node = self.root
+        for c in flow.source.get_flow_key():
+            if c == '*':
+                if node.is_star:
+                    continue # '**' is the same as '*'
+                if not node.star:
+                    node.star = OCSNFlowTrieNode(is_star = True)
+                node = node.star
+                continue
+
+            child = node.children.get(c)
+            if not child:
+                child = node.children[c] = OCSNFlowTrieNode()
+            node = child
+
+        if node.flows is None:
+            node.flows = []
+        node.flows.append((flow_id, flow))
+
+    def add_symmetric(self, flow_id, flow):
+        self.sym_groups[flow_id] = flow
+        for e in (flow.entities or []):
+            if e.is_pattern():
+                self.sym_patterns.append((e, flow_id))
+            else:
+                self.sym_members.setdefault(e.get_scope_key(), []).append((safestr(e.obj_prefix), flow_id))
+
+    def add_instance(self, df):
+        for flow_id, flow in (df.flows or {}).items():
+            self.add(flow_id, flow)
+        for flow_id, flow in (df.symmetric or {}).items():
+            self.add_symmetric(flow_id, flow)
+
+    def symmetric_groups(self, entity):
+        obj_prefix = safestr(entity.obj_prefix)
+        groups = set(flow_id for p, flow_id in self.sym_members.get(entity.get_scope_key(), ()) if obj_prefix.startswith(p))
+        if self.sym_patterns:
+            for p, flow_id in self.sym_patterns:
+                if p.match(entity) is not None:
+                    groups.add(flow_id)
+        return groups
+
+    def _closure(self, states):
+        result = []
+        seen = set()
+        while states:
+            n = states.pop()
+            if id(n) in seen:
+                continue
+            seen.add(id(n))
+            result.append(n)
+            if n.star:
+                states.append(n.star)
+        return result
+
+    def _flows(self, states, seen):
+        for n in states:
+            if n.flows and id(n) not in seen:
+                seen.add(id(n))
+                for item in n.flows:
+                    yield item
+
+    def candidates(self, entity):
+        k = entity.get_flow_key()
+        seen = set()
+        seps = 0
+
+        states = self._closure([ self.root ])
+        for c in k:
+            next_states = []
+            for n in states:
+                if n.is_star and c != '\0':
+                    next_states.append(n)
+                child = n.children.get(c)
+                if child:
+                    next_states.append(child)
+
+            if not next_states:
+                return
+
+            states = self._closure(next_states)
+            if c == '\0':
+                seps += 1
+            if seps == 2:
+                # every state past the bucket ends a shorter obj_prefix
+                yield from self._flows(states, seen)
+
+    def match(self, source):
+        # (flow_id, flow, (capture, rest)) for every flow whose source covers source
+        for flow_id, flow in self.candidates(source):
+            m = flow.source.match(source)
+            if m is not None:
+                yield flow_id, flow, m
+
+    def dests(self, source):
+        for flow_id, flow, m in self.match(source):
+            yield flow.dest.apply(source, *m)
+
+    def check(self, source, dest):
+        for d in self.dests(source):
+            if d.compare(dest):
+                return True
+
+        if self.sym_groups and source.get_flow_key() != dest.get_flow_key():
+            src_groups = self.symmetric_groups(source)
+            if src_groups and not src_groups.isdisjoint(self.symmetric_groups(dest)):
+                return True
+
+        return False
+
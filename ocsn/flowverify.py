@@ -0,0 +1,136 @@
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .ocsn_types import *
+
+
+class OCSNFlowVerifier:
+    # Checks that every ordered pair of endpoints a vbucket is mapped to is
+    # covered by some flow. run() asks the matcher pair by pair;
+    # run_vectorized() interns the endpoints to ints and indexes the flows
+    # between them once: directional edges as sorted i * n + j codes and
+    # symmetric groups as (endpoint, group) codes. The pairs of all
+    # vbuckets with the same number of endpoints are then resolved with a
+    # few searchsorted lookups, so the cost follows the pairs that are
+    # asked about rather than the square of all endpoints.
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.ids = {}
+        self.nodes = []
+        self.items = [] # (key, [ endpoint id ])
+
+    def intern(self, entity):
+        k = entity.get_flow_key()
+        n = self.ids.get(k)
+        if n is None:
+            n = self.ids[k] = len(self.nodes)
+            self.nodes.append(entity)
+        return n
+
+    def add(self, key, entities):
+        self.items.append((key, [ self.intern(e) for e in entities ]))
+
+    def _result(self, key, ids, covered, pairs):
+        exists = []
+        missing = []
+        for (s, d), ok in zip(pairs, covered):
+            pair = (self.nodes[ids[s]], self.nodes[ids[d]])
+            if ok:
+                exists.append(pair)
+            else:
+                missing.append(pair)
+        return key, exists, missing
+
+    def run(self):
+        for key, ids in self.items:
+            if len(ids) < 2:
+                continue
+            pairs = list(itertools.permutations(range(len(ids)), 2))
+            covered = [ self.matcher.check(self.nodes[ids[s]], self.nodes[ids[d]]) for s, d in pairs ]
+            yield self._result(key, ids, covered, pairs)
+
+    def _index(self):
+        n = len(self.nodes)
+        edges = []
+        groups = {}
+        members = []
+        for i, e in enumerate(self.nodes):
+            for d in self.matcher.dests(e):
+                j = self.ids.get(d.get_flow_key())
+                if j is not None:
+                    edges.append(i * n + j)
+            members.append(sorted(set(groups.setdefault(flow_id, len(groups)) for flow_id in self.matcher.symmetric_groups(e))))
+
+        self.edges = np.unique(np.array(edges, dtype = np.int64))
+
+        # groups of each endpoint padded with -1, and the same memberships
+        # as sorted endpoint * ngroups + group codes
+        self.ngroups = len(groups)
+        width = max([ len(m) for m in members ] + [ 0 ])
+        self.groups = np.full((n, width), -1, dtype = np.int64)
+        codes = []
+        for i, m in enumerate(members):
+            self.groups[i, :len(m)] = m
+            codes += [ i * self.ngroups + g for g in m ]
+        self.members = np.array(sorted(codes), dtype = np.int64)
+
+    def _lookup(self, table, codes):
+        if not len(table):
+            return np.zeros(codes.shape, dtype = bool)
+        pos = np.minimum(np.searchsorted(table, codes), len(table) - 1)
+        return table[pos] == codes
+
+    def _covered(self, src, dst):
+        # src and dst are same-shaped arrays of endpoint ids
+        src = src.astype(np.int64)
+        dst = dst.astype(np.int64)
+        covered = self._lookup(self.edges, src * len(self.nodes) + dst)
+
+        # a pair shares a group if some group of src is also one of dst
+        shared = np.zeros(covered.shape, dtype = bool)
+        for slot in range(self.groups.shape[1]):
+            g = self.groups[src, slot]
+            shared |= (g >= 0) & self._lookup(self.members, dst * self.ngroups + g)
+
+        return covered | (shared & (src != dst))
+
+    def coverage(self, ids):
+        # endpoint x endpoint coverage among the given endpoint ids
+        if np is None:
+            raise OCSNException(OCSNError.ERROR, 'vectorized verification requires numpy')
+
+        self._index()
+        ids = np.array(ids, dtype = np.intp)
+        cov = self._covered(*np.broadcast_arrays(ids[:, None], ids[None, :]))
+        np.fill_diagonal(cov, False)
+        return cov
+
+    def run_vectorized(self):
+        if np is None:
+            raise OCSNException(OCSNError.ERROR, 'vectorized verification requires numpy')
+
+        self._index()
+
+        by_size = {}
+        for pos, (key, ids) in enumerate(self.items):
+            if len(ids) >= 2:
+                by_size.setdefault(len(ids), []).append(pos)
+
+        results = {}
+        for size, positions in by_size.items():
+            pairs = list(itertools.permutations(range(size), 2))
+            src, dst = np.array(pairs, dtype = np.intp).T
+
+            ids = np.array([ self.items[pos][1] for pos in positions ], dtype = np.intp)
+            covered = self._covered(ids[:, src], ids[:, dst]) # vbuckets x pairs
+
+            for row, pos in enumerate(positions):
+                key, item_ids = self.items[pos]
+                results[pos] = self._result(key, item_ids, covered[row].tolist(), pairs)
+
+        for pos in sorted(results):
+            yield results[pos]
@@ -0,0 +1,109 @@
+import random
+
+from .ocsn_types import *
+
+
+def parse_range(s):
+    # '10' or '5-20' -> (low, high)
+    low, _, high = str(s).partition('-')
+    try:
+        low = int(low)
+        high = int(high) if high else low
+    except ValueError:
+        raise OCSNException(OCSNError.ERROR, 'invalid range: ' + str(s))
+    if low < 0 or high < low:
+        raise OCSNException(OCSNError.ERROR, 'invalid range: ' + str(s))
+    return low, high
+
+
+class OCSNCatalogGen:
+    # Seeded synthetic catalog: services -> service instances -> bucket
+    # instances (with creds), tenants -> users -> vbuckets mapped onto bucket
+    # instances picked across all service instances, and flow groups between
+    # those buckets. Per-parent counts are (low, high) ranges drawn
+    # uniformly; the same seed and shape always produce the same catalog.
+    # records() streams (key, document) pairs, only the bucket instance
+    # table is kept in memory.
+    def __init__(self, seed = 1, services = 10, svcis = (1, 3), bis = (10, 100), creds = (1, 2),
+                 tenants = 100, users = (1, 10), vbuckets = (1, 10), mappings = (1, 3),
+                 flow_groups = 10, flows = (1, 20)):
+        self.seed = seed
+        self.services = services
+        self.svcis = svcis
+        self.bis = bis
+        self.creds = creds
+        self.tenants = tenants
+        self.users = users
+        self.vbuckets = vbuckets
+        self.mappings = mappings
+        self.flow_groups = flow_groups
+        self.flows = flows
+
+    def _n(self, rnd, r):
+        return rnd.randint(r[0], r[1])
+
+    def _services(self, rnd, bi_table):
+        for s in range(self.services):
+            svc = OCSNService(id = 'svc-%05d' % s, name = 'service %d' % s,
+                              region = 'region-%d' % (s % 4),
+                              endpoint = 'https://s3-%05d.example.com' % s)
+            yield svc
+
+            for i in range(self._n(rnd, self.svcis)):
+                svci = OCSNServiceInstance(id = '%s-i%03d' % (svc.id, i), name = '%s instance %d' % (svc.name, i),
+                                           svc_id = svc.id)
+                yield svci
+
+                creds_ids = []
+                for c in range(max(1, self._n(rnd, self.creds))):
+                    creds = OCSNS3Creds(svci.id, id = 'creds-%03d' % c,
+                                        access_key = 'AK%016X' % rnd.getrandbits(64),
+                                        secret = '%040x' % rnd.getrandbits(160))
+                    creds_ids.append(creds.id)
+                    yield creds
+
+                for b in range(self._n(rnd, self.bis)):
+                    bi = OCSNBucketInstance(svci.id, id = 'bi-%05d' % b, bucket = 'bucket-%05d' % b,
+                                            obj_prefix = '', creds_id = rnd.choice(creds_ids))
+                    bi_table.append((svc.id, svci.id, bi.id, bi.bucket))
+                    yield bi
+
+    def _tenants(self, rnd, bi_table):
+        for t in range(self.tenants):
+            tenant = OCSNTenant(id = 'tenant-%06d' % t, name = 'tenant %d' % t)
+            yield tenant
+
+            for u in range(self._n(rnd, self.users)):
+                user = OCSNUser(tenant.id, id = 'user-%04d' % u, name = 'user %d' % u)
+                yield user
+
+                for v in range(self._n(rnd, self.vbuckets)):
+                    vb = OCSNVBucket(tenant.id, user.id, id = 'vb-%04d' % v, name = 'vbucket %d' % v)
+                    n = min(self._n(rnd, self.mappings), len(bi_table))
+                    for e, (_, svci_id, bi_id, _) in enumerate(rnd.sample(bi_table, n)):
+                        vb.map('e%d' % e, OCSNBucketInstance(svci_id, id = bi_id))
+                    yield vb
+
+    def _flows(self, rnd, bi_table):
+        if len(bi_table) < 2:
+            return
+
+        for g in range(self.flow_groups):
+            group_id = 'flowgroup-%05d' % g
+            for f in range(self._n(rnd, self.flows)):
+                (src_svc, _, _, src_bucket), (dst_svc, _, _, dst_bucket) = rnd.sample(bi_table, 2)
+                yield OCSNDataFlow(group_id, '%s/f%05d' % (group_id, f),
+                                   OCSNDirectionalFlow(OCSNDataFlowEntity(src_svc, src_bucket),
+                                                       OCSNDataFlowEntity(dst_svc, dst_bucket)))
+
+    def entities(self):
+        rnd = random.Random(self.seed)
+        bi_table = []
+
+        yield from self._services(rnd, bi_table)
+        yield from self._tenants(rnd, bi_table)
+        yield from self._flows(rnd, bi_table)
+
+    def records(self):
+        for e in self.entities():
+            yield e.get_key(), e.encode()
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+
+from .ocsn_err import *
+
+
+# ULID-style ids: 48 bits of millisecond timestamp followed by 80 random
+# bits, in lowercase Crockford base32 (26 chars). Ids generated later sort
+# after earlier ones, also within the same millisecond, so keys of newly
+# created entities are range-scannable by creation time.
+ID_ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+ID_LEN = 26
+
+id_lock = threading.Lock()
+id_last = [ 0, 0 ] # timestamp, random part of the last id generated
+
+
+def encode_base32(n, length):
+    s = []
+    for _ in range(length):
+        s.append(ID_ALPHABET[n & 31])
+        n >>= 5
+    return ''.join(reversed(s))
+
+def new_ulid(now = None):
+    ms = int((now if now is not None else time.time()) * 1000)
+
+    with id_lock:
+        if ms <= id_last[0]:
+            # same (or a backwards) millisecond: keep ordering by bumping
+            # the random part of the previous id
+            ms = id_last[0]
+            rnd = id_last[1] + 1
+            if rnd >> 80:
+                ms += 1
+                rnd = int.from_bytes(os.urandom(10), 'big')
+        else:
+            rnd = int.from_bytes(os.urandom(10), 'big')
+
+        id_last[0] = ms
+        id_last[1] = rnd
+
+    return encode_base32(ms, 10) + encode_base32(rnd, 16)
+
+def gen_id(entity_str):
+    return entity_str + '-' + new_ulid()
+
+def id_time(id):
+    # creation time (in ms) embedded in a generated id, None if the id was
+    # not generated by gen_id()
+    if not id:
+        return None
+
+    s = id.rsplit('-', 1)[-1].rsplit('/', 1)[-1]
+    if len(s) != ID_LEN:
+        return None
+
+    ms = 0
+    for c in s[:10]:
+        v = ID_ALPHABET.find(c)
+        if v < 0:
+            return None
+        ms = (ms << 5) | v
+
+    if any(c not in ID_ALPHABET for c in s[10:]):
+        return None
+
+    return ms
+
+def store_new(client, entity, entity_str = None, retries = 5):
+    # exclusive store of a new entity; if its id was generated (entity_str
+    # set) a collision is retried with a fresh id, an explicit id that is
+    # already taken is an error
+    for _ in range(retries + 1):
+        if entity.store(client, exclusive = True):
+            return entity
+
+        if not entity_str:
+            raise OCSNException(OCSNError.ERROR, 'already exists: ' + entity.get_key())
+
+        entity.id = gen_id(entity_str)
+
+    raise OCSNException(OCSNError.ERROR, 'could not allocate a unique id for ' + entity_str)
@@ -0,0 +1,78 @@
+from .ocsn_types import *
+from .redis_client import *
+
+
+class OCSNIndexCtl:
+    def __init__(self, client):
+        self.client = client
+
+    def vbuckets_of_bi(self, svci_id, bi_id):
+        return [ entity_for_key(k) for k in self.client.get_refs(bi_vbuckets_index(svci_id, bi_id)) ]
+
+    def bis_of_svci(self, svci_id):
+        return self.client.get_refs(svci_bis_index(svci_id))
+
+    def creds_of_svci(self, svci_id):
+        return self.client.get_refs(svci_creds_index(svci_id))
+
+    def svcis_of_svc(self, svc_id):
+        return self.client.get_refs(svc_svcis_index(svc_id))
+
+    def bis_of_creds(self, svci_id, creds_id):
+        return self.client.get_refs(creds_bis_index(svci_id, creds_id))
+
+    def created(self, prefix, since = None, until = None, limit = None):
+        # entities under prefix ('svc/', 'b/', ...) created in [since, until]
+        # (ms), oldest first, as (created, entity) pairs
+        index = created_index(prefix)
+        entries = self.client.get_scores(index, since, until, limit)
+
+        keys = [ k for k, _ in entries ]
+        stale = []
+        for (k, created), item in zip(entries, self.client.get_many(keys)):
+            e = entity_for_key(k)
+            if item is None or not e:
+                stale.append((index, k))
+                continue
+            yield created, e.decode_json(item)
+
+        if stale:
+            self.client.update_scores(remove = stale)
+
+    def rebuild(self, batch_size = 1000):
+        stale = []
+        for k in self.client.keys('idx/'):
+            if k.startswith(CREATED_INDEX_PREFIX):
+                continue # not derived from the entities, keep it
+            stale.append(k)
+            if len(stale) >= batch_size:
+                self.client.unlink(stale)
+                stale = []
+        self.client.unlink(stale)
+
+        count = 0
+        refs = []
+        for prefix in [ OCSNServiceInstance.get_prefix(), 'bi/', 'creds/', 'b/', OCSNDataFlow.get_prefix() ]:
+            for k in self.client.keys(prefix):
+                e = entity_for_key(k)
+                if not e or not e.indexed:
+                    continue
+
+                if e.load(self.client) is None:
+                    continue
+
+                refs += e.get_refs()
+                count += 1
+
+                if isinstance(e, OCSNVBucket) and e.hashed:
+                    e.count_refs(self.client, batch_size)
+
+                if len(refs) >= batch_size:
+                    self.client.update_refs(add = refs)
+                    refs = []
+
+        if refs:
+            self.client.update_refs(add = refs)
+
+        return count
+
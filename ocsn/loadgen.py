@@ -0,0 +1,220 @@
+import asyncio
+import bisect
+import itertools
+import math
+import random
+import time
+
+from urllib.parse import urlparse, quote
+
+from .ocsn_types import *
+
+
+LOADGEN_KINDS = [ 'svc', 'svci', 'user', 'coninfo' ]
+
+
+def parse_mix(s):
+    # 'svc=1,svci=1,user=2,coninfo=6' -> {'svc': 1.0, ...}
+    mix = {}
+    for item in s.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in LOADGEN_KINDS:
+            raise OCSNException(OCSNError.ERROR, 'unknown request kind: ' + kind)
+        mix[kind] = float(weight or 1)
+    return mix
+
+def percentile(values, p):
+    # nearest rank on a sorted list
+    if not values:
+        return None
+    i = min(len(values), max(1, math.ceil(p / 100.0 * len(values)))) - 1
+    return values[i]
+
+
+class OCSNZipf:
+    # draws items with probability proportional to 1 / rank^s; the ranks
+    # are a seeded shuffle of the items so that the hot keys are not just
+    # the first ones in key order
+    def __init__(self, items, s, rnd):
+        self.items = list(items)
+        rnd.shuffle(self.items)
+        self.cum = list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, len(self.items) + 1)))
+        self.rnd = rnd
+
+    def draw(self):
+        return self.items[bisect.bisect_left(self.cum, self.rnd.random() * self.cum[-1])]
+
+
+class OCSNHttpConnection:
+    # minimal HTTP/1.1 client over asyncio streams, enough for GETs against
+    # server.py; reconnects when the server does not keep the connection
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        if not self.writer:
+            await self._connect()
+
+        self.writer.write(('GET %s HTTP/1.1\r\nHost: %s:%d\r\nConnection: keep-alive\r\n\r\n'
+                           % (path, self.host, self.port)).encode())
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+
+        version, status = status_line.split(None, 2)[:2]
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await self.reader.read()
+            headers['connection'] = 'close'
+
+        keep = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if not keep:
+            self.close()
+
+        return int(status), len(body)
+
+
+class OCSNLoadGen:
+    # Open loop load: request i is due at start + i / rate whatever happened
+    # to the previous ones, and its latency is measured from that due time,
+    # so time spent waiting for a free connection when the server falls
+    # behind is counted instead of silently lowering the offered load.
+    def __init__(self, client, url, mix, zipf_s = 1.1, seed = 1, max_keys = 100000):
+        u = urlparse(url)
+        self.host = u.hostname or 'localhost'
+        self.port = u.port or 80
+
+        self.rnd = random.Random(seed)
+        self.mix = mix
+        self.pools = self._load_keys(client, zipf_s, max_keys)
+
+        kinds = [ k for k in mix if self.pools.get(k) ]
+        if not kinds:
+            raise OCSNException(OCSNError.ERROR, 'no keys in the catalog for the requested mix')
+        self.kinds = kinds
+        self.kind_cum = list(itertools.accumulate(mix[k] for k in kinds))
+
+    def _load_keys(self, client, zipf_s, max_keys):
+        def collect(prefix):
+            return list(itertools.islice(client.keys(prefix), max_keys))
+
+        paths = {
+            'svc': [ '/svc/' + quote(k.split('/', 1)[1]) for k in collect(OCSNService.get_prefix()) ],
+            'svci': [ '/svci/' + quote(k.split('/', 1)[1]) for k in collect(OCSNServiceInstance.get_prefix()) ],
+            'user': [ '/user/' + '/'.join(quote(p) for p in k.split('/')[1:3]) for k in collect('u/') ],
+            'coninfo': [ '/coninfo/' + '/'.join(quote(p) for p in k.split('/')[1:4]) for k in collect('b/') ],
+        }
+
+        return { kind: OCSNZipf(p, zipf_s, self.rnd) for kind, p in paths.items() if kind in self.mix and p }
+
+    def _next(self):
+        kind = self.kinds[bisect.bisect_left(self.kind_cum, self.rnd.random() * self.kind_cum[-1])]
+        return kind, self.pools[kind].draw()
+
+    async def _one(self, conns, kind, path, due, timeout, results):
+        conn = await conns.get()
+        try:
+            status, _ = await asyncio.wait_for(conn.get(path), timeout)
+            results.append((kind, time.monotonic() - due, str(status) if status >= 400 else None))
+        except asyncio.TimeoutError:
+            conn.close()
+            results.append((kind, time.monotonic() - due, 'timeout'))
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            conn.close()
+            results.append((kind, time.monotonic() - due, type(e).__name__))
+        finally:
+            conns.put_nowait(conn)
+
+    async def _run(self, rate, duration, connections, timeout):
+        conns = asyncio.Queue()
+        for _ in range(connections):
+            conns.put_nowait(OCSNHttpConnection(self.host, self.port))
+
+        results = []
+        tasks = []
+        late = 0
+
+        start = time.monotonic()
+        total = int(rate * duration)
+        for i in range(total):
+            due = start + i / rate
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -0.01:
+                late += 1 # the generator itself could not keep up
+
+            kind, path = self._next()
+            tasks.append(asyncio.ensure_future(self._one(conns, kind, path, due, timeout, results)))
+
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+
+        while not conns.empty():
+            conns.get_nowait().close()
+
+        return results, elapsed, late
+
+    def _summary(self, results):
+        latencies = sorted(lat for _, lat, err in results if err is None)
+        errors = {}
+        for _, _, err in results:
+            if err is not None:
+                errors[err] = errors.get(err, 0) + 1
+
+        def ms(v):
+            return round(v * 1000, 3) if v is not None else None
+
+        return {'requests': len(results),
+                'errors': sum(errors.values()),
+                'error_rate': (sum(errors.values()) / len(results)) if results else 0.0,
+                'errors_by_type': errors,
+                'latency_ms': {'p50': ms(percentile(latencies, 50)),
+                               'p90': ms(percentile(latencies, 90)),
+                               'p99': ms(percentile(latencies, 99)),
+                               'p999': ms(percentile(latencies, 99.9)),
+                               'max': ms(latencies[-1] if latencies else None),
+                               },
+                }
+
+    def run(self, rate, duration, connections = 64, timeout = 5.0):
+        results, elapsed, late = asyncio.run(self._run(rate, duration, connections, timeout))
+
+        report = self._summary(results)
+        report['offered_rate'] = rate
+        report['achieved_rate'] = round(len(results) / elapsed, 1) if elapsed else None
+        report['late_sends'] = late
+        report['by_kind'] = { kind: self._summary([ r for r in results if r[0] == kind ]) for kind in self.kinds }
+
+        return report
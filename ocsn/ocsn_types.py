@@ -1,13 +1,19 @@
 from abc import abstractmethod
 
+import os
+import time
 import random
 import string
+import re
 import copy
 import itertools
 
 from flask import json
 from flask.json import JSONEncoder
 
+from .ids import *
+from .backend import change_record
+
 
 
 def safestr(s):
@@ -18,6 +24,11 @@ def safestr(s):
 def safecmp(s1, s2):
     return (s1 or '') == (s2 or '')
 
+def flow_key(svc_id, bucket, obj_prefix):
+    # flat form of a (svc, bucket, prefix) endpoint used for pattern matching;
+    # '\0' separates the fields so a wildcard never spans two of them
+    return safestr(svc_id) + '\0' + safestr(bucket) + '\0' + safestr(obj_prefix)
+
 def decode_list(d, T):
     if d is None:
         return None
@@ -38,9 +49,121 @@ def decode_dict(d, T):
 
     return result
 
+class lazy_field:
+    # Attribute decoded from its raw document subtree on first access.
+    # set_raw() keeps the subtree as json.loads() returned it; until the
+    # attribute is read (or assigned) raw() hands the subtree back so that
+    # encode() can pass it through without building the nested objects.
+    def __init__(self, decode):
+        self.decode = decode
+
+    def __set_name__(self, owner, name):
+        self.name = '_' + name
+        self.raw_name = '_raw_' + name
+
+    def __get__(self, obj, owner = None):
+        if obj is None:
+            return self
+        d = obj.__dict__
+        if self.raw_name in d:
+            d[self.name] = self.decode(d.pop(self.raw_name))
+        return d.get(self.name)
+
+    def __set__(self, obj, value):
+        obj.__dict__.pop(self.raw_name, None)
+        obj.__dict__[self.name] = value
+
+    def set_raw(self, obj, raw):
+        obj.__dict__.pop(self.name, None)
+        obj.__dict__[self.raw_name] = raw
+
+    def raw(self, obj):
+        # (True, subtree) while still undecoded, (False, None) otherwise
+        d = obj.__dict__
+        if self.raw_name in d:
+            return True, d[self.raw_name]
+        return False, None
+
+
+def bi_vbuckets_index(svci_id, bi_id):
+    return 'idx/bi-vbuckets/' + svci_id + '/' + bi_id
+
+def vbucket_bis_index(tenant_id, user_id, vbucket_id):
+    # hash of <svci>/<bi> -> number of entries of a hashed vbucket mapping
+    # that bi; its bi-vbuckets ref goes away with the last one
+    return 'idx/vbucket-bis/' + tenant_id + '/' + user_id + '/' + vbucket_id
+
+def svci_bis_index(svci_id):
+    return 'idx/svci-bis/' + svci_id
+
+def svci_creds_index(svci_id):
+    return 'idx/svci-creds/' + svci_id
+
+def svc_svcis_index(svc_id):
+    return 'idx/svc-svcis/' + svc_id
+
+def creds_bis_index(svci_id, creds_id):
+    return 'idx/creds-bis/' + svci_id + '/' + creds_id
+
+def s3_access_key_index(access_key):
+    return 'idx/s3-access-key/' + access_key
+
+DFLOW_GROUP_INDEX_PREFIX = 'idx/dflow-group/'
+
+def dflow_group_index(group_id):
+    return DFLOW_GROUP_INDEX_PREFIX + group_id
+
+def dflow_source_index(svc_id):
+    return 'idx/dflow-source/' + svc_id
+
+CREATED_INDEX_PREFIX = 'idx/created/'
+
+def created_index(key):
+    # sorted set of the keys of one entity type scored by creation time (ms);
+    # members may outlive their entity (cascades unlink directly), readers
+    # skip and prune those
+    return CREATED_INDEX_PREFIX + key.split('/', 1)[0]
+
+VBUCKET_MAP_PREFIX = 'bmap/'
+
+# vbuckets that grow past this many mappings move them out of their
+# document into a hash of their own (see OCSNVBucket.map_entry())
+VBUCKET_HASH_THRESHOLD = int(os.environ.get('OCSN_VBUCKET_HASH_THRESHOLD', 1000))
+
+# callables invoked as fn(key, op) after an entity is stored ('store') or
+# removed ('remove') through this process, and by OCSNChangeWatcher for the
+# changes other processes append to the change feed
+mutation_listeners = []
+
+def add_mutation_listener(fn):
+    mutation_listeners.append(fn)
+
+def remove_mutation_listener(fn):
+    mutation_listeners.remove(fn)
+
+def notify_mutation(key, op):
+    for fn in mutation_listeners:
+        fn(key, op)
+
+def publish_change(client, key, op):
+    client.append_changes([ change_record(key, op) ])
+    notify_mutation(key, op)
+
+def update_refs(client, old_refs, new_refs):
+    old_refs = set(old_refs)
+    new_refs = set(new_refs)
+
+    if old_refs == new_refs:
+        return
+
+    client.update_refs(add = new_refs - old_refs, remove = old_refs - new_refs)
+
 
 class OCSNEntity(json.JSONEncoder):
 
+    # entities that contribute to the reverse indexes (see get_refs())
+    indexed = False
+
     @abstractmethod
     def encode(self):
         raise NotImplementedError()
@@ -67,18 +190,62 @@ class OCSNEntity(json.JSONEncoder):
     def encode_json(self):
         return json.dumps(self.encode())
 
+    def get_refs(self):
+        # list of (index key, member) pairs this entity adds to the reverse indexes
+        return []
+
     def load(self, client):
         v = client.get(self.get_key())
         return self.decode_json(v)
 
+    def load_prev(self, client):
+        v = client.get(self.get_key())
+        if v is None:
+            return None
+        return copy.copy(self).decode_json(v)
+
     def store(self, client, exclusive = None, only_modify = None):
         k = self.get_key()
-        client.put(k, self.encode_json(), exclusive = exclusive, only_modify = only_modify)
+
+        prev = None
+        if self.indexed and not exclusive:
+            prev = self.load_prev(client)
+
+        if not client.put(k, self.encode_json(), exclusive = exclusive, only_modify = only_modify):
+            return False
+
+        if self.indexed:
+            update_refs(client, prev.get_refs() if prev else [], self.get_refs())
+
+        if exclusive:
+            created = id_time(getattr(self, 'id', None)) or int(time.time() * 1000)
+            client.update_scores(add = [ (created_index(k), k, created) ])
+
+        publish_change(client, k, 'store')
+
+        return True
+
+    def remove_owned(self, client):
+        # drops what the stored entity keeps outside of its own document
+        pass
 
     def remove(self, client):
         k = self.get_key()
+
+        prev = None
+        if self.indexed:
+            prev = self.load_prev(client)
+
         client.remove(k)
 
+        if prev:
+            update_refs(client, prev.get_refs(), [])
+            prev.remove_owned(client)
+
+        client.update_scores(remove = [ (created_index(k), k) ])
+
+        publish_change(client, k, 'remove')
+
 
 
 class OCSNEntityJSONEncoder(JSONEncoder):
@@ -94,6 +261,8 @@ class Credentials(OCSNEntity):
 
 class OCSNS3Creds(Credentials):
 
+    indexed = True
+
     def __init__(self, svci, id = None, access_key = None, secret = None):
         self.svci = svci
         self.id = id
@@ -125,6 +294,12 @@ class OCSNS3Creds(Credentials):
     def get_key(self):
         return self.get_prefix() + self.id
 
+    def get_refs(self):
+        refs = [ (svci_creds_index(self.svci), self.id) ]
+        if self.access_key:
+            refs.append((s3_access_key_index(self.access_key), self.get_key()))
+        return refs
+
 
 class OCSNDataPolicy(OCSNEntity):
 
@@ -177,6 +352,9 @@ class OCSNUser(OCSNEntity):
 
 
 class OCSNBucketInstance(OCSNEntity):
+
+    indexed = True
+
     def __init__(self, svci, id = None, bucket = None, obj_prefix = '', creds_id = None):
         self.svci = svci
         self.id = id
@@ -198,6 +376,12 @@ class OCSNBucketInstance(OCSNEntity):
     def get_key(self):
         return self.get_prefix() + '/' + self.id
 
+    def get_refs(self):
+        refs = [ (svci_bis_index(self.svci), self.id) ]
+        if self.creds_id:
+            refs.append((creds_bis_index(self.svci, self.creds_id), self.id))
+        return refs
+
     def encode(self):
         return {'id': self.id,
                 'svci': self.svci,
@@ -273,12 +457,17 @@ class OCSNBucketInstanceMapping(OCSNEntity):
 
 class OCSNVBucket(OCSNEntity):
 
+    indexed = True
+
+    mappings = lazy_field(lambda d: OCSNBucketInstanceMapping().decode(d))
+
     def __init__(self, tenant_id, user_id, id = None, name = None, mappings = None):
         self.tenant_id = tenant_id
         self.user_id = user_id
         self.id = id
         self.name = name
         self.mappings = mappings
+        self.hashed = False # mappings are kept in the hash at get_map_key()
 
     def apply(self, name = None, mappings = None):
         if name:
@@ -300,6 +489,12 @@ class OCSNVBucket(OCSNEntity):
     def get_key(self):
         return self.get_prefix() + self.id
 
+    def get_map_key(self):
+        return VBUCKET_MAP_PREFIX + self.tenant_id + '/' + self.user_id + '/' + self.id
+
+    def get_counts_key(self):
+        return vbucket_bis_index(self.tenant_id, self.user_id, self.id)
+
     def map(self, entry_id, bi):
         if not self.mappings:
             self.mappings = OCSNBucketInstanceMapping()
@@ -312,18 +507,181 @@ class OCSNVBucket(OCSNEntity):
 
         self.mappings.remove(entry_id)
 
+    def get_refs(self):
+        undecoded, raw = __class__.mappings.raw(self)
+        if undecoded:
+            # only the index keys are needed, read them off the raw entries
+            bis = (raw or {}).get('bis') or {}
+            k = self.get_key()
+            return [ (bi_vbuckets_index(bid.get('svci'), bid.get('bi')), k) for bid in bis.values() ]
+
+        if not self.mappings or not self.mappings.bis:
+            return []
+
+        k = self.get_key()
+        return [ (bi_vbuckets_index(bid.svci_id, bid.bi_id), k) for bid in self.mappings.bis.values() ]
+
+    def mapping_batches(self, client, batch_size = 1000):
+        # (entry id, OCSNBucketInstanceID) pairs, streamed from the hash for
+        # a hashed vbucket
+        if self.mappings and self.mappings.bis:
+            yield list(self.mappings.bis.items())
+
+        if self.hashed:
+            for batch in client.hash_batches(self.get_map_key(), batch_size):
+                yield [ (entry_id, OCSNBucketInstanceID().decode(json.loads(v))) for entry_id, v in batch ]
+
+    def mapping_refs(self, client, batch_size = 1000):
+        # index refs of the hashed mappings, get_refs() only has the inline ones
+        if not self.hashed:
+            return
+
+        k = self.get_key()
+        for batch in client.hash_batches(self.get_counts_key(), batch_size):
+            yield [ (bi_vbuckets_index(*field.split('/', 1)), k) for field, _ in batch ]
+
+    def count_refs(self, client, batch_size = 1000):
+        # recomputes the per bi entry counts and refs of a hashed vbucket
+        # from its mappings
+        counts = {}
+        for batch in self.mapping_batches(client, batch_size):
+            for _, bid in batch:
+                field = bid.svci_id + '/' + bid.bi_id
+                counts[field] = counts.get(field, 0) + 1
+
+        client.unlink([ self.get_counts_key() ])
+        client.hash_put(self.get_counts_key(), { field: str(n) for field, n in counts.items() })
+
+        k = self.get_key()
+        refs = [ (bi_vbuckets_index(*field.split('/', 1)), k) for field in counts ]
+        client.update_refs(add = refs)
+        return refs
+
+    def count_ref(self, client, svci_id, bi_id, amount):
+        # amount more (or fewer) hashed entries map the bi; the ref is added
+        # with the first one and dropped with the last
+        field = svci_id + '/' + bi_id
+        n = client.hash_incr(self.get_counts_key(), field, amount, drop = True)
+
+        ref = (bi_vbuckets_index(svci_id, bi_id), self.get_key())
+        if amount > 0:
+            if n == amount:
+                client.update_refs(add = [ ref ])
+        elif n <= 0:
+            client.update_refs(remove = [ ref ])
+            # a concurrent map may have counted the bi again in between; it
+            # adds the ref after its increment, so looking again after the
+            # removal never leaves a counted bi without its ref
+            if int(client.hash_get(self.get_counts_key(), [ field ])[0] or 0) > 0:
+                client.update_refs(add = [ ref ])
+
+    def migrate(self, client):
+        # moves the inline mappings to the hash; the index refs stay as they are
+        k = self.get_key()
+        if self.mappings and self.mappings.bis:
+            client.hash_put(self.get_map_key(), { entry_id: json.dumps(bid.encode()) for entry_id, bid in self.mappings.bis.items() })
+
+            counts = {}
+            for bid in self.mappings.bis.values():
+                field = bid.svci_id + '/' + bid.bi_id
+                counts[field] = counts.get(field, 0) + 1
+            client.hash_put(self.get_counts_key(), { field: str(n) for field, n in counts.items() })
+
+        self.hashed = True
+        self.mappings = None
+        if not client.put(k, self.encode_json(), only_modify = True):
+            return False
+
+        publish_change(client, k, 'store')
+        return True
+
+    def map_entry(self, client, entry_id, bi):
+        # map() and store() of a loaded vbucket; a hashed vbucket only sets
+        # the one hash field instead of rewriting all of its mappings
+        if not self.hashed:
+            self.map(entry_id, bi)
+            if not self.store(client):
+                return False
+            if len(self.mappings.bis) > VBUCKET_HASH_THRESHOLD:
+                return self.migrate(client)
+            return True
+
+        k = self.get_key()
+        map_key = self.get_map_key()
+        bid = OCSNBucketInstanceID(bi.svci, bi.id)
+
+        # swapped atomically: of concurrent maps of the same entry only one
+        # sees the old value, so each change is counted once
+        old = client.hash_swap(map_key, entry_id, json.dumps(bid.encode()))
+
+        # the bi refs are counted, other entries may map the same bi
+        old = json.loads(old) if old else None
+        if old != bid.encode():
+            self.count_ref(client, bid.svci_id, bid.bi_id, 1)
+            if old:
+                self.count_ref(client, old['svci'], old['bi'], -1)
+
+        publish_change(client, k, 'store')
+        return True
+
+    def unmap_entry(self, client, entry_id):
+        # returns the OCSNBucketInstanceID the entry mapped, None if there
+        # was no such entry
+        if not self.hashed:
+            old = (self.mappings.bis or {}).get(entry_id) if self.mappings else None
+            if old is None:
+                return None
+            self.unmap(entry_id)
+            self.store(client)
+            # vbuckets that outgrew the threshold before it was lowered, or
+            # before there was one, move to the hash on any change
+            if len(self.mappings.bis or {}) > VBUCKET_HASH_THRESHOLD:
+                self.migrate(client)
+            return old
+
+        k = self.get_key()
+        map_key = self.get_map_key()
+
+        old = client.hash_swap(map_key, entry_id, None)
+        if not old:
+            return None
+
+        old = OCSNBucketInstanceID().decode(json.loads(old))
+        self.count_ref(client, old.svci_id, old.bi_id, -1)
+
+        publish_change(client, k, 'store')
+        return old
+
+    def remove_owned(self, client):
+        if not self.hashed:
+            return
+
+        for refs in self.mapping_refs(client):
+            client.update_refs(remove = refs)
+        client.unlink([ self.get_map_key(), self.get_counts_key() ])
+
     def encode(self):
-        mappings = self.mappings
-        if mappings:
-            mappings = self.mappings.encode()
-        return {'id': self.id,
-                'name': self.name,
-                'mappings': mappings }
+        undecoded, mappings = __class__.mappings.raw(self)
+        if undecoded:
+            mappings = mappings or None
+        else:
+            mappings = self.mappings
+            if mappings:
+                mappings = self.mappings.encode()
+        result = {'id': self.id,
+                  'name': self.name,
+                  'mappings': mappings }
+
+        if self.hashed:
+            result['mappings_hash'] = True
+
+        return result
 
     def decode(self, d):
         self.id = d.get('id')
-        self.user = d.get('name')
-        self.mappings = OCSNBucketInstanceMapping().decode(d.get('mappings'))
+        self.name = d.get('name')
+        __class__.mappings.set_raw(self, d.get('mappings'))
+        self.hashed = bool(d.get('mappings_hash'))
         return self
 
 class OCSNTenantPolicy(OCSNEntity):
@@ -431,6 +789,9 @@ class OCSNService(OCSNEntity):
 
 
 class OCSNServiceInstance(OCSNEntity):
+
+    indexed = True
+
     def __init__(self, id = None, name = None, svc_id = None, buckets = None, creds = None):
         self.id = id
         self.name = name
@@ -454,6 +815,11 @@ class OCSNServiceInstance(OCSNEntity):
     def get_key(self):
         return __class__.get_prefix() + self.id
 
+    def get_refs(self):
+        if not self.svc_id:
+            return []
+        return [ (svc_svcis_index(self.svc_id), self.id) ]
+
     def decode(self, d):
         self.id = d.get('id')
         self.name = d.get('name')
@@ -488,14 +854,63 @@ class OCSNDataFlowEntity(OCSNEntity):
                 'obj_prefix': self.obj_prefix,
                 }
 
-    def apply(self, entity):
+    def get_flow_key(self):
+        return flow_key(self.svc_id, self.bucket, self.obj_prefix)
+
+    def is_pattern(self):
+        return '*' in safestr(self.bucket) or '*' in safestr(self.obj_prefix)
+
+    def get_scope_key(self):
+        # flow key up to the obj_prefix, which is matched as a prefix
+        return flow_key(self.svc_id, self.bucket, None)
+
+    def _regex(self):
+        # the bucket is a glob, '*' matching any run of characters; the
+        # obj_prefix covers every object prefix starting with it, and a '*'
+        # in it stands for the bucket captured on the source side as it
+        # always did: what the first bucket wildcard matched, or the whole
+        # bucket name
+        pieces = [ re.escape(x) for x in safestr(self.bucket).split('*') ]
+        if len(pieces) == 1:
+            bucket = '(?P<cap>' + pieces[0] + ')'
+        else:
+            bucket = pieces[0] + '(?P<cap>[^\0]*)' + '[^\0]*'.join(pieces[1:])
+
+        obj_prefix = '(?P=cap)'.join(re.escape(x) for x in safestr(self.obj_prefix).split('*'))
+
+        return re.compile(re.escape(safestr(self.svc_id)) + '\0' + bucket + '\0' + obj_prefix + '(?P<rest>[^\0]*)')
+
+    def match(self, entity):
+        # returns None if entity is not covered by this pattern, otherwise
+        # (capture, rest) for apply() on the other side of a flow: capture
+        # stands for '*', rest is what entity's obj_prefix adds to ours
+        if not self.is_pattern():
+            if not safecmp(self.svc_id, entity.svc_id) or not safecmp(self.bucket, entity.bucket):
+                return None
+            obj_prefix = safestr(self.obj_prefix)
+            if not safestr(entity.obj_prefix).startswith(obj_prefix):
+                return None
+            return safestr(entity.bucket), safestr(entity.obj_prefix)[len(obj_prefix):]
+
+        m = self._regex().fullmatch(entity.get_flow_key())
+        if not m:
+            return None
+
+        return m.group('cap'), m.group('rest')
+
+    def apply(self, entity, capture = None, rest = ''):
+        if capture is None:
+            capture = safestr(entity.bucket)
+
         new_entity = OCSNDataFlowEntity(self.svc_id, self.bucket, self.obj_prefix)
 
         if self.bucket:
-            new_entity.bucket = self.bucket.replace('*', entity.bucket)
+            new_entity.bucket = self.bucket.replace('*', capture)
 
         if self.obj_prefix:
-            new_entity.obj_prefix = self.obj_prefix.replace('*', entity.bucket)
+            new_entity.obj_prefix = self.obj_prefix.replace('*', capture) + rest
+        elif rest:
+            new_entity.obj_prefix = rest
 
         return new_entity
 
@@ -525,26 +940,68 @@ class OCSNDirectionalFlow(OCSNEntity):
                 }
 
     def check(self, source, dest):
-        s = self.source.apply(source)
-        d = self.dest.apply(source) # use the source bucket in case of wildcard
-        return s.compare(source) and d.compare(dest)
+        m = self.source.match(source)
+        if m is None:
+            return False
+
+        d = self.dest.apply(source, *m) # wildcards take what the source wildcard matched
+        return d.compare(dest)
 
 
 class OCSNSymmetricFlow(OCSNEntity):
+    # n-way replication between all member endpoints; literal members are
+    # kept by scope (svc and bucket) so checks never expand the group into
+    # pairs. A member covers the object prefixes starting with its own.
     def __init__(self, id = None, entities = None):
         self.id = id
-        self.entities
+        self.entities = entities
+        self._members = None
+
+    def _decode(obj, d):
+        if not obj:
+            obj = OCSNSymmetricFlow()
+        obj.id = d.get('id')
+        obj.entities = [ OCSNDataFlowEntity().decode(e) for e in (d.get('entities') or []) ]
+        obj._members = None
+        return obj
 
     def decode(self, d):
-        self.id = d.get('id')
-        self.entities = decode_list(d.get('entities'), str)
-        return self
+        return OCSNSymmetricFlow._decode(self, d)
 
     def encode(self):
         return {'id': self.id,
-                'entites': self.entities,
+                'entities': [ e.encode() for e in (self.entities or []) ],
                 }
 
+    def members(self):
+        # scope key -> obj_prefixes of the literal members
+        if self._members is None:
+            self._members = {}
+            for e in (self.entities or []):
+                if not e.is_pattern():
+                    self._members.setdefault(e.get_scope_key(), []).append(safestr(e.obj_prefix))
+        return self._members
+
+    def patterns(self):
+        return [ e for e in (self.entities or []) if e.is_pattern() ]
+
+    def contains(self, entity):
+        obj_prefix = safestr(entity.obj_prefix)
+        for p in self.members().get(entity.get_scope_key(), ()):
+            if obj_prefix.startswith(p):
+                return True
+
+        for p in self.patterns():
+            if p.match(entity) is not None:
+                return True
+
+        return False
+
+    def check(self, source, dest):
+        if source.get_flow_key() == dest.get_flow_key():
+            return False
+        return self.contains(source) and self.contains(dest)
+
 
 class OCSNDataFlowGroup(OCSNEntity):
     def __init__(self, id = None, directional = None, symmetric = None):
@@ -579,9 +1036,14 @@ class OCSNDataFlowPolicy(OCSNEntity):
 
 
 class OCSNDataFlowInstance(OCSNEntity):
+
+    flows = lazy_field(lambda d: decode_dict(d, OCSNDirectionalFlow))
+    symmetric = lazy_field(lambda d: decode_dict(d, OCSNSymmetricFlow))
+
     def __init__(self, id = None):
         self.id = id
         self.flows = None
+        self.symmetric = None
 
     def apply(self, flows = None):
         if flows:
@@ -595,38 +1057,147 @@ class OCSNDataFlowInstance(OCSNEntity):
 
     def decode(self, d):
         self.id = d.get('id')
-        self.flows = decode_dict(d.get('flows'), OCSNDirectionalFlow)
+        __class__.flows.set_raw(self, d.get('flows'))
+        __class__.symmetric.set_raw(self, d.get('symmetric'))
         return self
 
     def encode(self):
-        d = {}
-        for k, v in self.flows.items():
-            d[k] = v.encode()
+        undecoded, d = __class__.flows.raw(self)
+        if not undecoded:
+            d = {}
+            for k, v in (self.flows or {}).items():
+                d[k] = v.encode()
 
-        return {'id': self.id,
-                'flows': d,
-                }
+        result = {'id': self.id,
+                  'flows': d or {},
+                  }
+
+        undecoded, symmetric = __class__.symmetric.raw(self)
+        if not undecoded and self.symmetric:
+            symmetric = { k: v.encode() for k, v in self.symmetric.items() }
+        if symmetric:
+            result['symmetric'] = symmetric
+
+        return result
+
+    def gen_flow_id(self):
+        return self.id + '/' + new_ulid()
 
     def append(self, flow, flow_id = None):
         if not flow_id:
-            flow_id = self.id + '/' + ''.join(random.choices(string.ascii_lowercase, k=5))
+            flow_id = self.gen_flow_id()
 
         if not self.flows:
             self.flows = {}
 
         self.flows[flow_id] = flow
 
+    def append_symmetric(self, flow, flow_id = None):
+        if not flow_id:
+            flow_id = self.gen_flow_id()
+
+        if not self.symmetric:
+            self.symmetric = {}
+
+        flow.id = flow_id
+        self.symmetric[flow_id] = flow
+
     def pop(self, flow_id):
-        try:
-            self.flows.pop(flow_id)
-        except:
-            pass
+        for flows in (self.flows, self.symmetric):
+            if flows:
+                flows.pop(flow_id, None)
 
-        return bool(self.flows)
+        return bool(self.flows) or bool(self.symmetric)
 
     def check(self, source, dest):
-        for _, f in self.flows.items():
+        for _, f in (self.flows or {}).items():
+            if f.check(source, dest):
+                return True
+        for _, f in (self.symmetric or {}).items():
             if f.check(source, dest):
                 return True
         return False
 
+
+class OCSNDataFlow(OCSNEntity):
+    # A single flow of a group, stored on its own at dflow/<group>/<suffix>
+    # (generated flow ids are already <group>/<suffix>). The group index
+    # lists the flows of a group, the source index the flows leaving a
+    # service (every member service for a symmetric flow).
+
+    indexed = True
+
+    def __init__(self, group_id = None, id = None, flow = None):
+        self.group_id = group_id
+        self.id = id
+        self.flow = flow
+
+    def get_prefix():
+        return 'dflow/'
+
+    def get_key(self):
+        if self.id.startswith(self.group_id + '/'):
+            return __class__.get_prefix() + self.id
+        return __class__.get_prefix() + self.group_id + '/' + self.id
+
+    def is_symmetric(self):
+        return isinstance(self.flow, OCSNSymmetricFlow)
+
+    def sources(self):
+        if self.is_symmetric():
+            return set(e.svc_id for e in (self.flow.entities or []))
+        return { self.flow.source.svc_id }
+
+    def get_refs(self):
+        k = self.get_key()
+        return [ (dflow_group_index(self.group_id), k) ] + [ (dflow_source_index(svc_id), k) for svc_id in self.sources() ]
+
+    def add_to(self, df):
+        if self.is_symmetric():
+            df.append_symmetric(self.flow, flow_id = self.id)
+        else:
+            df.append(self.flow, flow_id = self.id)
+
+    def encode(self):
+        return {'id': self.id,
+                'group': self.group_id,
+                'type': 'symmetric' if self.is_symmetric() else 'directional',
+                'flow': self.flow.encode(),
+                }
+
+    def decode(self, d):
+        self.id = d.get('id')
+        self.group_id = d.get('group')
+        if d.get('type') == 'symmetric':
+            self.flow = OCSNSymmetricFlow._decode(None, d.get('flow'))
+        else:
+            self.flow = OCSNDirectionalFlow._decode(None, d.get('flow'))
+        return self
+
+
+entity_prefixes = [ 't/', 'u/', 'b/', 'svc/', 'svci/', 'bi/', 'creds/', 'dataflow/', 'dflow/' ]
+
+def entity_for_key(key):
+    parts = key.split('/')
+    t = parts[0]
+
+    if t == 't':
+        return OCSNTenant(id = parts[1])
+    if t == 'u':
+        return OCSNUser(parts[1], id = parts[2])
+    if t == 'b':
+        return OCSNVBucket(parts[1], parts[2], id = parts[3])
+    if t == 'svc':
+        return OCSNService(id = parts[1])
+    if t == 'svci':
+        return OCSNServiceInstance(id = parts[1])
+    if t == 'bi':
+        return OCSNBucketInstance(parts[1], id = parts[2])
+    if t == 'creds':
+        return OCSNS3Creds(parts[1], id = parts[3])
+    if t == 'dataflow':
+        return OCSNDataFlowInstance(id = '/'.join(parts[1:]))
+    if t == 'dflow':
+        return OCSNDataFlow(parts[1], id = '/'.join(parts[1:]))
+
+    return None
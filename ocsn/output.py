@@ -0,0 +1,106 @@
+import itertools
+import json
+import sys
+
+
+OUTPUT_FORMATS = [ 'json', 'ndjson', 'compact', 'table' ]
+
+# rows looked at to pick the table columns and their widths
+TABLE_SAMPLE = 100
+
+
+def cell(v):
+    if v is None:
+        return ''
+    if isinstance(v, str):
+        return v
+    return json.dumps(v, separators = (',', ':'))
+
+
+class OCSNOutput:
+    # Prints command results in one of OUTPUT_FORMATS:
+    #
+    #   json      indented JSON (the default)
+    #   ndjson    one compact JSON document per line
+    #   compact   JSON without any whitespace
+    #   table     aligned columns, nested values as compact JSON
+    #
+    # records() writes a listing as its items come out of the generator, so
+    # memory does not grow with the number of records in any format; table
+    # takes its columns and widths from the first TABLE_SAMPLE rows.
+    def __init__(self, format = 'json', out = None):
+        self.format = format
+        self.out = out
+
+    def _out(self):
+        return self.out or sys.stdout
+
+    def dumps(self, x):
+        if self.format == 'ndjson':
+            return json.dumps(x)
+        if self.format == 'compact':
+            return json.dumps(x, separators = (',', ':'))
+        if self.format == 'table':
+            if isinstance(x, list):
+                return '\n'.join(self._table(x))
+            if isinstance(x, dict):
+                return '\n'.join(self._table([ {'key': k, 'value': v} for k, v in x.items() ]))
+            return cell(x)
+        return json.dumps(x, indent = 2)
+
+    def records(self, items):
+        out = self._out()
+
+        if self.format == 'ndjson':
+            for x in items:
+                out.write(json.dumps(x) + '\n')
+        elif self.format == 'compact':
+            sep = '['
+            for x in items:
+                out.write(sep + json.dumps(x, separators = (',', ':')))
+                sep = ','
+            out.write('[]\n' if sep == '[' else ']\n')
+        elif self.format == 'table':
+            for line in self._table(items):
+                out.write(line + '\n')
+        else:
+            # same text as json.dumps(list, indent = 2)
+            sep = '[\n'
+            for x in items:
+                out.write(sep + '  ' + json.dumps(x, indent = 2).replace('\n', '\n  '))
+                sep = ',\n'
+            out.write('[]\n' if sep == '[\n' else '\n]\n')
+
+        out.flush()
+
+    def _table(self, items):
+        items = iter(items)
+        sample = list(itertools.islice(items, TABLE_SAMPLE))
+
+        columns = []
+        for x in sample:
+            for k in (x if isinstance(x, dict) else {'value': x}):
+                if k not in columns:
+                    columns.append(k)
+
+        if not columns:
+            return
+
+        def row(x):
+            if not isinstance(x, dict):
+                x = {'value': x}
+            return [ cell(x.get(k)) for k in columns ]
+
+        widths = [ len(k) for k in columns ]
+        rows = [ row(x) for x in sample ]
+        for r in rows:
+            widths = [ max(w, len(c)) for w, c in zip(widths, r) ]
+
+        def line(r):
+            return '  '.join(c.ljust(w) for c, w in zip(r, widths)).rstrip()
+
+        yield line([ k.upper() for k in columns ])
+        for r in rows:
+            yield line(r)
+        for x in items:
+            yield line(row(x))
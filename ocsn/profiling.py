@@ -0,0 +1,89 @@
+import cProfile
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+from .trace import *
+
+
+# sequence number of the profiles dumped by this process, keeping the names
+# of profiles taken within the same second apart
+profile_seq = itertools.count(1)
+
+def profile_path(out_dir, name):
+    safe = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'op'
+    return os.path.join(out_dir, '%s-%d-%d-%s.prof' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(),
+                                                       next(profile_seq), safe[:80]))
+
+
+class OCSNProfiler:
+    # Opt-in profiling of whole operations. start() traces the operation
+    # (see ocsn.trace) and, if asked to, runs it under cProfile; finish()
+    # writes the profile to out_dir (readable with pstats or snakeviz) and
+    # logs the operation with the keys it touched to the slow log when it
+    # took longer than slow_ms.
+    def __init__(self, out_dir = None, slow_ms = None, slow_log = None):
+        self.out_dir = out_dir
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.lock = threading.Lock()
+
+    def env():
+        # OCSN_PROFILE_DIR: where profiles go, OCSN_SLOW_MS: slow operation
+        # threshold, OCSN_SLOW_LOG: slow log file (stderr if unset)
+        slow_ms = os.environ.get('OCSN_SLOW_MS')
+        return OCSNProfiler(os.environ.get('OCSN_PROFILE_DIR'),
+                            float(slow_ms) if slow_ms else None,
+                            os.environ.get('OCSN_SLOW_LOG'))
+
+    def start(self, name, profile = False):
+        prof = None
+        if profile and self.out_dir:
+            prof = cProfile.Profile()
+
+        t, token = start_trace(name)
+        if prof:
+            try:
+                prof.enable()
+            except ValueError:
+                prof = None # another profile is running (3.12+ allow one per process)
+
+        return (t, token, prof)
+
+    def finish(self, op):
+        t, token, prof = op
+        if prof:
+            prof.disable()
+        end_trace(t, token)
+
+        if prof:
+            os.makedirs(self.out_dir, exist_ok = True)
+            prof.dump_stats(profile_path(self.out_dir, t.name))
+
+        if self.slow_ms is not None and t.elapsed * 1000 >= self.slow_ms:
+            self.log_slow(t)
+
+        return t
+
+    @contextmanager
+    def run(self, name, profile = False):
+        op = self.start(name, profile)
+        try:
+            yield op[0]
+        finally:
+            self.finish(op)
+
+    def log_slow(self, t):
+        line = json.dumps(dict(t.encode(), time = time.strftime('%Y-%m-%dT%H:%M:%S%z'), pid = os.getpid()))
+        with self.lock:
+            if self.slow_log:
+                with open(self.slow_log, 'a') as f:
+                    f.write(line + '\n')
+            else:
+                print('slow operation: ' + line, file = sys.stderr)
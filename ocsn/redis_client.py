@@ -1,34 +1,402 @@
+import time
+import threading
+import itertools
+
+from collections import OrderedDict
+
 import redis
 from .ocsn_err import *
+from .backend import OCSNBackend, CHANGEFEED_KEY, CHANGEFEED_MAXLEN
+from .trace import trace_op, trace_recv
 from redis.commands.json.path import Path
 
 
 
-class RedisClient:
-    def __init__(self):
-        self.client = redis.Redis(host='localhost', port=6379, db=0)
+class RedisReplica:
+    def __init__(self, client):
+        self.client = client
+        self.latency = 0.0
 
-    def get(self, key):
-        result = self.client.json().get(key)
+    def record(self, elapsed, alpha = 0.2):
+        self.latency += alpha * (elapsed - self.latency)
+
+
+# read-your-writes window: keys written by a client are read back from the
+# primary for this many seconds, and at most WRITTEN_MAX of them are kept
+STICKY_DEFAULT = 5.0
+WRITTEN_MAX = 100000
+
+# single key read-modify-writes, atomic on the server and fine on a cluster
+HASH_SWAP_SCRIPT = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if #ARGV > 1 then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+else
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return old
+"""
+
+HASH_INCR_DROP_SCRIPT = """
+local n = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if n <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return n
+"""
+
+
+def key_prefixes(key):
+    # '' and every prefix of key ending with '/': 'b/', 'b/t0/', 'b/t0/u0/'
+    yield ''
+    i = key.find('/')
+    while i >= 0:
+        yield key[:i + 1]
+        i = key.find('/', i + 1)
+
+
+class RedisWrittenKeys:
+    # Keys written recently, oldest first, expiring after sticky seconds
+    # and capped at max_keys (the oldest go first). Written keys are also
+    # counted under each of their '/' prefixes, so asking whether anything
+    # under a prefix was written costs a dict lookup; a prefix ending in
+    # the middle of a segment is checked against its last full segment,
+    # which may send a scan to the primary when a replica would have done.
+    def __init__(self, sticky = STICKY_DEFAULT, max_keys = WRITTEN_MAX):
+        self.sticky = sticky
+        self.max_keys = max_keys
+        self.keys = OrderedDict()
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _drop(self, key):
+        del self.keys[key]
+        for p in key_prefixes(key):
+            n = self.prefixes[p] - 1
+            if n:
+                self.prefixes[p] = n
+            else:
+                del self.prefixes[p]
+
+    def _expire(self, now):
+        while self.keys:
+            key, t = next(iter(self.keys.items()))
+            if now - t < self.sticky and len(self.keys) <= self.max_keys:
+                break
+            self._drop(key)
+
+    def mark(self, keys):
+        if not self.sticky:
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            for k in keys:
+                if k in self.keys:
+                    self.keys.move_to_end(k)
+                else:
+                    for p in key_prefixes(k):
+                        self.prefixes[p] = self.prefixes.get(p, 0) + 1
+                self.keys[k] = now
+            self._expire(now)
 
+    def contains(self, key):
+        if not self.keys:
+            return False
+
+        with self.lock:
+            self._expire(time.monotonic())
+            return key in self.keys
+
+    def has_prefix(self, prefix):
+        if not self.keys:
+            return False
+
+        with self.lock:
+            self._expire(time.monotonic())
+            return prefix[:prefix.rfind('/') + 1] in self.prefixes
+
+
+class RedisClient(OCSNBackend):
+    def __init__(self, host = 'localhost', port = 6379, db = 0,
+                 replicas = None, read_policy = 'round-robin', sticky = STICKY_DEFAULT,
+                 changefeed_maxlen = CHANGEFEED_MAXLEN):
+        self.client = redis.Redis(host=host, port=port, db=db)
+        self.changefeed_maxlen = changefeed_maxlen
+
+        # replicas is a list of (host, port); reads go to a replica chosen by
+        # read_policy ('round-robin' or 'least-latency') unless this client
+        # wrote the key in the last 'sticky' seconds, in which case it is
+        # read back from the primary (0 turns that off)
+        if read_policy not in ('round-robin', 'least-latency'):
+            raise OCSNException(OCSNError.ERROR, 'unknown read policy: ' + read_policy)
+
+        self.replicas = [ RedisReplica(redis.Redis(host=h, port=p, db=db)) for h, p in (replicas or []) ]
+        self.read_policy = read_policy
+        self.sticky = sticky
+        self.written = RedisWrittenKeys(sticky)
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def _mark_written(self, keys):
+        if not self.replicas:
+            return
+
+        self.written.mark(keys)
+
+    def _is_written(self, key = None, prefix = None):
+        if key is not None:
+            return self.written.contains(key)
+
+        return self.written.has_prefix(prefix)
+
+    def _replica(self):
+        with self.lock:
+            self.reads += 1
+            if self.read_policy == 'round-robin' or self.reads % 64 == 0:
+                # least-latency still probes every replica now and then so
+                # that a recovered replica gets picked again
+                return self.replicas[self.reads % len(self.replicas)]
+
+            return min(self.replicas, key = lambda r: r.latency)
+
+    def _read(self, fn, keys = None, prefix = None):
+        if not self.replicas:
+            return fn(self.client)
+
+        if keys is not None and any(self._is_written(key = k) for k in keys):
+            return fn(self.client)
+
+        if prefix is not None and self._is_written(prefix = prefix):
+            return fn(self.client)
+
+        r = self._replica()
+        start = time.monotonic()
+        result = fn(r.client)
+        r.record(time.monotonic() - start)
         return result
-            
+
+    def physical_key(self, key):
+        return key
+
+    def physical_prefix(self, prefix):
+        return prefix
+
+    def logical_key(self, key):
+        return key
+
+    def get(self, key):
+        trace_op('get', [ key ])
+        result = self._read(lambda c: c.json().get(self.physical_key(key)), keys = [ key ])
+
+        return trace_recv(result)
+
+    def _get_many(self, c, keys):
+        p = c.pipeline(transaction = False)
+        for k in keys:
+            p.json().get(self.physical_key(k))
+        return p.execute()
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+
+        trace_op('get_many', keys)
+        return trace_recv(self._read(lambda c: self._get_many(c, keys), keys = keys))
+
     def put(self, key, data, exclusive = None, only_modify = None):
+        trace_op('put', [ key ], sent = len(data))
         p = self.client.pipeline()
-        p.json().set(key, Path.root_path(), data, nx = exclusive, xx = only_modify)
+        p.json().set(self.physical_key(key), Path.root_path(), data, nx = exclusive, xx = only_modify)
+        self._mark_written([ key ])
+        return bool(p.execute()[0])
+
+    def put_many(self, items):
+        trace_op('put_many', [ key for key, _ in items ], sent = sum(len(data) for _, data in items))
+        p = self.client.pipeline(transaction = False)
+        for key, data in items:
+            p.json().set(self.physical_key(key), Path.root_path(), data)
+        self._mark_written([ key for key, _ in items ])
         p.execute()
 
     def remove(self, key):
-        self.client.json().delete(key)
+        trace_op('remove', [ key ])
+        self._mark_written([ key ])
+        self.client.json().delete(self.physical_key(key))
 
-    def list(self, prefix = ''):
-        cursor = ''
-        while cursor != 0:
-            cursor, keys = self.client.scan(cursor=cursor, match=prefix + '*')
+    def unlink(self, keys):
+        if keys:
+            trace_op('unlink', keys)
+            self._mark_written(keys)
+            self.client.unlink(*[ self.physical_key(k) for k in keys ])
 
-            for k in keys:
-                yield self.get(k)
+    def keys(self, prefix = ''):
+        for batch in self.key_batches(prefix):
+            for k in batch:
+                yield k
+
+    def key_batches(self, prefix = '', batch_size = 1000):
+        c = self.client
+        if self.replicas and not self._is_written(prefix = prefix):
+            c = self._replica().client
+
+        # driven one SCAN call at a time so that each is traced as the round
+        # trip it is
+        match = self.physical_prefix(prefix) + '*'
+        cursor = 0
+        batch = []
+        while True:
+            trace_op('scan', [ prefix + '*' ])
+            cursor, keys = c.scan(cursor, match = match, count = batch_size)
+            for k in trace_recv(keys):
+                batch.append(self.logical_key(k.decode()))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if cursor == 0:
+                break
+
+        if batch:
+            yield batch
+
+    def update_refs(self, add = None, remove = None):
+        trace_op('update_refs', [ index for index, _ in itertools.chain(remove or [], add or []) ])
+        p = self.client.pipeline(transaction = False)
+        for index, member in (remove or []):
+            p.srem(self.physical_key(index), member)
+        for index, member in (add or []):
+            p.sadd(self.physical_key(index), member)
+        self._mark_written([ index for index, _ in itertools.chain(remove or [], add or []) ])
+        p.execute()
+
+    def get_refs(self, index):
+        trace_op('get_refs', [ index ])
+        return trace_recv(sorted([ m.decode() for m in self._read(lambda c: c.smembers(self.physical_key(index)), keys = [ index ]) ]))
+
+    def update_scores(self, add = None, remove = None):
+        trace_op('update_scores', [ item[0] for item in itertools.chain(remove or [], add or []) ])
+        p = self.client.pipeline(transaction = False)
+        for index, member in (remove or []):
+            p.zrem(self.physical_key(index), member)
+        for index, member, score in (add or []):
+            p.zadd(self.physical_key(index), {member: score})
+        self._mark_written([ item[0] for item in itertools.chain(remove or [], add or []) ])
+        p.execute()
+
+    def get_scores(self, index, low = None, high = None, limit = None):
+        trace_op('get_scores', [ index ])
+
+        def fn(c):
+            return c.zrangebyscore(self.physical_key(index),
+                                   '-inf' if low is None else low,
+                                   '+inf' if high is None else high,
+                                   start = 0 if limit else None, num = limit,
+                                   withscores = True)
+
+        return trace_recv([ (m.decode(), int(score)) for m, score in self._read(fn, keys = [ index ]) ])
+
+    def hash_put(self, key, fields):
+        if not fields:
+            return
+        trace_op('hash_put', [ key ], sent = sum(len(v) for v in fields.values()))
+        self._mark_written([ key ])
+        self.client.hset(self.physical_key(key), mapping = fields)
+
+    def hash_get(self, key, fields):
+        if not fields:
+            return []
+        trace_op('hash_get', [ key ])
+        result = self._read(lambda c: c.hmget(self.physical_key(key), fields), keys = [ key ])
+        return trace_recv([ v.decode() if v is not None else None for v in result ])
+
+    def hash_remove(self, key, fields):
+        if not fields:
+            return
+        trace_op('hash_remove', [ key ])
+        self._mark_written([ key ])
+        self.client.hdel(self.physical_key(key), *fields)
+
+    def hash_swap(self, key, field, value):
+        trace_op('hash_swap', [ key ], sent = len(value or ''))
+        self._mark_written([ key ])
+        args = [ field ] if value is None else [ field, value ]
+        old = self.client.register_script(HASH_SWAP_SCRIPT)(keys = [ self.physical_key(key) ], args = args)
+        return trace_recv(old.decode() if old is not None else None)
+
+    def hash_incr(self, key, field, amount = 1, drop = False):
+        trace_op('hash_incr', [ key ])
+        self._mark_written([ key ])
+        if drop:
+            return self.client.register_script(HASH_INCR_DROP_SCRIPT)(keys = [ self.physical_key(key) ], args = [ field, amount ])
+        return self.client.hincrby(self.physical_key(key), field, amount)
+
+    def hash_len(self, key):
+        trace_op('hash_len', [ key ])
+        return self._read(lambda c: c.hlen(self.physical_key(key)), keys = [ key ])
+
+    def hash_batches(self, key, batch_size = 1000):
+        c = self.client
+        if self.replicas and not self._is_written(key = key):
+            c = self._replica().client
+
+        k = self.physical_key(key)
+        cursor = 0
+        while True:
+            trace_op('hash_scan', [ key ])
+            cursor, items = c.hscan(k, cursor, count = batch_size)
+            if items:
+                yield trace_recv([ (f.decode(), v.decode()) for f, v in items.items() ])
+            if not cursor:
+                break
+
+    def _changes(self, entries):
+        return [ (v.decode(), { f.decode(): x.decode() for f, x in fields.items() }) for v, fields in entries ]
+
+    def append_changes(self, records):
+        # the stream is capped approximately, trimming whole macro nodes is
+        # much cheaper than keeping the exact length
+        trace_op('append_changes', [ CHANGEFEED_KEY ])
+        stream = self.physical_key(CHANGEFEED_KEY)
+        p = self.client.pipeline(transaction = False)
+        for r in records:
+            p.xadd(stream, r, maxlen = self.changefeed_maxlen, approximate = True)
+        return [ v.decode() for v in p.execute() ]
+
+    def last_change(self):
+        entries = self.client.xrevrange(self.physical_key(CHANGEFEED_KEY), count = 1)
+        return entries[0][0].decode() if entries else None
+
+    def read_changes(self, after = None, count = 100, block = None):
+        trace_op('read_changes', [ CHANGEFEED_KEY ])
+        result = self.client.xread({ self.physical_key(CHANGEFEED_KEY): after or '0-0' }, count = count, block = block)
+        if not result:
+            return []
+        return self._changes(result[0][1])
+
+    def create_change_group(self, group, start = '$'):
+        try:
+            self.client.xgroup_create(self.physical_key(CHANGEFEED_KEY), group, id = start, mkstream = True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def read_change_group(self, group, consumer, count = 100, block = None, pending_after = None):
+        stream = self.physical_key(CHANGEFEED_KEY)
+        if pending_after is not None:
+            result = self.client.xreadgroup(group, consumer, { stream: pending_after }, count = count)
+        else:
+            result = self.client.xreadgroup(group, consumer, { stream: '>' }, count = count, block = block)
+        if not result:
+            return []
+        # entries trimmed away while pending come back without fields
+        return self._changes([ (v, fields or {}) for v, fields in result[0][1] ])
 
+    def ack_changes(self, group, versions):
+        if versions:
+            self.client.xack(self.physical_key(CHANGEFEED_KEY), group, *versions)
 
 
 class RedisTrans:
@@ -1,4 +1,6 @@
-from .ocsn_types import OCSNService, OCSNServiceInstance, OCSNS3Creds, OCSNBucketInstance
+import itertools
+
+from .ocsn_types import *
 from .redis_client import *
 
 
@@ -18,6 +20,63 @@ class OCSNServiceInstanceCtl:
         for item in self.client.list(OCSNServiceInstance.get_prefix()):
             yield OCSNServiceInstance().decode_json(item)
 
+    def _subtree_ids(self, index, prefix):
+        ids = self.client.get_refs(index)
+        if ids:
+            return ids
+
+        # not indexed, fall back to scanning the keyspace
+        return [ k[len(prefix):] for k in self.client.keys(prefix) ]
+
+    def _flag_vbuckets(self, svci_id, bi_ids, batch_size):
+        flagged = set()
+
+        if bi_ids and self.client.get_refs(svci_bis_index(svci_id)):
+            for bi_id in bi_ids:
+                flagged.update(self.client.get_refs(bi_vbuckets_index(svci_id, bi_id)))
+            return flagged
+
+        bi_ids = set(bi_ids)
+        for keys in self.client.key_batches('b/', batch_size):
+            for k, item in zip(keys, self.client.get_many(keys)):
+                vb = entity_for_key(k)
+                if not vb or not vb.decode_json(item):
+                    continue
+
+                for _, bid in itertools.chain.from_iterable(vb.mapping_batches(self.client)):
+                    if bid.svci_id == svci_id and bid.bi_id in bi_ids:
+                        flagged.add(k)
+
+        return flagged
+
+    def remove_cascade(self, svci_id, batch_size = 1000, throttle = None):
+        svci = OCSNServiceInstance(id = svci_id)
+
+        bi_ids = self._subtree_ids(svci_bis_index(svci_id), OCSNBucketInstance(svci_id).get_prefix() + '/')
+        creds_ids = self._subtree_ids(svci_creds_index(svci_id), OCSNS3Creds(svci_id).get_prefix())
+
+        flagged = self._flag_vbuckets(svci_id, bi_ids, batch_size)
+
+        keys = itertools.chain(
+                (OCSNBucketInstance(svci_id, id).get_key() for id in bi_ids),
+                (OCSNS3Creds(svci_id, id).get_key() for id in creds_ids))
+
+        indexes = itertools.chain(
+                (bi_vbuckets_index(svci_id, id) for id in bi_ids),
+                (creds_bis_index(svci_id, id) for id in creds_ids),
+                [ svci_bis_index(svci_id), svci_creds_index(svci_id) ])
+
+        self.client.unlink_many(keys, batch_size, throttle, op = 'remove')
+        self.client.unlink_many(indexes, batch_size, throttle)
+
+        svci.remove(self.client)
+
+        return {'svci_id': svci_id,
+                'bis': len(bi_ids),
+                'creds': len(creds_ids),
+                'flagged_vbuckets': sorted(flagged),
+                }
+
 class OCSNS3CredsCtl:
     def __init__(self, client, svci):
         self.client = client
@@ -29,6 +88,50 @@ class OCSNS3CredsCtl:
         for item in self.client.list(prefix):
             yield creds.decode_json(item)
 
+class OCSNS3CredsLookup:
+    def __init__(self, client, cache = None):
+        self.client = client
+        self.cache = cache
+
+    def lookup(self, access_key):
+        if self.cache:
+            result = self.cache.get(access_key)
+            if result is not None:
+                return result
+
+        keys = self.client.get_refs(s3_access_key_index(access_key))
+
+        result = []
+        for k, item in zip(keys, self.client.get_many(keys)):
+            creds = entity_for_key(k)
+            if creds.decode_json(item):
+                result.append(creds)
+
+        if self.cache and result:
+            # also evicted when creds with this access key are added
+            self.cache.put(access_key, result, keys + [ s3_access_key_index(access_key) ])
+
+        return result
+
+    def invalidate(self, access_key):
+        if self.cache:
+            self.cache.invalidate(access_key)
+
+    def attach(self):
+        if self.cache:
+            add_mutation_listener(self._on_mutation)
+        return self
+
+    def _on_mutation(self, key, op):
+        self.cache.invalidate_dep(key)
+
+        # stored creds may carry an access key that is cached for other
+        # creds; their previous access key is covered by the key above
+        if op == 'store' and key.startswith('creds/'):
+            creds = entity_for_key(key)
+            if creds and creds.load(self.client) is not None and creds.access_key:
+                self.cache.invalidate_dep(s3_access_key_index(creds.access_key))
+
 class OCSNBucketInstanceCtl:
     def __init__(self, client, svci):
         self.client = client
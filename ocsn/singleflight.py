@@ -0,0 +1,175 @@
+import copy
+import threading
+import time
+
+from .cache import OCSNCache
+from .ocsn_types import *
+
+
+class OCSNFlight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class OCSNSingleFlight:
+    # Concurrent do() calls for the same key share a single execution of fn:
+    # the first caller runs it, the others wait for its result (or its
+    # exception). Nothing is kept once the call completes, so the callers
+    # all get a fresh result; they also share the same object, which has to
+    # be treated as read only.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = OCSNFlight()
+                leader = True
+                self.calls += 1
+            else:
+                leader = False
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = fn()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {'calls': self.calls,
+                    'shared': self.shared,
+                    'in_flight': len(self.flights),
+                    }
+
+
+class OCSNHotKeyCache:
+    # Caches only the keys that are read at least `threshold` times within
+    # a `window` of seconds. Access counts are halved at the end of every
+    # window, so a key stays hot while it keeps being read and cools off
+    # (and stops being counted) once it does not. Values are held for ttl
+    # seconds and dropped as soon as the key is stored or removed, by this
+    # process or, through OCSNChangeWatcher, by any other (see
+    # OCSNReader.attach()). A value loaded while any key was invalidated is
+    # not kept, it may predate the change.
+    def __init__(self, ttl = 1.0, threshold = 20, window = 1.0, max_entries = 1000):
+        self.cache = OCSNCache(ttl, max_entries)
+        self.threshold = threshold
+        self.window = window
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.decayed = time.monotonic()
+        self.promoted = 0
+        self.invalidations = 0
+
+    def _decay(self, now):
+        while now - self.decayed >= self.window:
+            self.decayed += self.window
+            self.counts = { k: n >> 1 for k, n in self.counts.items() if n > 1 }
+            if not self.counts:
+                self.decayed = now
+
+    def get(self, key):
+        # every read is counted, hits included, so that a hot key stays hot
+        with self.lock:
+            self._decay(time.monotonic())
+            n = self.counts.get(key, 0) + 1
+            self.counts[key] = n
+            if n == self.threshold:
+                self.promoted += 1
+
+        return self.cache.get(key)
+
+    def version(self):
+        # taken before a load and handed back to record()
+        with self.lock:
+            return self.invalidations
+
+    def record(self, key, value, version = None):
+        # value was just loaded for key, keep it if key is hot
+        with self.lock:
+            hot = self.counts.get(key, 0) >= self.threshold
+            if version is not None and version != self.invalidations:
+                hot = False
+
+        if hot and value is not None:
+            self.cache.put(key, value, (key,))
+
+    def invalidate(self, key):
+        with self.lock:
+            self.invalidations += 1
+        self.cache.invalidate_dep(key)
+
+    def stats(self):
+        result = self.cache.stats()
+        with self.lock:
+            result['tracked'] = len(self.counts)
+            result['promoted'] = self.promoted
+        return result
+
+
+class OCSNReader:
+    # Read path for single entities: served from the hot-key cache when the
+    # key is hot, otherwise loaded through single-flight so that a burst of
+    # requests for the same key costs one backend round trip and decode.
+    # Every caller gets its own copy of the result, the cached and shared
+    # one is never handed out. The hot-key cache is evicted by the mutation
+    # listeners, which an OCSNChangeWatcher also feeds with the changes of
+    # other processes.
+    def __init__(self, client, hot = None):
+        self.client = client
+        self.hot = hot
+        self.flight = OCSNSingleFlight()
+
+    def attach(self):
+        if self.hot:
+            add_mutation_listener(self._on_mutation)
+        return self
+
+    def detach(self):
+        if self.hot:
+            remove_mutation_listener(self._on_mutation)
+
+    def _on_mutation(self, key, op):
+        self.hot.invalidate(key)
+
+    def load(self, e):
+        k = e.get_key()
+
+        version = None
+        if self.hot:
+            result = self.hot.get(k)
+            if result is not None:
+                return copy.deepcopy(result)
+            version = self.hot.version()
+
+        result = self.flight.do(k, lambda: e.load(self.client))
+
+        if self.hot:
+            self.hot.record(k, result, version)
+
+        return copy.deepcopy(result)
+
+    def do(self, key, fn):
+        # coalesces any other read (a composite result, a lookup) by key
+        return copy.deepcopy(self.flight.do(key, fn))
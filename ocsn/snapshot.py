@@ -0,0 +1,153 @@
+import gzip
+import io
+import sys
+
+from .ocsn_types import *
+from .redis_client import *
+
+import json
+
+
+SNAPSHOT_FORMAT = 'ocsn-ndjson'
+SNAPSHOT_VERSION = 1
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_snapshot(path, mode, compress = False):
+    # a text file to use as a context manager; '-' is stdin/stdout, which
+    # stay open when it is closed. gzip is used when requested or when the
+    # file name ends with .gz, and detected by its magic on input
+    if mode == 'w':
+        if path == '-':
+            sys.stdout.flush()
+            if compress:
+                return gzip.open(open(sys.stdout.fileno(), 'wb', buffering = 0, closefd = False), 'wt')
+            return open(sys.stdout.fileno(), 'w', closefd = False)
+
+        if compress or path.endswith('.gz'):
+            return gzip.open(path, 'wt')
+        return open(path, 'w')
+
+    if path == '-':
+        f = open(sys.stdin.fileno(), 'rb', closefd = False)
+        if f.peek(2)[:2] == GZIP_MAGIC:
+            return gzip.open(f, 'rt')
+        return io.TextIOWrapper(f)
+
+    with open(path, 'rb') as f:
+        gzipped = f.read(2) == GZIP_MAGIC
+    if gzipped:
+        return gzip.open(path, 'rt')
+    return open(path, 'r')
+
+
+class OCSNSnapshot:
+    def __init__(self, client):
+        self.client = client
+
+    def export(self, out, batch_size = 1000):
+        # one JSON record per line; entity documents are stored as JSON
+        # text, so they are spliced in as is instead of being re-encoded
+        out.write(json.dumps({'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION}) + '\n')
+
+        count = 0
+        for prefix in entity_prefixes:
+            for keys in self.client.key_batches(prefix, batch_size):
+                lines = []
+                for k, v in zip(keys, self.client.get_many(keys)):
+                    if v is None:
+                        continue
+                    lines.append('{"k":' + json.dumps(k) + ',"v":' + v + '}\n')
+
+                out.write(''.join(lines))
+                count += len(lines)
+
+        # hashed vbucket mappings, one record per scanned batch of entries;
+        # the values are JSON text as well
+        for keys in self.client.key_batches(VBUCKET_MAP_PREFIX, batch_size):
+            for k in keys:
+                for batch in self.client.hash_batches(k, batch_size):
+                    out.write('{"k":' + json.dumps(k) + ',"v":{' +
+                              ','.join(json.dumps(f) + ':' + v for f, v in batch) + '}}\n')
+
+        return count
+
+    def _load_batch(self, batch):
+        refs = []
+        items = []
+        created = []
+        changes = []
+        for k, v in batch:
+            if k.startswith(VBUCKET_MAP_PREFIX):
+                # a batch of hashed vbucket mappings, after its vbucket
+                vb = entity_for_key('b/' + k[len(VBUCKET_MAP_PREFIX):])
+                self.client.hash_put(k, { f: json.dumps(bid) for f, bid in v.items() })
+
+                counts = {}
+                for bid in v.values():
+                    counts[(bid['svci'], bid['bi'])] = counts.get((bid['svci'], bid['bi']), 0) + 1
+                for (svci_id, bi_id), n in counts.items():
+                    vb.count_ref(self.client, svci_id, bi_id, n)
+                continue
+
+            items.append((k, json.dumps(v)))
+            changes.append(change_record(k, 'store'))
+
+            e = entity_for_key(k)
+            if e and e.indexed:
+                refs += e.decode(v).get_refs()
+
+            # creation times are only known for generated ids
+            t = id_time(getattr(e, 'id', None))
+            if t:
+                created.append((created_index(k), k, t))
+
+        self.client.put_many(items)
+        self.client.update_refs(add = refs)
+        self.client.append_changes(changes)
+        if created:
+            self.client.update_scores(add = created)
+
+    def _records(self, lines):
+        for line in lines:
+            d = json.loads(line)
+            if 'format' in d:
+                if d['format'] != SNAPSHOT_FORMAT or d.get('version', 0) > SNAPSHOT_VERSION:
+                    raise OCSNException(OCSNError.ERROR, 'unsupported snapshot format')
+                continue
+
+            yield d['k'], d['v']
+
+    def load_records(self, records, batch_size = 1000):
+        # (key, document) pairs, written with pipelined bulk writes
+        count = 0
+        batch = []
+
+        for item in records:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self._load_batch(batch)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            self._load_batch(batch)
+            count += len(batch)
+
+        return count
+
+    def load(self, lines, batch_size = 1000):
+        return self.load_records(self._records(lines), batch_size)
+
+def write_records(out, records):
+    # a snapshot file made of (key, document) pairs that never were in a
+    # backend, see ocsn.gen
+    out.write(json.dumps({'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION}) + '\n')
+
+    count = 0
+    for k, v in records:
+        out.write('{"k":' + json.dumps(k) + ',"v":' + json.dumps(v, separators = (',', ':')) + '}\n')
+        count += 1
+
+    return count
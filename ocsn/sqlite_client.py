@@ -0,0 +1,369 @@
+import time
+import sqlite3
+import threading
+
+from .ocsn_err import *
+from .backend import OCSNBackend, CHANGEFEED_KEY, CHANGEFEED_MAXLEN
+from .trace import trace_op, trace_recv
+
+
+def prefix_range(prefix):
+    # [prefix, upper) covers every key starting with prefix under the
+    # default BINARY collation, so lookups stay on the primary key index
+    if not prefix:
+        return '', None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SQLiteClient(OCSNBackend):
+    def __init__(self, path = ':memory:', changefeed_maxlen = CHANGEFEED_MAXLEN):
+        self.db = sqlite3.connect(path, isolation_level = None, check_same_thread = False)
+        self.lock = threading.Lock()
+        self.changefeed_maxlen = changefeed_maxlen
+
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS kv '
+                        '(key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS refs '
+                        '(idx TEXT, member TEXT, PRIMARY KEY (idx, member)) WITHOUT ROWID')
+        self.db.execute('CREATE TABLE IF NOT EXISTS scores '
+                        '(idx TEXT, member TEXT, score INTEGER, PRIMARY KEY (idx, member)) WITHOUT ROWID')
+        self.db.execute('CREATE INDEX IF NOT EXISTS scores_by_score ON scores (idx, score)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS hashes '
+                        '(key TEXT, field TEXT, value TEXT NOT NULL, PRIMARY KEY (key, field)) WITHOUT ROWID')
+
+        # change feed: the rowid is the version; consumer groups keep the
+        # last version handed out and the changes not acked yet
+        self.db.execute('CREATE TABLE IF NOT EXISTS changes '
+                        '(version INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT, key TEXT, op TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS change_groups '
+                        '(grp TEXT PRIMARY KEY, last INTEGER NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS change_pending '
+                        '(grp TEXT, version INTEGER, consumer TEXT, PRIMARY KEY (grp, version)) WITHOUT ROWID')
+
+    def get(self, key):
+        trace_op('get', [ key ])
+        with self.lock:
+            row = self.db.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+
+        if not row:
+            return None
+        return trace_recv(row[0])
+
+    def get_many(self, keys, chunk = 500):
+        trace_op('get_many', keys)
+        result = {}
+        with self.lock:
+            for i in range(0, len(keys), chunk):
+                part = keys[i:i + chunk]
+                q = 'SELECT key, value FROM kv WHERE key IN (%s)' % ','.join('?' * len(part))
+                result.update(self.db.execute(q, part))
+
+        return trace_recv([ result.get(k) for k in keys ])
+
+    def put(self, key, data, exclusive = None, only_modify = None):
+        trace_op('put', [ key ], sent = len(data))
+        with self.lock:
+            if exclusive:
+                c = self.db.execute('INSERT OR IGNORE INTO kv (key, value) VALUES (?, ?)', (key, data))
+            elif only_modify:
+                c = self.db.execute('UPDATE kv SET value = ? WHERE key = ?', (data, key))
+            else:
+                c = self.db.execute('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', (key, data))
+
+        return c.rowcount > 0
+
+    def put_many(self, items):
+        trace_op('put_many', [ key for key, _ in items ], sent = sum(len(data) for _, data in items))
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)', items)
+
+    def remove(self, key):
+        trace_op('remove', [ key ])
+        with self.lock:
+            self.db.execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def unlink(self, keys):
+        if not keys:
+            return
+
+        trace_op('unlink', keys)
+        params = [ (k,) for k in keys ]
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('DELETE FROM kv WHERE key = ?', params)
+            self.db.executemany('DELETE FROM refs WHERE idx = ?', params)
+            self.db.executemany('DELETE FROM scores WHERE idx = ?', params)
+            self.db.executemany('DELETE FROM hashes WHERE key = ?', params)
+
+    # tables holding keys, with their key column; all of them together make
+    # up the keyspace a Redis SCAN walks
+    KEY_TABLES = [ ('kv', 'key'), ('refs', 'idx'), ('scores', 'idx'), ('hashes', 'key') ]
+
+    def _page(self, prefix, after, batch_size):
+        # one page of the merged keyspace: a key is listed once whatever
+        # tables it has rows in, and pages are ordered across all of them
+        low, high = prefix_range(prefix)
+        parts = []
+        params = []
+        for table, column in self.KEY_TABLES:
+            q = 'SELECT %s AS k FROM %s WHERE %s >= ? AND %s > ?' % (column, table, column, column)
+            params += [ low, after ]
+            if high is not None:
+                q += ' AND %s < ?' % column
+                params.append(high)
+            parts.append(q)
+
+        q = ' UNION '.join(parts) + ' ORDER BY k LIMIT ?'
+        params.append(batch_size)
+
+        trace_op('scan', [ prefix + '*' ])
+        with self.lock:
+            return [ row[0] for row in self.db.execute(q, params) ]
+
+    def key_batches(self, prefix = '', batch_size = 1000):
+        # every key under prefix, documents as well as index sets, sorted
+        # sets and hashes, like SCAN over a Redis keyspace; keyset
+        # pagination, so callers may delete the keys they were handed
+        after = ''
+        while True:
+            batch = self._page(prefix, after, batch_size)
+            if not batch:
+                break
+
+            yield batch
+            after = batch[-1]
+
+    def update_refs(self, add = None, remove = None):
+        add = list(add or [])
+        remove = list(remove or [])
+        trace_op('update_refs', [ index for index, _ in remove + add ])
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('DELETE FROM refs WHERE idx = ? AND member = ?', remove)
+            self.db.executemany('INSERT OR IGNORE INTO refs (idx, member) VALUES (?, ?)', add)
+
+    def get_refs(self, index):
+        trace_op('get_refs', [ index ])
+        with self.lock:
+            return trace_recv([ row[0] for row in self.db.execute(
+                        'SELECT member FROM refs WHERE idx = ? ORDER BY member', (index,)) ])
+
+    def update_scores(self, add = None, remove = None):
+        add = list(add or [])
+        remove = list(remove or [])
+        trace_op('update_scores', [ item[0] for item in remove + add ])
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('DELETE FROM scores WHERE idx = ? AND member = ?', remove)
+            self.db.executemany('INSERT OR REPLACE INTO scores (idx, member, score) VALUES (?, ?, ?)', add)
+
+    def get_scores(self, index, low = None, high = None, limit = None):
+        trace_op('get_scores', [ index ])
+        q = 'SELECT member, score FROM scores WHERE idx = ?'
+        params = [ index ]
+        if low is not None:
+            q += ' AND score >= ?'
+            params.append(low)
+        if high is not None:
+            q += ' AND score <= ?'
+            params.append(high)
+        q += ' ORDER BY score, member'
+        if limit:
+            q += ' LIMIT ?'
+            params.append(limit)
+
+        with self.lock:
+            return [ (row[0], row[1]) for row in self.db.execute(q, params) ]
+
+    def hash_put(self, key, fields):
+        if not fields:
+            return
+        trace_op('hash_put', [ key ], sent = sum(len(v) for v in fields.values()))
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)',
+                                [ (key, f, v) for f, v in fields.items() ])
+
+    def hash_get(self, key, fields, chunk = 500):
+        if not fields:
+            return []
+        trace_op('hash_get', [ key ])
+        result = {}
+        with self.lock:
+            for i in range(0, len(fields), chunk):
+                part = list(fields[i:i + chunk])
+                q = 'SELECT field, value FROM hashes WHERE key = ? AND field IN (%s)' % ','.join('?' * len(part))
+                result.update(self.db.execute(q, [ key ] + part))
+
+        return trace_recv([ result.get(f) for f in fields ])
+
+    def hash_remove(self, key, fields):
+        if not fields:
+            return
+        trace_op('hash_remove', [ key ])
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('DELETE FROM hashes WHERE key = ? AND field = ?', [ (key, f) for f in fields ])
+
+    def hash_swap(self, key, field, value):
+        trace_op('hash_swap', [ key ], sent = len(value or ''))
+        # IMMEDIATE takes the write lock before reading, other processes
+        # cannot slip a write in between
+        with self.lock, self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            row = self.db.execute('SELECT value FROM hashes WHERE key = ? AND field = ?', (key, field)).fetchone()
+            if value is None:
+                self.db.execute('DELETE FROM hashes WHERE key = ? AND field = ?', (key, field))
+            else:
+                self.db.execute('INSERT OR REPLACE INTO hashes (key, field, value) VALUES (?, ?, ?)', (key, field, value))
+        return trace_recv(row[0] if row else None)
+
+    def hash_incr(self, key, field, amount = 1, drop = False):
+        trace_op('hash_incr', [ key ])
+        with self.lock, self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute('INSERT INTO hashes (key, field, value) VALUES (?, ?, ?) '
+                            'ON CONFLICT (key, field) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value',
+                            (key, field, amount))
+            n = int(self.db.execute('SELECT value FROM hashes WHERE key = ? AND field = ?', (key, field)).fetchone()[0])
+            if drop and n <= 0:
+                self.db.execute('DELETE FROM hashes WHERE key = ? AND field = ?', (key, field))
+        return n
+
+    def hash_len(self, key):
+        trace_op('hash_len', [ key ])
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM hashes WHERE key = ?', (key,)).fetchone()[0]
+
+    def hash_batches(self, key, batch_size = 1000):
+        after = ''
+        while True:
+            trace_op('hash_scan', [ key ])
+            with self.lock:
+                batch = self.db.execute('SELECT field, value FROM hashes WHERE key = ? AND field > ? '
+                                        'ORDER BY field LIMIT ?', (key, after, batch_size)).fetchall()
+            if not batch:
+                break
+
+            yield trace_recv(batch)
+            after = batch[-1][0]
+
+    def append_changes(self, records):
+        trace_op('append_changes', [ CHANGEFEED_KEY ])
+        versions = []
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            for r in records:
+                c = self.db.execute('INSERT INTO changes (type, key, op) VALUES (?, ?, ?)',
+                                    (r['type'], r['key'], r['op']))
+                versions.append(c.lastrowid)
+
+            # trim in steps rather than on every append, like an approximate
+            # MAXLEN on a stream
+            if versions and versions[-1] % 1000 < len(versions):
+                self.db.execute('DELETE FROM changes WHERE version <= ?',
+                                (versions[-1] - self.changefeed_maxlen,))
+
+        return [ str(v) for v in versions ]
+
+    def last_change(self):
+        with self.lock:
+            row = self.db.execute('SELECT MAX(version) FROM changes').fetchone()
+        return str(row[0]) if row[0] is not None else None
+
+    def _changes(self, rows):
+        return [ (str(v), {'type': t, 'key': k, 'op': op}) for v, t, k, op in rows ]
+
+    def _wait(self, fn, block):
+        # no server side blocking read, poll until something shows up
+        result = fn()
+        if block is None or result:
+            return result
+
+        deadline = time.monotonic() + block / 1000
+        while not result and time.monotonic() < deadline:
+            time.sleep(0.05)
+            result = fn()
+        return result
+
+    def read_changes(self, after = None, count = 100, block = None):
+        def fn():
+            trace_op('read_changes', [ CHANGEFEED_KEY ])
+            with self.lock:
+                return self._changes(self.db.execute(
+                        'SELECT version, type, key, op FROM changes WHERE version > ? ORDER BY version LIMIT ?',
+                        (int(after or 0), count)))
+
+        return self._wait(fn, block)
+
+    def create_change_group(self, group, start = '$'):
+        with self.lock:
+            if start == '$':
+                row = self.db.execute('SELECT MAX(version) FROM changes').fetchone()
+                start = row[0] or 0
+            self.db.execute('INSERT OR IGNORE INTO change_groups (grp, last) VALUES (?, ?)', (group, int(start)))
+
+    def _deliver(self, group, consumer, count):
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            row = self.db.execute('SELECT last FROM change_groups WHERE grp = ?', (group,)).fetchone()
+            if not row:
+                raise OCSNException(OCSNError.NOT_FOUND, 'no such consumer group: ' + group)
+
+            rows = self.db.execute(
+                    'SELECT version, type, key, op FROM changes WHERE version > ? ORDER BY version LIMIT ?',
+                    (row[0], count)).fetchall()
+            if rows:
+                self.db.execute('UPDATE change_groups SET last = ? WHERE grp = ?', (rows[-1][0], group))
+                self.db.executemany('INSERT OR REPLACE INTO change_pending (grp, version, consumer) VALUES (?, ?, ?)',
+                                    [ (group, r[0], consumer) for r in rows ])
+
+        return self._changes(rows)
+
+    def read_change_group(self, group, consumer, count = 100, block = None, pending_after = None):
+        if pending_after is None:
+            return self._wait(lambda: self._deliver(group, consumer, count), block)
+
+        with self.lock:
+            rows = self.db.execute(
+                    'SELECT p.version, c.type, c.key, c.op FROM change_pending p '
+                    'LEFT JOIN changes c ON c.version = p.version '
+                    'WHERE p.grp = ? AND p.consumer = ? AND p.version > ? ORDER BY p.version LIMIT ?',
+                    (group, consumer, int(pending_after), count)).fetchall()
+
+        # changes trimmed away while pending come back without fields
+        return [ (str(v), {'type': t, 'key': k, 'op': op} if k is not None else {}) for v, t, k, op in rows ]
+
+    def ack_changes(self, group, versions):
+        with self.lock, self.db:
+            self.db.execute('BEGIN')
+            self.db.executemany('DELETE FROM change_pending WHERE grp = ? AND version = ?',
+                                [ (group, int(v)) for v in versions ])
+
+    def list(self, prefix = ''):
+        low, high = prefix_range(prefix)
+        after = ''
+        while True:
+            q = 'SELECT key, value FROM kv WHERE key >= ? AND key > ?'
+            params = [ low, after ]
+            if high is not None:
+                q += ' AND key < ?'
+                params.append(high)
+            q += ' ORDER BY key LIMIT 1000'
+
+            with self.lock:
+                rows = self.db.execute(q, params).fetchall()
+
+            trace_op('list', [ r[0] for r in rows ])
+            trace_recv([ r[1] for r in rows ])
+
+            if not rows:
+                break
+
+            for _, value in rows:
+                yield value
+            after = rows[-1][0]
+
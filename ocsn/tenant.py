@@ -1,4 +1,6 @@
-from .ocsn_types import OCSNTenant, OCSNUser, OCSNVBucket
+import time
+
+from .ocsn_types import *
 from .redis_client import *
 
 
@@ -10,6 +12,37 @@ class OCSNTenantCtl:
         for item in self.client.list(OCSNTenant.get_prefix()):
             yield OCSNTenant().decode_json(item)
 
+    def remove_cascade(self, tenant_id, batch_size = 1000, throttle = None):
+        prefix = OCSNUser(tenant_id).get_prefix() + '/'
+        users = self.client.unlink_many(self.client.keys(prefix), batch_size, throttle, op = 'remove')
+
+        vbuckets = 0
+        for keys in self.client.key_batches(OCSNVBucket(tenant_id, None).get_prefix_opt(), batch_size):
+            refs = []
+            map_keys = []
+            for k, item in zip(keys, self.client.get_many(keys)):
+                vb = entity_for_key(k)
+                if vb and vb.decode_json(item):
+                    refs += vb.get_refs()
+                    if vb.hashed:
+                        for r in vb.mapping_refs(self.client, batch_size):
+                            self.client.update_refs(remove = r)
+                        map_keys += [ vb.get_map_key(), vb.get_counts_key() ]
+
+            self.client.update_refs(remove = refs)
+            self.client.unlink(map_keys)
+            vbuckets += self.client.unlink_many(keys, batch_size, op = 'remove')
+
+            if throttle:
+                time.sleep(throttle)
+
+        OCSNTenant(id = tenant_id).remove(self.client)
+
+        return {'tenant_id': tenant_id,
+                'users': users,
+                'vbuckets': vbuckets,
+                }
+
 class OCSNUserCtl:
     def __init__(self, client, tenant_id):
         self.client = client
@@ -0,0 +1,128 @@
+import contextvars
+import os
+import time
+
+from contextlib import contextmanager
+
+
+# the trace of the operation (CLI command, server request) running in the
+# current thread/context, None when nothing is being traced
+current_trace = contextvars.ContextVar('ocsn_trace', default = None)
+
+TRACE_MAX_KEYS = 1000
+
+# single-key reads of the same prefix within one operation before it is
+# reported as an N+1 pattern (a loop that should be a get_many())
+TRACE_NPLUS1 = int(os.environ.get('OCSN_TRACE_NPLUS1', 3))
+
+SINGLE_KEY_OPS = ('get', 'get_refs', 'get_scores')
+
+
+def key_prefix(key):
+    # the entity type ('bi/', 'svc/', ...), so that loading the bis of
+    # several service instances one by one is caught too
+    i = key.find('/')
+    return key[:i + 1] if i >= 0 else key
+
+def payload_size(v):
+    if v is None:
+        return 0
+    if isinstance(v, (str, bytes)):
+        return len(v)
+    if isinstance(v, (list, tuple)):
+        return sum(payload_size(x) for x in v)
+    return 0
+
+
+class OCSNTrace:
+    # what one operation asked of the backend: round trips (a pipeline is
+    # one), keys, payload bytes each way, and the keys themselves
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.ops = 0
+        self.by_op = {}
+        self.nkeys = 0
+        self.sent = 0
+        self.received = 0
+        self.keys = []
+        self.dropped = 0
+        self.singles = {} # (op, key prefix) -> count of single-key calls
+
+    def record(self, op, keys, sent = 0):
+        self.ops += 1
+        self.by_op[op] = self.by_op.get(op, 0) + 1
+        self.sent += sent
+
+        keys = list(keys)
+        self.nkeys += len(keys)
+
+        if op in SINGLE_KEY_OPS and len(keys) == 1:
+            p = (op, key_prefix(keys[0]))
+            self.singles[p] = self.singles.get(p, 0) + 1
+
+        for k in keys:
+            if len(self.keys) < TRACE_MAX_KEYS:
+                self.keys.append(k)
+            else:
+                self.dropped += 1
+
+    def recv(self, nbytes):
+        self.received += nbytes
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.start
+        return self
+
+    def n_plus_one(self):
+        result = [ {'op': op, 'prefix': prefix, 'count': n}
+                   for (op, prefix), n in self.singles.items() if n >= TRACE_NPLUS1 ]
+        return sorted(result, key = lambda r: -r['count'])
+
+    def summary(self):
+        return {'op': self.name,
+                'elapsed_ms': round(self.elapsed * 1000, 3) if self.elapsed is not None else None,
+                'round_trips': self.ops,
+                'by_op': self.by_op,
+                'keys': self.nkeys,
+                'bytes_sent': self.sent,
+                'bytes_received': self.received,
+                'n_plus_one': self.n_plus_one(),
+                }
+
+    def encode(self):
+        result = self.summary()
+        result['keys_touched'] = self.keys
+        result['keys_dropped'] = self.dropped
+        return result
+
+
+def trace_op(op, keys = (), sent = 0):
+    # hook called by the backends for every call that reaches the store
+    t = current_trace.get()
+    if t is not None:
+        t.record(op, keys, sent)
+
+def trace_recv(result):
+    # hook for the payload a read brought back; returns it unchanged
+    t = current_trace.get()
+    if t is not None:
+        t.recv(payload_size(result))
+    return result
+
+def start_trace(name):
+    t = OCSNTrace(name)
+    return t, current_trace.set(t)
+
+def end_trace(t, token):
+    current_trace.reset(token)
+    return t.finish()
+
+@contextmanager
+def tracing(name):
+    t, token = start_trace(name)
+    try:
+        yield t
+    finally:
+        end_trace(t, token)
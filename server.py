@@ -1,44 +1,147 @@
-from flask import Flask, request
+# Single process (development):
+#
+#   python server.py --port 5000
+#
+# Pre-forked workers, one per core by default:
+#
+#   python server.py --port 5000 --workers 8
+#
+# or under gunicorn, with the hooks in gunicorn.conf.py:
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# The catalog backend is selected by OCSN_BACKEND (see ocsn.backend). Each
+# worker opens its own backend connections after the fork and warms the
+# service/service instance catalog before serving.
+
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import argparse
+
+from flask import Flask, Response, request, abort, current_app, g
 
 from ocsn.ocsn_types import *
-from ocsn.redis_client import RedisClient, redis_client
+from ocsn.cache import OCSNCache
+from ocsn.catalog import OCSNCatalog
+from ocsn.coninfo import OCSNConInfoCtl
+from ocsn.service import OCSNS3CredsLookup
+from ocsn.changefeed import OCSNChangeFeed, OCSNChangeFilter, OCSNChangeWatcher
+from ocsn.singleflight import OCSNReader, OCSNHotKeyCache
+from ocsn.profiling import OCSNProfiler
+from ocsn.backend import open_backend
+
+
+class OCSNServerState:
+    def __init__(self, backend_url = None):
+        self.backend_url = backend_url
+        self.pid = None
+
+        # profiles go to OCSN_PROFILE_DIR for requests sent with an
+        # X-OCSN-Profile header and for a random OCSN_PROFILE_SAMPLE share
+        # of all requests; OCSN_SLOW_MS enables the slow request log
+        self.profiler = OCSNProfiler.env()
+        self.profile_sample = float(os.environ.get('OCSN_PROFILE_SAMPLE', 0))
+
+    def get(self):
+        # connection pools must not be shared across fork(), so they are
+        # (re)created the first time a process touches them
+        if self.pid != os.getpid():
+            self.client = open_backend(self.backend_url)
+            # attached first: the coninfo cache is rebuilt from the catalog,
+            # so a changed entry must be gone from it before that is evicted
+            self.catalog = OCSNCatalog(self.client, float(os.environ.get('OCSN_CATALOG_TTL', 60))).attach()
+
+            # optional in-process cache for access key lookups, e.g. OCSN_CREDS_CACHE_TTL=30
+            creds_cache = None
+            if float(os.environ.get('OCSN_CREDS_CACHE_TTL', 0)) > 0:
+                creds_cache = OCSNCache(float(os.environ['OCSN_CREDS_CACHE_TTL']))
+
+            self.creds_lookup = OCSNS3CredsLookup(self.client, creds_cache).attach()
+
+            # connection info cache, e.g. OCSN_CONINFO_CACHE_TTL=30; holds
+            # secrets, so it only ever lives in process memory
+            coninfo_cache = None
+            if float(os.environ.get('OCSN_CONINFO_CACHE_TTL', 0)) > 0:
+                coninfo_cache = OCSNCache(float(os.environ['OCSN_CONINFO_CACHE_TTL']))
+
+            self.coninfo = OCSNConInfoCtl(self.client, coninfo_cache, self.catalog).attach()
 
+            # reads of the same key by concurrent requests are coalesced;
+            # keys read often enough are also cached for OCSN_HOTKEY_TTL
+            # seconds, e.g. OCSN_HOTKEY_TTL=1 OCSN_HOTKEY_THRESHOLD=20
+            hot = None
+            if float(os.environ.get('OCSN_HOTKEY_TTL', 0)) > 0:
+                hot = OCSNHotKeyCache(float(os.environ['OCSN_HOTKEY_TTL']),
+                                      int(os.environ.get('OCSN_HOTKEY_THRESHOLD', 20)))
+
+            self.reader = OCSNReader(self.client, hot).attach()
+
+            # the catalog and the caches above are evicted right away on
+            # writes made by this process, and through the change feed on
+            # writes made by others
+            self.watcher = OCSNChangeWatcher(self.client).start()
+
+            self.caches = {'creds': creds_cache, 'coninfo': coninfo_cache, 'hotkeys': hot,
+                           'singleflight': self.reader.flight}
+            self.pid = os.getpid()
+
+        return self
+
+    def warm(self):
+        return self.get().catalog.warm()
+
+
+def state():
+    return current_app.extensions['ocsn'].get()
 
-app = Flask(__name__)
-app.json_encoder = OCSNEntityJSONEncoder
 
-@app.route('/')
 def index():
     return 'index!'
 
-@app.route('/user/<username>', methods = ['GET', 'POST', 'DELETE'])
-def user_handler(username):
+def user_handler(tenant_id, user_id):
+    s = state()
+    client = s.client
+
     #GET
     if request.method == 'GET':
-        u = OCSNUser(id = username).load(redis_client)
+        u = s.reader.load(OCSNUser(tenant_id, id = user_id))
+        if not u:
+            abort(404)
         return u.encode_json()
 
+    if request.method == 'DELETE':
+        OCSNUser(tenant_id, id = user_id).remove(client)
+        return ''
+
     # POST
     data = request.get_data()
-    u = OCSNUser(id = username)
+    u = OCSNUser(tenant_id, id = user_id)
     u = u.decode_json(data)
     if u:
-        u.id = username # force provided id
-        u.store(redis_client)
+        u.id = user_id # force provided id
+        u.store(client)
 
     return ''
 
-@app.route('/svc/<service>', methods = ['GET', 'POST', 'DELETE'])
 def svc_handler(service):
+    s = state()
+
     #GET
     if request.method == 'GET':
-        svc = OCSNService(id = service).load(redis_client)
+        svc = s.catalog.service(service)
+        if not svc:
+            abort(404)
         return svc.encode_json()
 
     if request.method == 'DELETE':
-        svc = OCSNService(id = service).load(redis_client)
+        svc = OCSNService(id = service).load(s.client)
         if svc:
-            svc.remove()
+            svc.remove(s.client)
+            s.catalog.invalidate(svc)
         return ''
 
     # POST
@@ -47,24 +150,238 @@ def svc_handler(service):
     svc = svc.decode_json(data)
     if svc:
         svc.id = service # force provided id
-        svc.store(redis_client)
+        s.catalog.update(svc)
+        svc.store(s.client)
 
     return ''
 
-@app.route('/svci/<id>', methods = ['GET', 'POST', 'DELETE'])
 def svci_handler(id):
+    s = state()
+
     #GET
     if request.method == 'GET':
-        svci = OCSNServiceInstance(id = id).load(redis_client)
+        svci = s.catalog.service_instance(id)
+        if not svci:
+            abort(404)
         return svci.encode_json()
 
+    if request.method == 'DELETE':
+        svci = OCSNServiceInstance(id = id).load(s.client)
+        if svci:
+            svci.remove(s.client)
+            s.catalog.invalidate(svci)
+        return ''
+
     # POST
     data = request.get_data()
     svci = OCSNServiceInstance(id = id)
     svci = svci.decode_json(data)
     if svci:
         svci.id = id # force provided id
-        svci.store(redis_client)
+        s.catalog.update(svci)
+        svci.store(s.client)
 
     return ''
 
+def coninfo_handler(tenant_id, user_id, vbucket_id):
+    s = state()
+    result = s.reader.do(('coninfo', tenant_id, user_id, vbucket_id),
+                         lambda: s.coninfo.get(tenant_id, user_id, vbucket_id))
+
+    return json.dumps(result)
+
+def stats_handler():
+    caches = state().caches
+
+    return json.dumps({ name: c.stats() for name, c in caches.items() if c })
+
+WATCH_HEARTBEAT = 15      # seconds between SSE keep-alive comments
+WATCH_MAX_TIMEOUT = 60    # upper bound for a long-poll wait
+WATCH_BATCH = 100
+
+def watch_handler():
+    # GET /watch?prefix=svc/&prefix=b/t1/&tenant=t1&since=<version>
+    #
+    # Streams change events as SSE when the client accepts
+    # text/event-stream, answers a long-poll otherwise. Both resume after
+    # the version given by 'since' or, for SSE reconnects, Last-Event-ID;
+    # without one they start with changes made from now on.
+    feed = OCSNChangeFeed(state().client)
+    filt = OCSNChangeFilter(request.args.getlist('prefix'), request.args.get('tenant'))
+
+    since = request.headers.get('Last-Event-ID') or request.args.get('since') or feed.latest()
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return Response(watch_events(feed, filt, since), mimetype = 'text/event-stream',
+                        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    timeout = min(float(request.args.get('timeout', 30)), WATCH_MAX_TIMEOUT)
+    deadline = time.monotonic() + timeout
+
+    changes = []
+    while not changes:
+        block = int((deadline - time.monotonic()) * 1000)
+        if block <= 0:
+            break
+
+        batch = feed.read(since, WATCH_BATCH, block)
+        if not batch:
+            break
+
+        # the returned version moves past filtered out changes too, so the
+        # next poll does not scan them again
+        since = batch[-1].version
+        changes = [ c.encode() for c in batch if filt.match(c) ]
+
+    return json.dumps({'version': since, 'changes': changes})
+
+def watch_events(feed, filt, since):
+    # runs after the request context is gone, everything it needs is passed in
+    yield 'retry: 2000\n\n'
+
+    while True:
+        batch = feed.read(since, WATCH_BATCH, WATCH_HEARTBEAT * 1000)
+        if not batch:
+            yield ': keep-alive\n\n'
+            continue
+
+        events = []
+        for c in batch:
+            since = c.version
+            if filt.match(c):
+                events.append('id: %s\nevent: change\ndata: %s\n\n' % (c.version, json.dumps(c.encode())))
+
+        if events:
+            yield ''.join(events)
+
+def profile_begin():
+    if request.endpoint == 'watch_handler':
+        return # long lived by design
+
+    s = current_app.extensions['ocsn']
+    profile = bool(request.headers.get('X-OCSN-Profile')) or random.random() < s.profile_sample
+
+    g.ocsn_op = s.profiler.start(request.method + ' ' + request.path, profile)
+
+def trace_headers(response):
+    # per-request backend accounting; the N+1 report names key prefixes,
+    # so it is only added when asked for with an X-OCSN-Trace header
+    op = g.get('ocsn_op')
+    if not op:
+        return response
+
+    t = op[0]
+    response.headers['X-OCSN-Round-Trips'] = str(t.ops)
+    response.headers['X-OCSN-Keys'] = str(t.nkeys)
+    response.headers['X-OCSN-Bytes'] = '%d/%d' % (t.sent, t.received)
+
+    if request.headers.get('X-OCSN-Trace'):
+        n_plus_one = t.n_plus_one()
+        if n_plus_one:
+            response.headers['X-OCSN-N-Plus-One'] = ', '.join(
+                    '%s %s*x%d' % (r['op'], r['prefix'], r['count']) for r in n_plus_one)
+
+    return response
+
+def profile_end(exc):
+    op = g.pop('ocsn_op', None)
+    if op:
+        current_app.extensions['ocsn'].profiler.finish(op)
+
+def s3_creds_handler(access_key):
+    s = state()
+    result = s.reader.do(('creds', access_key), lambda: s.creds_lookup.lookup(access_key))
+    if not result:
+        abort(404)
+
+    return json.dumps([ c.encode() for c in result ])
+
+
+def create_app(backend_url = None, warm = True):
+    app = Flask(__name__)
+    app.json_encoder = OCSNEntityJSONEncoder
+
+    app.extensions['ocsn'] = OCSNServerState(backend_url or os.environ.get('OCSN_BACKEND'))
+
+    app.add_url_rule('/', view_func = index)
+    app.add_url_rule('/user/<tenant_id>/<user_id>', view_func = user_handler, methods = ['GET', 'POST', 'DELETE'])
+    app.add_url_rule('/svc/<service>', view_func = svc_handler, methods = ['GET', 'POST', 'DELETE'])
+    app.add_url_rule('/svci/<id>', view_func = svci_handler, methods = ['GET', 'POST', 'DELETE'])
+    app.add_url_rule('/creds/s3/<access_key>', view_func = s3_creds_handler, methods = ['GET'])
+    app.add_url_rule('/coninfo/<tenant_id>/<user_id>/<vbucket_id>', view_func = coninfo_handler, methods = ['GET'])
+    app.add_url_rule('/stats', view_func = stats_handler, methods = ['GET'])
+    app.add_url_rule('/watch', view_func = watch_handler, methods = ['GET'])
+
+    app.before_request(profile_begin)
+    app.after_request(trace_headers)
+    app.teardown_request(profile_end)
+
+    if warm:
+        app.extensions['ocsn'].warm()
+
+    return app
+
+
+def run_prefork(app, host, port, workers):
+    from werkzeug.serving import make_server
+
+    # the listening socket is shared, connections to the backend are not:
+    # each child opens its own after the fork and warms its catalog
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            app.extensions['ocsn'].warm()
+            make_server(host, port, app, threaded = True, fd = sock.fileno()).serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='OCSN API server',
+        usage='server.py [--host HOST] [--port PORT] [--workers N]')
+
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 5000)
+    parser.add_argument('--workers', type = int, default = 1,
+                        help = 'number of pre-forked worker processes (0 = one per core)')
+    parser.add_argument('--backend')
+
+    args = parser.parse_args(sys.argv[1:])
+
+    workers = args.workers or os.cpu_count()
+
+    if workers == 1:
+        create_app(args.backend).run(host = args.host, port = args.port, threaded = True)
+        return
+
+    # build the app in the parent but defer backend connections to the workers
+    run_prefork(create_app(args.backend, warm = False), args.host, args.port, workers)
+
+
+if __name__ == "__main__":
+    main()
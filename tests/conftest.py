@@ -0,0 +1,97 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# cli.py opens its backend at import time; the tests never need Redis
+os.environ['OCSN_BACKEND'] = 'sqlite://'
+
+import cli
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.ocsn_types import *
+from ocsn.sqlite_client import SQLiteClient
+
+
+@pytest.fixture
+def client(monkeypatch):
+    c = SQLiteClient()
+    monkeypatch.setattr(cli, 'redis_client', c)
+    monkeypatch.setattr(cli.output, 'format', 'json')
+    return c
+
+
+@pytest.fixture
+def ocsn(client, capsys, monkeypatch):
+    # runs a cli command and returns its output, decoded if it is JSON
+    def run(*args):
+        capsys.readouterr()
+        monkeypatch.setattr(sys, 'argv', [ 'ocsn' ] + list(args))
+        cli.main()
+        out = capsys.readouterr().out
+        try:
+            return json.loads(out)
+        except ValueError:
+            return out
+
+    return run
+
+
+def setup_catalog(ocsn, bis = 2):
+    ocsn('svc', 'create', '--svc-id', 'svc0', '--name', 'svc 0', '--endpoint', 'https://s3.example.com')
+    ocsn('svci', 'create', '--svci-id', 'svci0', '--svc-id', 'svc0', '--name', 'svci 0')
+    for i in range(bis):
+        ocsn('bi', 'create', '--svci-id', 'svci0', '--bi-id', 'bi%d' % i, '--bucket', 'bucket%d' % i)
+    ocsn('tenant', 'create', '--tenant-id', 't0', '--name', 'tenant 0')
+    ocsn('user', 'create', '--tenant-id', 't0', '--user-id', 'u0', '--name', 'user 0')
+    ocsn('vbucket', 'create', '--tenant-id', 't0', '--user-id', 'u0', '--vbucket-id', 'vb0', '--name', 'vbucket 0')
+
+VB = [ '--tenant-id', 't0', '--user-id', 'u0', '--vbucket-id', 'vb0' ]
+
+
+def docs(client):
+    result = {}
+    for prefix in entity_prefixes:
+        keys = list(client.keys(prefix))
+        result.update((k, json.loads(v)) for k, v in zip(keys, client.get_many(keys)))
+    return result
+
+
+def hashes(client, prefix):
+    return { k: dict(f for batch in client.hash_batches(k) for f in batch) for k in set(client.keys(prefix)) }
+
+
+def refs(client):
+    # the derived indexes: reverse index sets and the per-bi counts of
+    # hashed vbuckets (the created index is not derived, see rebuild())
+    result = {}
+    for k in set(client.keys('idx/')):
+        if k.startswith(CREATED_INDEX_PREFIX):
+            continue
+        members = client.get_refs(k)
+        if members:
+            result[k] = members
+    result.update(hashes(client, 'idx/vbucket-bis/'))
+    return result
+
+
+def setup_mappings(ocsn, monkeypatch):
+    # vb0 goes over the threshold and keeps its mappings in a hash, vb1 does not
+    monkeypatch.setattr(ocsn_types, 'VBUCKET_HASH_THRESHOLD', 3)
+    setup_catalog(ocsn, bis = 3)
+
+    ocsn('creds', 'create', '--svci-id', 'svci0', '--creds-id', 'c0', '--access-key', 'AK0', '--secret', 's0')
+    ocsn('bi', 'modify', '--svci-id', 'svci0', '--bi-id', 'bi2', '--bucket', 'bucket2', '--creds-id', 'c0')
+    ocsn('vbucket', 'create', '--tenant-id', 't0', '--user-id', 'u0', '--vbucket-id', 'vb1', '--name', 'vbucket 1')
+
+    for i in range(5):
+        ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi%d' % (i % 3), '--entry-id', 'e%d' % i)
+    ocsn('vbucket', 'unmap', *VB, '--entry-id', 'e3')
+    ocsn('vbucket', 'map', '--tenant-id', 't0', '--user-id', 'u0', '--vbucket-id', 'vb1',
+         '--svci-id', 'svci0', '--bi-id', 'bi1', '--entry-id', 'e0')
+
+    ocsn('flow', 'create', '--group-id', 'g0', '--source-svc-id', 'svc0', '--dest-svc-id', 'svc1')
+    ocsn('flow', 'symmetric', '--group-id', 'g1', '--endpoint', 'svc0:a', '--endpoint', 'svc1:b')
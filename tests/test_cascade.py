@@ -0,0 +1,45 @@
+from ocsn.ocsn_types import *
+
+from conftest import setup_catalog, setup_mappings, docs, hashes, refs, VB
+
+
+def test_svci_cascade_removes_subtree_and_flags_vbuckets(ocsn, client, monkeypatch):
+    setup_mappings(ocsn, monkeypatch)
+
+    result = ocsn('svci', 'remove', '--svci-id', 'svci0', '--cascade', '--batch-size', '2')
+    assert result == {'svci_id': 'svci0', 'bis': 3, 'creds': 1,
+                      'flagged_vbuckets': [ 'b/t0/u0/vb0', 'b/t0/u0/vb1' ]}
+
+    left = docs(client)
+    assert not [ k for k in left if k.startswith(('svci/', 'bi/', 'creds/')) ]
+    assert not [ k for k in refs(client) if 'svci0' in k ]
+
+    # vbuckets are only reported, their mappings stay as they were
+    info = ocsn('vbucket', 'info', *VB)
+    assert len(info) == 4
+    assert set(r['bucket'] for r in info) == { None }
+
+
+def test_svci_cascade_without_indexes_scans_the_subtree(ocsn, client):
+    setup_catalog(ocsn, bis = 2)
+    ocsn('creds', 'create', '--svci-id', 'svci0', '--creds-id', 'c0', '--access-key', 'AK0', '--secret', 's0')
+    client.unlink([ svci_bis_index('svci0'), svci_creds_index('svci0') ])
+
+    result = ocsn('svci', 'remove', '--svci-id', 'svci0', '--cascade')
+    assert (result['bis'], result['creds']) == (2, 1)
+    assert not [ k for k in docs(client) if k.startswith(('svci/', 'bi/', 'creds/')) ]
+
+
+def test_tenant_cascade_drops_vbucket_refs_and_hashes(ocsn, client, monkeypatch):
+    setup_mappings(ocsn, monkeypatch)
+    ocsn('user', 'create', '--tenant-id', 't0', '--user-id', 'u1', '--name', 'user 1')
+
+    result = ocsn('tenant', 'remove', '--tenant-id', 't0', '--cascade', '--batch-size', '1')
+    assert result == {'tenant_id': 't0', 'users': 2, 'vbuckets': 2}
+
+    assert not [ k for k in docs(client) if k.startswith(('t/', 'u/', 'b/')) ]
+    assert hashes(client, VBUCKET_MAP_PREFIX) == {}
+    assert not [ k for k in refs(client) if k.startswith(('idx/bi-vbuckets/', 'idx/vbucket-bis/')) ]
+
+    # the rest of the catalog is untouched
+    assert ocsn('svci', 'bis', '--svci-id', 'svci0') == [ 'bi0', 'bi1', 'bi2' ]
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.catalog import OCSNCatalog
+from ocsn.ocsn_types import *
+
+from conftest import setup_catalog, VB
+
+
+def vbuckets_of(ocsn, bi_id):
+    return [ r['vbucket_id'] for r in ocsn('bi', 'vbuckets', '--svci-id', 'svci0', '--bi-id', bi_id) ]
+
+
+def test_hashed_unmap_keeps_shared_bi_ref(ocsn, client, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'VBUCKET_HASH_THRESHOLD', 2)
+    setup_catalog(ocsn)
+
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'xa')
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'xb')
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi1', '--entry-id', 'xc')
+
+    vb = OCSNVBucket('t0', 'u0', id = 'vb0').load(client)
+    assert vb.hashed
+
+    ocsn('vbucket', 'unmap', *VB, '--entry-id', 'xa')
+    assert vbuckets_of(ocsn, 'bi0') == [ 'vb0' ]
+
+    ocsn('vbucket', 'unmap', *VB, '--entry-id', 'xb')
+    assert vbuckets_of(ocsn, 'bi0') == []
+    assert vbuckets_of(ocsn, 'bi1') == [ 'vb0' ]
+
+    # remapping the last entry of a bi moves the ref
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'xc')
+    assert vbuckets_of(ocsn, 'bi0') == [ 'vb0' ]
+    assert vbuckets_of(ocsn, 'bi1') == []
+
+
+def test_vbucket_info_lists_hashed_entries(ocsn, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'VBUCKET_HASH_THRESHOLD', 2)
+    setup_catalog(ocsn, bis = 4)
+
+    for i in range(4):
+        entry = ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi%d' % i, '--entry-id', 'e%d' % i)
+        assert entry == {'entry_id': 'e%d' % i, 'svci': 'svci0', 'bi': 'bi%d' % i}
+
+    info = ocsn('vbucket', 'info', *VB)
+    assert sorted((r['entry_id'], r['bucket']) for r in info) == [ ('e%d' % i, 'bucket%d' % i) for i in range(4) ]
+
+    assert ocsn('vbucket', 'unmap', *VB, '--entry-id', 'e1') == {'entry_id': 'e1', 'svci': 'svci0', 'bi': 'bi1'}
+    assert len(ocsn('vbucket', 'info', *VB)) == 3
+
+
+def hashed_vbucket(ocsn, client, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'VBUCKET_HASH_THRESHOLD', 2)
+    setup_catalog(ocsn)
+    for i in range(3):
+        ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi1', '--entry-id', 'e%d' % i)
+    assert OCSNVBucket('t0', 'u0', id = 'vb0').load(client).hashed
+
+
+def counts(client):
+    return dict(f for b in client.hash_batches(vbucket_bis_index('t0', 'u0', 'vb0')) for f in b)
+
+
+def test_concurrent_maps_of_one_entry_count_once(ocsn, client, monkeypatch):
+    hashed_vbucket(ocsn, client, monkeypatch)
+
+    barrier = threading.Barrier(8)
+    def map_x():
+        vb = OCSNVBucket('t0', 'u0', id = 'vb0').load(client)
+        barrier.wait()
+        vb.map_entry(client, 'x', OCSNBucketInstance('svci0', id = 'bi0'))
+
+    threads = [ threading.Thread(target = map_x) for i in range(8) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert counts(client) == {'svci0/bi0': '1', 'svci0/bi1': '3'}
+
+    OCSNVBucket('t0', 'u0', id = 'vb0').load(client).unmap_entry(client, 'x')
+    assert counts(client) == {'svci0/bi1': '3'}
+    assert vbuckets_of(ocsn, 'bi0') == []
+
+
+class RemoveHook:
+    # runs hook() right before the first ref removal reaches the backend
+    def __init__(self, client, hook):
+        self.client = client
+        self.hook = hook
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def update_refs(self, add = None, remove = None):
+        if remove and self.hook:
+            hook, self.hook = self.hook, None
+            hook()
+        return self.client.update_refs(add = add, remove = remove)
+
+
+def test_unmap_racing_map_of_same_bi_keeps_ref(ocsn, client, monkeypatch):
+    hashed_vbucket(ocsn, client, monkeypatch)
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'xa')
+
+    # another writer maps xb to bi0 after xa's unmap took the count to zero
+    def map_xb():
+        OCSNVBucket('t0', 'u0', id = 'vb0').load(client).map_entry(client, 'xb', OCSNBucketInstance('svci0', id = 'bi0'))
+
+    vb = OCSNVBucket('t0', 'u0', id = 'vb0').load(client)
+    vb.unmap_entry(RemoveHook(client, map_xb), 'xa')
+
+    assert counts(client)['svci0/bi0'] == '1'
+    assert vbuckets_of(ocsn, 'bi0') == [ 'vb0' ]
+
+
+def test_unmap_migrates_large_inline_vbucket(ocsn, client, monkeypatch):
+    setup_catalog(ocsn)
+    for i in range(4):
+        ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi%d' % (i % 2), '--entry-id', 'e%d' % i)
+    assert not OCSNVBucket('t0', 'u0', id = 'vb0').load(client).hashed
+
+    # the threshold is lowered below what the vbucket already holds
+    monkeypatch.setattr(ocsn_types, 'VBUCKET_HASH_THRESHOLD', 2)
+    ocsn('vbucket', 'unmap', *VB, '--entry-id', 'e0')
+
+    vb = OCSNVBucket('t0', 'u0', id = 'vb0').load(client)
+    assert vb.hashed and not vb.mappings
+    assert counts(client) == {'svci0/bi0': '1', 'svci0/bi1': '2'}
+    assert sorted(r['entry_id'] for r in ocsn('vbucket', 'info', *VB)) == [ 'e1', 'e2', 'e3' ]
+    assert vbuckets_of(ocsn, 'bi0') == [ 'vb0' ]
+
+
+def test_expired_catalog_reloads_once(client):
+    OCSNService(id = 'svc0', name = 'svc 0').store(client)
+
+    catalog = OCSNCatalog(client, ttl = 60)
+    catalog.warm()
+    catalog.loaded -= 120
+
+    warms = []
+    warm = catalog.warm
+
+    def slow_warm():
+        warms.append(1)
+        time.sleep(0.1)
+        return warm()
+
+    catalog.warm = slow_warm
+
+    found = []
+    threads = [ threading.Thread(target = lambda: found.append(catalog.service('svc0'))) for _ in range(8) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(warms) == 1
+    assert [ svc.id for svc in found ] == [ 'svc0' ] * 8
@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.cache import OCSNCache
+from ocsn.changefeed import *
+from ocsn.ocsn_types import *
+from ocsn.sqlite_client import SQLiteClient
+
+
+def test_watcher_evicts_changes_of_other_processes(tmp_path):
+    path = str(tmp_path / 'ocsn.db')
+    ours = SQLiteClient(path)
+    theirs = SQLiteClient(path)
+
+    cache = OCSNCache(60)
+    svc = OCSNService(id = 'svc0', name = 'svc 0', endpoint = 'https://s3.example.com')
+    cache.put('svc0', 'cached', deps = [ svc.get_key() ])
+
+    def listener(key, op):
+        cache.invalidate_dep(key)
+
+    add_mutation_listener(listener)
+    watcher = OCSNChangeWatcher(ours, block = 50).start()
+    try:
+        # what store() does in another process: no in-process notification
+        theirs.put(svc.get_key(), svc.encode_json())
+        theirs.append_changes([ change_record(svc.get_key(), 'store') ])
+
+        deadline = time.monotonic() + 5
+        while cache.get('svc0') is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+        assert cache.get('svc0') is None
+    finally:
+        watcher.stop()
+        remove_mutation_listener(listener)
+
+
+@pytest.fixture(params = [ 'sqlite', 'redis' ])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    if request.param == 'sqlite':
+        return SQLiteClient()
+
+    fakeredis = pytest.importorskip('fakeredis')
+    from ocsn.redis_client import RedisClient
+    client = RedisClient()
+    client.client = fakeredis.FakeRedis()
+    return client
+
+
+def test_store_and_remove_append_changes(backend):
+    feed = OCSNChangeFeed(backend)
+    assert feed.latest() is None
+
+    svc = OCSNService(id = 'svc0', name = 'svc 0', endpoint = 'https://s3.example.com')
+    svc.store(backend)
+    svc.remove(backend)
+
+    changes = feed.read()
+    assert [ (c.type, c.key, c.op) for c in changes ] == [ ('svc', 'svc/svc0', 'store'), ('svc', 'svc/svc0', 'remove') ]
+    assert feed.latest() == changes[-1].version
+
+    # resuming after a version only returns what came later
+    assert [ c.op for c in feed.read(changes[0].version) ] == [ 'remove' ]
+    assert feed.read(changes[-1].version) == []
+
+
+def test_feed_is_capped():
+    # trimmed approximately, every 1000 versions
+    client = SQLiteClient(changefeed_maxlen = 3)
+    for i in range(1000):
+        client.append_changes([ change_record('svc/svc%d' % i, 'store') ])
+
+    changes = OCSNChangeFeed(client).read(count = 2000)
+    assert [ c.key for c in changes ] == [ 'svc/svc%d' % i for i in range(997, 1000) ]
+
+
+def test_consumer_group_splits_and_redelivers_pending(backend):
+    a = OCSNChangeConsumer(backend, 'g', 'a')
+    b = OCSNChangeConsumer(backend, 'g', 'b')
+
+    for i in range(4):
+        publish_change(backend, 'svc/svc%d' % i, 'store')
+
+    got_a = a.read(count = 2)
+    got_b = b.read(count = 10)
+    assert sorted(c.key for c in got_a + got_b) == [ 'svc/svc%d' % i for i in range(4) ]
+    assert len(got_a) == 2 and len(got_b) == 2
+
+    a.ack(got_a[:1])
+
+    # a restarts under the same name: the unacked change comes back first
+    a = OCSNChangeConsumer(backend, 'g', 'a')
+    assert [ c.key for c in a.read() ] == [ got_a[1].key ]
+    assert a.read() == []
+
+
+def test_consumer_group_starts_at_new_changes(backend):
+    publish_change(backend, 'svc/old', 'store')
+
+    c = OCSNChangeConsumer(backend, 'g', 'a')
+    publish_change(backend, 'svc/new', 'store')
+
+    assert [ x.key for x in c.read() ] == [ 'svc/new' ]
+
+
+def test_filter_by_prefix_and_tenant():
+    def change(key):
+        return OCSNChange(key = key)
+
+    f = OCSNChangeFilter(tenant_id = 't0')
+    assert f.match(change('t/t0'))
+    assert f.match(change(OCSNUser('t0', id = 'u0').get_key()))
+    assert f.match(change(OCSNVBucket('t0', 'u0', id = 'vb0').get_key()))
+    assert not f.match(change('t/t1'))
+    assert not f.match(change(OCSNVBucket('t1', 'u0', id = 'vb0').get_key()))
+
+    f = OCSNChangeFilter(prefixes = [ 'svc/' ])
+    assert f.match(change('svc/svc0'))
+    assert not f.match(change('svci/svci0'))
+    assert OCSNChangeFilter().match(change('anything'))
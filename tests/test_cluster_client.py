@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+import ocsn.cluster_client as cluster_client
+
+from ocsn.cluster_client import RedisClusterClient, tag_key, untag_key
+
+
+@pytest.mark.parametrize('key, tagged', [
+        ('t/t0', 't/{t0}'),
+        ('b/t0/u0/vb0', 'b/{t0}/u0/vb0'),
+        ('bmap/t0/u0/vb0', 'bmap/{t0}/u0/vb0'),
+        ('bi/svci0/bi0', 'bi/{svci0}/bi0'),
+        ('creds/svci0/s3/c0', 'creds/{svci0}/s3/c0'),
+        ('idx/bi-vbuckets/svci0/bi0', 'idx/bi-vbuckets/{svci0}/bi0'),
+        ('idx/vbucket-bis/t0/u0/vb0', 'idx/vbucket-bis/{t0}/u0/vb0'),
+        ('changefeed', 'changefeed'),
+        ('idx/created', 'idx/created'),
+    ])
+def test_tag_key_round_trip(key, tagged):
+    assert tag_key(key) == tagged
+    assert untag_key(tagged) == key
+
+
+def test_tag_key_prefixes():
+    # a partial tag segment stays open so the match covers every id
+    assert tag_key('b/t0', prefix = True) == 'b/{t0'
+    assert tag_key('b/t0/', prefix = True) == 'b/{t0}/'
+    assert tag_key('b/', prefix = True) == 'b/'
+    assert tag_key('', prefix = True) == ''
+
+
+class FakeCluster:
+    # get_primaries()/get_redis_connection() over independent fake nodes
+    nodes = []
+
+    def __init__(self, host = None, port = None):
+        pass
+
+    def get_primaries(self):
+        return list(range(len(self.nodes)))
+
+    def get_redis_connection(self, node):
+        return self.nodes[node]
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    FakeCluster.nodes = [ fakeredis.FakeRedis() for _ in range(3) ]
+    monkeypatch.setattr(cluster_client, 'RedisCluster', FakeCluster)
+
+    for i in range(60):
+        FakeCluster.nodes[i % 3].set(tag_key('svc/svc%02d' % i), '{}')
+
+    return RedisClusterClient(scan_threads = 2)
+
+
+def test_base_client_state_is_set(cluster):
+    assert cluster.replicas == []
+    assert cluster.read_policy == 'round-robin'
+    assert cluster.reads == 0
+    assert not cluster._is_written(prefix = 'svc/')
+
+
+def test_key_batches_scan_every_node(cluster):
+    batches = list(cluster.key_batches('svc/', 7))
+    assert all(len(b) <= 7 for b in batches)
+    assert sorted(k for b in batches for k in b) == [ 'svc/svc%02d' % i for i in range(60) ]
+
+
+def test_abandoned_key_batches_stop_their_threads(cluster):
+    before = threading.active_count()
+
+    for _ in range(3):
+        batches = cluster.key_batches('svc/', 1)
+        next(batches)
+        batches.close()
+
+    deadline = time.monotonic() + 5
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert threading.active_count() == before
@@ -0,0 +1,74 @@
+import time
+
+import cli
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.cache import OCSNCache
+from ocsn.catalog import OCSNCatalog
+from ocsn.changefeed import OCSNChangeWatcher
+from ocsn.coninfo import OCSNConInfoCtl
+from ocsn.ocsn_types import *
+from ocsn.sqlite_client import SQLiteClient
+
+from conftest import setup_catalog, VB
+
+
+def endpoints(coninfo):
+    return [ d['connection']['endpoint'] for d in coninfo.get('t0', 'u0', 'vb0') ]
+
+
+def store_elsewhere(client, e):
+    # what store() does in another process: no in-process notification
+    client.put(e.get_key(), e.encode_json())
+    client.append_changes([ change_record(e.get_key(), 'store') ])
+
+
+def wait_for(fn, expected, timeout = 5):
+    deadline = time.monotonic() + timeout
+    while fn() != expected and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return fn()
+
+
+def test_svci_changed_by_another_process_reaches_coninfo(ocsn, monkeypatch, tmp_path):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    path = str(tmp_path / 'ocsn.db')
+    ours = SQLiteClient(path)
+    theirs = SQLiteClient(path)
+    monkeypatch.setattr(cli, 'redis_client', ours)
+
+    setup_catalog(ocsn, bis = 1)
+    ocsn('svc', 'create', '--svc-id', 'svc1', '--name', 'svc 1', '--endpoint', 'https://s3.example.org')
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'e0')
+
+    catalog = OCSNCatalog(ours, ttl = 60).attach()
+    coninfo = OCSNConInfoCtl(ours, OCSNCache(60), catalog).attach()
+    watcher = OCSNChangeWatcher(ours, block = 50).start()
+    try:
+        assert endpoints(coninfo) == [ 'https://s3.example.com' ]
+
+        svci = OCSNServiceInstance(id = 'svci0').load(theirs)
+        svci.svc_id = 'svc1'
+        store_elsewhere(theirs, svci)
+        assert wait_for(lambda: endpoints(coninfo), [ 'https://s3.example.org' ]) == [ 'https://s3.example.org' ]
+
+        svc = OCSNService(id = 'svc1').load(theirs)
+        svc.endpoint = 'https://s3-2.example.org'
+        store_elsewhere(theirs, svc)
+        assert wait_for(lambda: endpoints(coninfo), [ 'https://s3-2.example.org' ]) == [ 'https://s3-2.example.org' ]
+    finally:
+        watcher.stop()
+
+
+def test_catalog_drops_entries_changed_in_this_process(client, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    OCSNService(id = 'svc0', endpoint = 'https://a').store(client)
+
+    catalog = OCSNCatalog(client, ttl = 60).attach()
+    assert catalog.service('svc0').endpoint == 'https://a'
+
+    OCSNService(id = 'svc0', endpoint = 'https://b').store(client)
+    assert catalog.service('svc0').endpoint == 'https://b'
+
+    OCSNService(id = 'svc0').remove(client)
+    assert catalog.service('svc0') is None
@@ -0,0 +1,50 @@
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.cache import OCSNCache
+from ocsn.ocsn_types import *
+from ocsn.service import OCSNS3CredsLookup
+
+from conftest import setup_catalog
+
+
+def test_creds_access_key_index(ocsn, client, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    setup_catalog(ocsn, bis = 0)
+    lookup = OCSNS3CredsLookup(client, OCSNCache(60)).attach()
+
+    def found(access_key):
+        return [ c.id for c in lookup.lookup(access_key) ]
+
+    creds = ocsn('creds', 'create', '--svci-id', 'svci0', '--access-key', 'AK1', '--secret', 's1')
+    key = OCSNS3Creds('svci0', id = creds['id']).get_key()
+    assert client.get_refs(s3_access_key_index('AK1')) == [ key ]
+    assert found('AK1') == [ creds['id'] ]
+    assert [ c['id'] for c in ocsn('creds', 'lookup', '--access-key', 'AK1') ] == [ creds['id'] ]
+
+    ocsn('creds', 'modify', '--svci-id', 'svci0', '--creds-id', creds['id'], '--access-key', 'AK2', '--secret', 's2')
+    assert client.get_refs(s3_access_key_index('AK1')) == []
+    assert client.get_refs(s3_access_key_index('AK2')) == [ key ]
+    assert found('AK1') == []
+    assert found('AK2') == [ creds['id'] ]
+    assert lookup.lookup('AK2')[0].secret == 's2'
+
+    ocsn('creds', 'remove', '--svci-id', 'svci0', '--creds-id', creds['id'])
+    assert client.get_refs(s3_access_key_index('AK2')) == []
+    assert found('AK2') == []
+
+
+def test_cached_lookup_sees_new_creds_with_the_same_access_key(ocsn, client, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    setup_catalog(ocsn, bis = 0)
+    lookup = OCSNS3CredsLookup(client, OCSNCache(60)).attach()
+
+    ocsn('creds', 'create', '--svci-id', 'svci0', '--creds-id', 'c0', '--access-key', 'AK1', '--secret', 's0')
+    assert [ c.id for c in lookup.lookup('AK1') ] == [ 'c0' ]
+
+    ocsn('creds', 'create', '--svci-id', 'svci0', '--creds-id', 'c1', '--access-key', 'AK1', '--secret', 's1')
+    assert sorted(c.id for c in lookup.lookup('AK1')) == [ 'c0', 'c1' ]
+
+    # a modify that moves other creds onto a cached access key
+    ocsn('creds', 'create', '--svci-id', 'svci0', '--creds-id', 'c2', '--access-key', 'AK2', '--secret', 's2')
+    ocsn('creds', 'modify', '--svci-id', 'svci0', '--creds-id', 'c2', '--access-key', 'AK1', '--secret', 's2')
+    assert sorted(c.id for c in lookup.lookup('AK1')) == [ 'c0', 'c1', 'c2' ]
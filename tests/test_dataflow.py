@@ -0,0 +1,109 @@
+from ocsn.ocsn_types import *
+from ocsn.dataflow import OCSNDataFlowInstanceCtl
+from ocsn.trace import tracing
+
+
+def test_created_lists_new_flows(ocsn):
+    f = ocsn('flow', 'create', '--group-id', 'g0', '--source-svc-id', 'svc0', '--dest-svc-id', 'svc1')
+    s = ocsn('flow', 'symmetric', '--group-id', 'g0', '--endpoint', 'svc0:a', '--endpoint', 'svc1:b')
+
+    created = ocsn('index', 'created', '--type', 'dflow')
+    assert [ r['entity'] for r in created ] == [ f, s ]
+
+    # replacing a flow by id does not make it new
+    ocsn('flow', 'modify', '--group-id', 'g0', '--flow-id', f['id'],
+         '--source-svc-id', 'svc0', '--dest-svc-id', 'svc2')
+    assert len(ocsn('index', 'created', '--type', 'dflow')) == 2
+
+
+def test_legacy_flow_group_migrates_on_first_edit(ocsn, client):
+    df = OCSNDataFlowInstance('g0')
+    df.append(OCSNDirectionalFlow(OCSNDataFlowEntity('svc0'), OCSNDataFlowEntity('svc1')), flow_id = 'g0/f1')
+    df.append_symmetric(OCSNSymmetricFlow(entities = [ OCSNDataFlowEntity('svc1'), OCSNDataFlowEntity('svc2') ]),
+                        flow_id = 'g0/f2')
+    df.store(client)
+
+    before = ocsn('flow', 'info', '--group-id', 'g0')
+    assert sorted(before['flows']) == [ 'g0/f1' ]
+    assert sorted(before['symmetric']) == [ 'g0/f2' ]
+
+    f = ocsn('flow', 'create', '--group-id', 'g0', '--source-svc-id', 'svc2', '--dest-svc-id', 'svc0')
+
+    assert client.get(df.get_key()) is None
+    assert client.get_refs(dflow_group_index('g0')) == sorted([ 'dflow/g0/f1', 'dflow/g0/f2', 'dflow/' + f['id'] ])
+    assert client.get_refs(dflow_source_index('svc2')) == sorted([ 'dflow/g0/f2', 'dflow/' + f['id'] ])
+
+    after = ocsn('flow', 'info', '--group-id', 'g0')
+    assert after['flows'] == dict(before['flows'], **{ f['id']: f['flow'] })
+    assert after['symmetric'] == before['symmetric']
+
+
+def create(ocsn, group, src, dest, *args):
+    return ocsn('flow', 'create', '--group-id', group, '--source-svc-id', src, '--dest-svc-id', dest, *args)
+
+
+def test_create_prints_the_flow_record(ocsn, client):
+    f = create(ocsn, 'g0', 'svc0', 'svc1')
+
+    assert f['group'] == 'g0' and f['type'] == 'directional'
+    assert f['id'].startswith('g0/')
+    assert f['flow']['source']['svc_id'] == 'svc0'
+    assert json.loads(client.get('dflow/' + f['id'])) == f
+
+
+def test_explicit_flow_id_is_created_once(ocsn, client):
+    f = create(ocsn, 'g0', 'svc0', 'svc1', '--flow-id', 'mine')
+    assert f['id'] == 'mine'
+    assert client.get_refs(dflow_group_index('g0')) == [ 'dflow/g0/mine' ]
+
+    created = ocsn('index', 'created', '--type', 'dflow')
+    assert [ r['entity'] for r in created ] == [ f ]
+
+    # the same id again replaces the flow and moves its source index entry
+    g = create(ocsn, 'g0', 'svc2', 'svc1', '--flow-id', 'mine')
+    assert [ r['entity'] for r in ocsn('index', 'created', '--type', 'dflow') ] == [ g ]
+    assert client.get_refs(dflow_source_index('svc0')) == []
+    assert client.get_refs(dflow_source_index('svc2')) == [ 'dflow/g0/mine' ]
+    assert list(ocsn('flow', 'info', '--group-id', 'g0')['flows']) == [ 'mine' ]
+
+
+def test_remove_drops_one_record(ocsn, client):
+    a = create(ocsn, 'g0', 'svc0', 'svc1')
+    b = create(ocsn, 'g0', 'svc1', 'svc2')
+
+    ocsn('flow', 'remove', '--group-id', 'g0', '--flow-id', a['id'])
+    assert client.get('dflow/' + a['id']) is None
+    assert client.get_refs(dflow_group_index('g0')) == [ 'dflow/' + b['id'] ]
+    assert client.get_refs(dflow_source_index('svc0')) == []
+    assert ocsn('index', 'created', '--type', 'dflow')[0]['entity'] == b
+
+    ocsn('flow', 'remove', '--group-id', 'g0', '--flow-id', b['id'])
+    assert ocsn('flow', 'info', '--group-id', 'g0') == {'id': 'g0', 'flows': {}}
+    assert [ df.id for df in OCSNDataFlowInstanceCtl(client).list() ] == []
+
+
+def test_edit_cost_does_not_grow_with_group(ocsn, client):
+    for i in range(50):
+        create(ocsn, 'g0', 'svc%d' % i, 'svc%d' % (i + 1))
+
+    ctl = OCSNDataFlowInstanceCtl(client)
+    flow = OCSNDirectionalFlow(OCSNDataFlowEntity('svc0'), OCSNDataFlowEntity('svc9'))
+    with tracing('append') as t:
+        f = ctl.append('g0', flow)
+
+    # one record goes out, none of the other 50 is read or written
+    assert t.sent < 2 * len(f.encode_json())
+    assert t.received < len(f.encode_json())
+    assert [ k for k in t.keys if k.startswith('dflow/') ] == [ f.get_key() ]
+
+
+def test_list_from_loads_only_matching_flows(ocsn, client):
+    create(ocsn, 'g0', 'svc0', 'svc1')
+    create(ocsn, 'g0', 'svc1', 'svc2')
+    create(ocsn, 'g1', 'svc3', 'svc0')
+    ocsn('flow', 'symmetric', '--group-id', 'g2', '--endpoint', 'svc1:a', '--endpoint', 'svc4:b')
+
+    groups = dict((df.id, df) for df in OCSNDataFlowInstanceCtl(client).list_from([ 'svc1' ]))
+    assert sorted(groups) == [ 'g0', 'g2' ]
+    assert [ f.source.svc_id for f in groups['g0'].flows.values() ] == [ 'svc1' ]
+    assert len(groups['g2'].symmetric) == 1
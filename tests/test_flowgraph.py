@@ -0,0 +1,71 @@
+from ocsn.ocsn_types import OCSNDataFlowEntity, OCSNDataFlowInstance, OCSNDirectionalFlow, OCSNSymmetricFlow
+from ocsn.flowgraph import OCSNFlowGraph, bits
+
+
+def E(svc, bucket = 'b'):
+    return OCSNDataFlowEntity(svc, bucket, '')
+
+
+def graph(edges, symmetric = None):
+    df = OCSNDataFlowInstance('df0')
+    df.flows = dict(('f%d' % i, OCSNDirectionalFlow(E(a), E(b))) for i, (a, b) in enumerate(edges))
+    df.symmetric = dict((k, OCSNSymmetricFlow(k, [ E(m) for m in v ])) for k, v in (symmetric or {}).items())
+    return OCSNFlowGraph.build([ df ])
+
+
+def names(g, mask):
+    return sorted(g.nodes[n].svc_id for n in bits(mask & ~g.virtual))
+
+
+def test_closure_matches_downstream():
+    g = graph([ ('a', 'b'), ('b', 'c'), ('c', 'd'), ('a', 'e'), ('e', 'd'), ('x', 'a') ])
+    closure = g.closure()
+
+    assert len(closure) == len(g.nodes)
+    for n, e in enumerate(g.nodes):
+        assert closure[n] == g.downstream(e)
+
+    assert names(g, closure[g.node_id(E('a'))]) == [ 'b', 'c', 'd', 'e' ]
+    assert closure[g.node_id(E('d'))] == 0
+
+
+def test_closure_is_lazy_and_keeps_shared_components_only():
+    g = graph([ ('a', 'b'), ('b', 'c'), ('c', 'd'), ('x', 'd'), ('d', 'e') ])
+    closure = g.closure()
+    assert closure.memo == {}
+
+    assert names(g, closure[g.node_id(E('a'))]) == [ 'b', 'c', 'd', 'e' ]
+
+    # only d has two predecessors, the chain above it is not kept
+    assert [ closure.comps[c] for c in closure.memo ] == [ [ g.node_id(E('d')) ] ]
+    assert names(g, closure[g.node_id(E('x'))]) == [ 'd', 'e' ]
+
+
+def test_cycle_collapses_into_one_component():
+    g = graph([ ('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'd'), ('d', 'd') ])
+    closure = g.closure()
+
+    comps = sorted(sorted(names(g, sum(1 << n for n in c))) for c in closure.comps)
+    assert comps == [ [ 'a', 'b', 'c' ], [ 'd' ] ]
+
+    for x in 'abc':
+        assert names(g, closure[g.node_id(E(x))]) == [ 'a', 'b', 'c', 'd' ]
+    assert names(g, closure[g.node_id(E('d'))]) == [ 'd' ]
+
+    cycles = sorted(sorted(e.svc_id for e in c) for c in g.cycles())
+    assert cycles == [ [ 'a', 'b', 'c' ], [ 'd' ] ]
+
+
+def test_no_cycles_in_dag():
+    g = graph([ ('a', 'b'), ('a', 'c'), ('b', 'c') ])
+    assert g.cycles() == []
+
+
+def test_symmetric_group_is_a_cycle_through_its_hub():
+    g = graph([ ('c', 'x') ], symmetric = { 'g0': [ 'a', 'b', 'c' ] })
+    closure = g.closure()
+
+    assert names(g, closure[g.node_id(E('a'))]) == [ 'a', 'b', 'c', 'x' ]
+    assert g.reaches(E('b'), E('x'))
+    assert not g.reaches(E('x'), E('a'))
+    assert [ sorted(e.svc_id for e in c) for c in g.cycles() ] == [ [ 'a', 'b', 'c' ] ]
@@ -0,0 +1,87 @@
+from ocsn.ocsn_types import OCSNDataFlowEntity, OCSNDirectionalFlow, OCSNSymmetricFlow
+from ocsn.flowmatch import OCSNFlowMatcher
+
+
+def E(svc, bucket, obj_prefix = ''):
+    return OCSNDataFlowEntity(svc, bucket, obj_prefix)
+
+
+def flow(source, dest):
+    return OCSNDirectionalFlow(E(*source), E(*dest))
+
+
+def dests(matcher, entity):
+    return sorted(d.get_flow_key() for d in matcher.dests(entity))
+
+
+def test_obj_prefix_covers_longer_prefixes():
+    f = flow(('s0', 'b', 'logs/'), ('s1', 'b', 'archive/'))
+    m = OCSNFlowMatcher([ ('f0', f) ])
+
+    assert f.check(E('s0', 'b', 'logs/2024/x'), E('s1', 'b', 'archive/2024/x'))
+    assert f.check(E('s0', 'b', 'logs/'), E('s1', 'b', 'archive/'))
+    assert not f.check(E('s0', 'b', 'logs/2024/x'), E('s1', 'b', 'archive/'))
+    assert not f.check(E('s0', 'b', 'log'), E('s1', 'b', 'archive/'))
+    assert not f.check(E('s0', 'bb', 'logs/x'), E('s1', 'b', 'archive/x'))
+
+    assert dests(m, E('s0', 'b', 'logs/2024/x')) == [ 's1\0b\0archive/2024/x' ]
+    assert dests(m, E('s0', 'b', 'other/')) == []
+
+
+def test_nested_prefixes_all_match():
+    m = OCSNFlowMatcher([
+        ('f0', flow(('s0', 'b', ''), ('s1', 'b', ''))),
+        ('f1', flow(('s0', 'b', 'logs/'), ('s2', 'b', ''))),
+        ('f2', flow(('s0', 'b', 'logs/2024/'), ('s3', 'b', 'y/'))),
+        ('f3', flow(('s0', 'c', ''), ('s4', 'c', ''))),
+        ])
+
+    assert dests(m, E('s0', 'b', 'logs/2024/x')) == [
+        's1\0b\0logs/2024/x', 's2\0b\x002024/x', 's3\0b\0y/x' ]
+    assert [ flow_id for flow_id, _ in m.candidates(E('s0', 'b', 'logs/')) ] == [ 'f0', 'f1' ]
+
+
+def test_bucket_glob():
+    f = flow(('s0', 'logs-*', ''), ('s1', 'archive', 'logs-*/'))
+    m = OCSNFlowMatcher([ ('f0', f) ])
+
+    assert dests(m, E('s0', 'logs-eu', 'a/b')) == [ 's1\0archive\0logs-eu/a/b' ]
+    assert dests(m, E('s0', 'data', 'a/b')) == []
+
+
+def test_star_in_obj_prefix_keeps_bucket_meaning():
+    # stored flows used '*' in obj_prefix for the source bucket name
+    f = flow(('s0', '*', '*/'), ('s1', 'backup', '*/'))
+    m = OCSNFlowMatcher([ ('f0', f) ])
+
+    assert dests(m, E('s0', 'photos', 'photos/2024')) == [ 's1\0backup\0photos/2024' ]
+    assert dests(m, E('s0', 'photos', 'videos/2024')) == []
+
+    f = flow(('s0', 'b', '*'), ('s1', 'b', '*'))
+    assert f.check(E('s0', 'b', 'b'), E('s1', 'b', 'b'))
+    assert not f.check(E('s0', 'b', 'c'), E('s1', 'b', 'c'))
+
+
+def test_exact_endpoint():
+    f = flow(('s0', 'b', 'p'), ('s1', 'c', 'q'))
+    m = OCSNFlowMatcher([ ('f0', f) ])
+
+    assert m.check(E('s0', 'b', 'p'), E('s1', 'c', 'q'))
+    assert not m.check(E('s0', 'b', 'p'), E('s1', 'b', 'q'))
+    assert not m.check(E('s1', 'c', 'q'), E('s0', 'b', 'p'))
+
+
+def test_symmetric_members_cover_prefixes():
+    g = OCSNSymmetricFlow('g0', [ E('s0', 'b', 'logs/'), E('s1', 'c', ''), E('s2', 'x-*', '') ])
+    m = OCSNFlowMatcher()
+    m.add_symmetric('g0', g)
+
+    assert g.contains(E('s0', 'b', 'logs/a'))
+    assert not g.contains(E('s0', 'b', 'data/a'))
+    assert g.contains(E('s1', 'c', 'anything'))
+    assert g.contains(E('s2', 'x-1', 'a'))
+
+    assert m.symmetric_groups(E('s0', 'b', 'logs/a')) == { 'g0' }
+    assert m.symmetric_groups(E('s0', 'b', 'data/a')) == set()
+    assert m.check(E('s0', 'b', 'logs/a'), E('s1', 'c', 'z'))
+    assert not m.check(E('s0', 'b', 'data/a'), E('s1', 'c', 'z'))
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from ocsn.ocsn_types import OCSNDataFlowEntity, OCSNDirectionalFlow, OCSNSymmetricFlow
+from ocsn.flowmatch import OCSNFlowMatcher
+from ocsn.flowverify import OCSNFlowVerifier
+
+np = pytest.importorskip('numpy')
+
+
+class Endpoint:
+    def __init__(self, key):
+        self.key = key
+
+    def get_flow_key(self):
+        return self.key
+
+
+class SharedGroupsMatcher:
+    # every endpoint is a member of the same n symmetric groups
+    def __init__(self, n):
+        self.groups = set('g%d' % i for i in range(n))
+
+    def dests(self, entity):
+        return []
+
+    def symmetric_groups(self, entity):
+        return self.groups
+
+    def check(self, source, dest):
+        return True
+
+
+@pytest.mark.parametrize('n', [ 1, 255, 256, 512 ])
+def test_coverage_counts_many_shared_groups(n):
+    v = OCSNFlowVerifier(SharedGroupsMatcher(n))
+    v.add('vb0', [ Endpoint('a'), Endpoint('b') ])
+
+    cov = v.coverage(v.items[0][1])
+    assert cov.tolist() == [ [ False, True ], [ True, False ] ]
+
+    key, exists, missing = list(v.run_vectorized())[0]
+    assert missing == []
+
+
+def test_vectorized_matches_pairwise():
+    rnd = random.Random(1)
+    E = lambda i: OCSNDataFlowEntity('svc%d' % i, 'b', '')
+
+    matcher = OCSNFlowMatcher()
+    for k in range(40):
+        matcher.add('f%d' % k, OCSNDirectionalFlow(E(rnd.randrange(30)), E(rnd.randrange(30))))
+    for k in range(5):
+        matcher.add_symmetric('g%d' % k, OCSNSymmetricFlow('g%d' % k, [ E(i) for i in rnd.sample(range(30), 4) ]))
+
+    v = OCSNFlowVerifier(matcher)
+    for k in range(50):
+        v.add('vb%d' % k, [ E(i) for i in rnd.sample(range(30), rnd.randrange(1, 5)) ])
+
+    assert list(v.run_vectorized()) == list(v.run())
+
+    # only the flows between endpoints are indexed, not an n x n matrix
+    assert len(v.edges) <= 40
+    assert v.members.size == 5 * 4
+
+
+def test_coverage_is_per_vbucket():
+    E = lambda i: OCSNDataFlowEntity('svc%d' % i, 'b', '')
+    matcher = OCSNFlowMatcher([ ('f0', OCSNDirectionalFlow(E(0), E(1))) ])
+
+    v = OCSNFlowVerifier(matcher)
+    v.add('vb0', [ E(0), E(1) ])
+    v.add('vb1', [ E(2), E(1), E(0) ])
+
+    assert v.coverage(v.items[1][1]).tolist() == [
+        [ False, False, False ],
+        [ False, False, False ],
+        [ False, True, False ] ]
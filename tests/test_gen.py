@@ -0,0 +1,74 @@
+import collections
+
+import pytest
+
+import cli
+
+from ocsn.gen import OCSNCatalogGen, parse_range
+from ocsn.ocsn_types import *
+from ocsn.sqlite_client import SQLiteClient
+
+from conftest import docs, hashes, refs
+
+
+SHAPE = [ '--services', '2', '--svcis', '2', '--bis', '3', '--creds', '1', '--tenants', '3',
+          '--users', '2', '--vbuckets', '1-3', '--mappings', '2', '--flow-groups', '2', '--flows', '4' ]
+
+
+def test_parse_range():
+    assert parse_range('10') == (10, 10)
+    assert parse_range('5-20') == (5, 20)
+    assert parse_range(3) == (3, 3)
+
+    for bad in [ '20-5', '-1', 'a-b' ]:
+        with pytest.raises(OCSNException):
+            parse_range(bad)
+
+
+def types(records):
+    return collections.Counter(k.split('/', 1)[0] for k, _ in records)
+
+
+def test_same_seed_same_catalog():
+    shape = dict(services = 3, svcis = (1, 3), bis = (2, 5), tenants = 5, flow_groups = 3)
+
+    a = list(OCSNCatalogGen(seed = 7, **shape).records())
+    assert list(OCSNCatalogGen(seed = 7, **shape).records()) == a
+    assert list(OCSNCatalogGen(seed = 8, **shape).records()) != a
+
+
+def test_fixed_shape_counts():
+    g = OCSNCatalogGen(services = 2, svcis = (2, 2), bis = (3, 3), creds = (1, 1), tenants = 3,
+                       users = (2, 2), vbuckets = (1, 1), mappings = (2, 2), flow_groups = 2, flows = (4, 4))
+    records = list(g.records())
+
+    assert types(records) == {'svc': 2, 'svci': 4, 'creds': 4, 'bi': 12, 't': 3, 'u': 6, 'b': 6, 'dflow': 8}
+
+    # every mapping names a bucket instance of the catalog
+    keys = set(k for k, _ in records)
+    for k, d in records:
+        if k.startswith('b/'):
+            vb = OCSNVBucket(None, None).decode(d)
+            assert len(vb.mappings.bis) == 2
+            for bid in vb.mappings.bis.values():
+                assert OCSNBucketInstance(bid.svci_id, id = bid.bi_id).get_key() in keys
+
+
+def test_gen_to_backend_matches_gen_to_file(ocsn, client, monkeypatch, tmp_path):
+    ocsn('gen', *SHAPE)
+    assert types((k, None) for k in docs(client))['b'] >= 6
+
+    # writing through the backend builds the same indexes a rebuild derives
+    before = refs(client)
+    ocsn('index', 'rebuild')
+    assert refs(client) == before
+
+    path = str(tmp_path / 'gen.jsonl')
+    ocsn('gen', *SHAPE, '--output', path)
+
+    imported = SQLiteClient()
+    monkeypatch.setattr(cli, 'redis_client', imported)
+    ocsn('import', '--input', path)
+
+    assert docs(imported) == docs(client)
+    assert refs(imported) == refs(client)
@@ -0,0 +1,49 @@
+from ocsn.ocsn_types import *
+
+from conftest import setup_catalog, setup_mappings, refs, VB
+
+
+def test_impact_queries_follow_edits(ocsn):
+    setup_catalog(ocsn, bis = 2)
+    ocsn('svc', 'create', '--svc-id', 'svc1', '--name', 'svc 1', '--endpoint', 'https://s3.example.org')
+    ocsn('creds', 'create', '--svci-id', 'svci0', '--creds-id', 'c0', '--access-key', 'AK0', '--secret', 's0')
+    ocsn('bi', 'modify', '--svci-id', 'svci0', '--bi-id', 'bi1', '--bucket', 'bucket1', '--creds-id', 'c0')
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi1', '--entry-id', 'e0')
+
+    assert ocsn('svc', 'instances', '--svc-id', 'svc0') == [ 'svci0' ]
+    assert ocsn('svci', 'bis', '--svci-id', 'svci0') == [ 'bi0', 'bi1' ]
+    assert ocsn('svci', 'creds', '--svci-id', 'svci0') == [ 'c0' ]
+    assert ocsn('creds', 'bis', '--svci-id', 'svci0', '--creds-id', 'c0') == [ 'bi1' ]
+    assert ocsn('bi', 'vbuckets', '--svci-id', 'svci0', '--bi-id', 'bi1') == [
+            {'tenant_id': 't0', 'user_id': 'u0', 'vbucket_id': 'vb0'} ]
+
+    # moving a reference drops the old member and adds the new one
+    ocsn('svci', 'modify', '--svci-id', 'svci0', '--svc-id', 'svc1')
+    assert ocsn('svc', 'instances', '--svc-id', 'svc0') == []
+    assert ocsn('svc', 'instances', '--svc-id', 'svc1') == [ 'svci0' ]
+
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'e0')
+    assert ocsn('bi', 'vbuckets', '--svci-id', 'svci0', '--bi-id', 'bi1') == []
+    assert len(ocsn('bi', 'vbuckets', '--svci-id', 'svci0', '--bi-id', 'bi0')) == 1
+
+    ocsn('bi', 'remove', '--svci-id', 'svci0', '--bi-id', 'bi1')
+    assert ocsn('svci', 'bis', '--svci-id', 'svci0') == [ 'bi0' ]
+    assert ocsn('creds', 'bis', '--svci-id', 'svci0', '--creds-id', 'c0') == []
+
+    ocsn('vbucket', 'remove', *VB)
+    assert ocsn('bi', 'vbuckets', '--svci-id', 'svci0', '--bi-id', 'bi0') == []
+
+
+def test_index_rebuild_matches_incremental_refs(ocsn, client, monkeypatch):
+    setup_mappings(ocsn, monkeypatch)
+
+    # edits after the initial creation, each moving some refs
+    ocsn('creds', 'modify', '--svci-id', 'svci0', '--creds-id', 'c0', '--access-key', 'AK1', '--secret', 's1')
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi2', '--entry-id', 'e0')
+    ocsn('flow', 'symmetric', '--group-id', 'g1', '--endpoint', 'svc2:c', '--endpoint', 'svc3:d')
+
+    incremental = refs(client)
+    assert incremental[bi_vbuckets_index('svci0', 'bi2')] == [ OCSNVBucket('t0', 'u0', id = 'vb0').get_key() ]
+
+    ocsn('index', 'rebuild')
+    assert refs(client) == incremental
@@ -0,0 +1,83 @@
+import copy
+
+from ocsn.ocsn_types import *
+
+
+def vbucket_doc(n = 3):
+    vb = OCSNVBucket('t0', 'u0', id = 'vb0', name = 'vbucket 0')
+    for i in range(n):
+        vb.map('e%d' % i, OCSNBucketInstance('svci%d' % (i % 2), id = 'bi%d' % i))
+    return json.loads(vb.encode_json())
+
+
+def undecoded(e, field):
+    return getattr(type(e), field).raw(e)[0]
+
+
+def test_vbucket_mappings_decode_on_first_access():
+    d = vbucket_doc()
+    vb = OCSNVBucket('t0', 'u0').decode(d)
+    assert undecoded(vb, 'mappings')
+
+    # encode hands the raw subtree back untouched
+    assert vb.encode()['mappings'] is d['mappings']
+    assert undecoded(vb, 'mappings')
+
+    # the refs are read off the raw entries, the same as decoded
+    refs = vb.get_refs()
+    assert undecoded(vb, 'mappings')
+
+    assert sorted(vb.mappings.bis) == [ 'e0', 'e1', 'e2' ]
+    assert not undecoded(vb, 'mappings')
+    assert vb.get_refs() == refs
+    assert vb.encode() == d
+
+
+def test_changes_after_decoding_are_encoded():
+    vb = OCSNVBucket('t0', 'u0').decode(vbucket_doc())
+    vb.unmap('e1')
+    vb.map('e9', OCSNBucketInstance('svci9', id = 'bi9'))
+
+    assert sorted(vb.encode()['mappings']['bis']) == [ 'e0', 'e2', 'e9' ]
+
+
+def test_assignment_replaces_raw_subtree():
+    vb = OCSNVBucket('t0', 'u0').decode(vbucket_doc())
+    vb.mappings = None
+
+    assert not undecoded(vb, 'mappings')
+    assert vb.get_refs() == []
+
+    vb.decode(vbucket_doc(1))
+    assert undecoded(vb, 'mappings')
+    assert sorted(vb.mappings.bis) == [ 'e0' ]
+
+
+def test_undecoded_copy_is_independent():
+    vb = OCSNVBucket('t0', 'u0').decode(vbucket_doc())
+    other = copy.deepcopy(vb)
+
+    other.unmap('e0')
+    assert sorted(vb.mappings.bis) == [ 'e0', 'e1', 'e2' ]
+    assert sorted(other.mappings.bis) == [ 'e1', 'e2' ]
+
+
+def test_flow_instance_decodes_flows_on_access():
+    df = OCSNDataFlowInstance('g0')
+    df.append(OCSNDirectionalFlow(OCSNDataFlowEntity('svc0', 'a'), OCSNDataFlowEntity('svc1', 'b')), flow_id = 'g0/f0')
+    df.append_symmetric(OCSNSymmetricFlow(entities = [ OCSNDataFlowEntity('svc0'), OCSNDataFlowEntity('svc2') ]),
+                        flow_id = 'g0/f1')
+    d = json.loads(json.dumps(df.encode()))
+
+    df = OCSNDataFlowInstance().decode(d)
+    assert undecoded(df, 'flows') and undecoded(df, 'symmetric')
+    assert df.encode() == d
+    assert df.encode()['flows'] is d['flows']
+
+    assert df.flows['g0/f0'].dest.bucket == 'b'
+    assert not undecoded(df, 'flows')
+    assert undecoded(df, 'symmetric')
+    assert df.encode() == d
+
+    df.pop('g0/f1')
+    assert 'symmetric' not in df.encode()
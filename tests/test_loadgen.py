@@ -0,0 +1,103 @@
+import random
+import threading
+
+import pytest
+
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.loadgen import *
+from ocsn.ocsn_types import *
+from ocsn.sqlite_client import SQLiteClient
+
+
+def test_parse_mix():
+    assert parse_mix('svc=1,svci=0.5,coninfo') == {'svc': 1.0, 'svci': 0.5, 'coninfo': 1.0}
+
+    with pytest.raises(OCSNException):
+        parse_mix('svc=1,bogus=2')
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 99.9) == 100
+    assert percentile(values, 0) == 1
+    assert percentile([ 7 ], 99) == 7
+    assert percentile([], 50) is None
+
+
+def test_zipf_is_seeded_and_skewed():
+    items = [ 'k%d' % i for i in range(100) ]
+
+    def draws(seed, s = 1.1, n = 5000):
+        z = OCSNZipf(items, s, random.Random(seed))
+        return z, [ z.draw() for _ in range(n) ]
+
+    z, a = draws(1)
+    assert draws(1)[1] == a
+    assert draws(2)[1] != a
+
+    # the hottest item is the first rank of the shuffle, not the first key
+    counts = dict((k, a.count(k)) for k in items)
+    assert max(counts, key = counts.get) == z.items[0]
+    assert counts[z.items[0]] > 10 * counts[z.items[-1]]
+
+    # s = 0 is uniform
+    _, u = draws(1, s = 0)
+    assert max(u.count(k) for k in items) < 3 * len(u) / len(items)
+
+
+def catalog():
+    client = SQLiteClient()
+    for i in range(3):
+        OCSNService(id = 'svc%d' % i, name = 'svc', endpoint = 'https://s3.example.com').store(client)
+    return client
+
+
+def test_summary_counts_errors_by_type():
+    gen = OCSNLoadGen(catalog(), 'http://127.0.0.1:1', {'svc': 1})
+    report = gen._summary([ ('svc', 0.001, None), ('svc', 0.002, None),
+                            ('svc', 0.5, '404'), ('svc', 5.0, 'timeout'), ('svc', 5.0, 'timeout') ])
+
+    assert report['requests'] == 5
+    assert report['errors'] == 3
+    assert report['error_rate'] == 0.6
+    assert report['errors_by_type'] == {'404': 1, 'timeout': 2}
+    assert report['latency_ms']['p50'] == 1.0
+    assert report['latency_ms']['max'] == 2.0
+
+
+def test_mix_without_keys_is_rejected():
+    with pytest.raises(OCSNException):
+        OCSNLoadGen(catalog(), 'http://127.0.0.1:1', {'user': 1})
+
+
+def test_run_against_server(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    from werkzeug.serving import make_server
+    import server
+
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    url = 'sqlite:///' + str(tmp_path / 'ocsn.db')
+    client = SQLiteClient(str(tmp_path / 'ocsn.db'))
+    for i in range(3):
+        OCSNService(id = 'svc%d' % i, name = 'svc', endpoint = 'https://s3.example.com').store(client)
+    OCSNServiceInstance(id = 'svci0', svc_id = 'svc0', name = 'svci').store(client)
+
+    app = server.create_app(url, warm = False)
+    httpd = make_server('127.0.0.1', 0, app, threaded = True)
+    thread = threading.Thread(target = httpd.serve_forever, daemon = True)
+    thread.start()
+    try:
+        gen = OCSNLoadGen(client, 'http://127.0.0.1:%d' % httpd.server_port, parse_mix('svc=3,svci=1'))
+        report = gen.run(rate = 200, duration = 0.25, connections = 4)
+    finally:
+        httpd.shutdown()
+        app.extensions['ocsn'].get().watcher.stop()
+
+    assert report['requests'] == 50
+    assert report['errors'] == 0
+    assert sorted(report['by_kind']) == [ 'svc', 'svci' ]
+    assert sum(r['requests'] for r in report['by_kind'].values()) == 50
+    assert report['latency_ms']['p50'] <= report['latency_ms']['p99']
@@ -0,0 +1,86 @@
+import io
+import json
+
+import pytest
+
+import ocsn.output
+
+from ocsn.output import OCSNOutput
+
+from conftest import setup_catalog
+
+
+ITEMS = [ {'id': 'a', 'n': 1, 'tags': [ 'x', 'y' ]}, {'id': 'bb', 'n': None, 'extra': {'k': 'v'}} ]
+
+
+def render(format, items):
+    out = io.StringIO()
+    OCSNOutput(format, out).records(items)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('items', [ [], ITEMS ])
+def test_json_records_match_dumps(items):
+    assert render('json', iter(items)) == json.dumps(items, indent = 2) + '\n'
+    assert render('compact', iter(items)) == json.dumps(items, separators = (',', ':')) + '\n'
+    assert render('ndjson', iter(items)) == ''.join(json.dumps(x) + '\n' for x in items)
+
+
+def test_table():
+    lines = render('table', ITEMS).splitlines()
+    assert lines == [
+        'ID  N  TAGS       EXTRA',
+        'a   1  ["x","y"]',
+        'bb                {"k":"v"}',
+        ]
+
+    assert render('table', []) == ''
+    assert render('table', [ 'plain', 'values' ]).splitlines() == [ 'VALUE', 'plain', 'values' ]
+
+
+def test_table_rows_past_the_sample(monkeypatch):
+    monkeypatch.setattr(ocsn.output, 'TABLE_SAMPLE', 2)
+    lines = render('table', [ {'id': 'a'}, {'id': 'b'}, {'id': 'ccc', 'late': 1} ]).splitlines()
+
+    # columns and widths come from the sample only
+    assert lines == [ 'ID', 'a', 'b', 'ccc' ]
+
+
+@pytest.mark.parametrize('format', [ 'ndjson', 'compact', 'json' ])
+def test_records_are_written_as_they_come(format):
+    out = io.StringIO()
+    seen = []
+
+    def items():
+        for i in range(3):
+            # everything before this record is already out
+            seen.append(out.getvalue().count('"id"'))
+            yield {'id': i}
+
+    OCSNOutput(format, out).records(items())
+    assert seen == [ 0, 1, 2 ]
+
+
+def test_dumps_single_documents():
+    assert OCSNOutput('compact').dumps({'a': [ 1, 2 ]}) == '{"a":[1,2]}'
+    assert OCSNOutput('ndjson').dumps({'a': 1}) == '{"a": 1}'
+    assert OCSNOutput('table').dumps({'a': 1, 'b': 'x'}).splitlines() == [ 'KEY  VALUE', 'a    1', 'b    x' ]
+
+
+def test_cli_format_option(ocsn, capsys):
+    setup_catalog(ocsn, bis = 3)
+
+    out = ocsn('--format', 'ndjson', 'bi', 'list', '--svci-id', 'svci0')
+    assert [ json.loads(line)['bucket'] for line in out.splitlines() ] == [ 'bucket0', 'bucket1', 'bucket2' ]
+
+    out = ocsn('bi', 'list', '--svci-id', 'svci0', '--format=table')
+    lines = out.splitlines()
+    assert 'BUCKET' in lines[0].split()
+    assert [ line.split()[lines[0].split().index('BUCKET')] for line in lines[1:] ] == [ 'bucket0', 'bucket1', 'bucket2' ]
+
+    out = ocsn('--format', 'compact', 'svc', 'list')
+    assert [ s['id'] for s in out ] == [ 'svc0' ]
+
+    with pytest.raises(SystemExit):
+        ocsn('--format', 'xml', 'svc', 'list')
+    assert 'Unknown output format' in capsys.readouterr().out
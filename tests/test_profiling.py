@@ -0,0 +1,7 @@
+from ocsn.profiling import profile_path
+
+
+def test_profile_paths_are_unique_within_a_second():
+    paths = [ profile_path('/tmp', 'GET /s3/bucket') for _ in range(100) ]
+    assert len(set(paths)) == 100
+    assert all(p.endswith('-GET_s3_bucket.prof') for p in paths)
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+from ocsn.redis_client import RedisClient, RedisWrittenKeys
+from ocsn.trace import start_trace, end_trace
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+def test_key_batches_traces_every_scan_call():
+    client = RedisClient()
+    client.client = fakeredis.FakeRedis()
+
+    keys = [ 'svc/svc%02d' % i for i in range(25) ]
+    client.put_many([ (k, '{}') for k in keys ])
+
+    t, token = start_trace('scan')
+    try:
+        batches = list(client.key_batches('svc/', 10))
+    finally:
+        end_trace(t, token)
+
+    assert sorted(k for b in batches for k in b) == keys
+    assert all(len(b) <= 10 for b in batches)
+    assert t.by_op['scan'] >= 3
+    assert t.received == sum(len(client.physical_key(k)) for k in keys)
+
+
+def replicated_client(n = 2, **kw):
+    # a primary and n replicas that do not replicate, so the value read
+    # tells which server answered
+    client = RedisClient(replicas = [ ('replica%d' % i, 6379) for i in range(n) ], **kw)
+    client.client = fakeredis.FakeRedis()
+    for i, r in enumerate(client.replicas):
+        r.client = fakeredis.FakeRedis()
+        r.client.json().set('svc/a', '$', 'replica%d' % i)
+    return client
+
+
+def test_reads_rotate_over_replicas():
+    client = replicated_client()
+    assert sorted(client.get('svc/a') for _ in range(4)) == [ 'replica0', 'replica0', 'replica1', 'replica1' ]
+
+
+def test_least_latency_prefers_the_fastest_replica():
+    client = replicated_client(read_policy = 'least-latency')
+    client.replicas[0].latency = 0.5
+    client.replicas[1].latency = 0.001
+
+    reads = [ client.get('svc/a') for _ in range(63) ]
+    assert reads.count('replica1') == 63
+
+
+def test_written_keys_are_read_from_the_primary_for_a_while(monkeypatch):
+    now = [ 1000.0 ]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+
+    client = replicated_client(sticky = 5)
+    client.put('svc/a', 'primary')
+    client.put('b/t0/u0/vb0', '{}')
+
+    assert client.get('svc/a') == 'primary'
+    assert client.written.has_prefix('b/t0/')
+    assert client.written.has_prefix('b/t0/u0/vb')
+    assert not client.written.has_prefix('b/t1/')
+
+    now[0] += 6
+    assert client.get('svc/a').startswith('replica')
+    assert len(client.written) == 0
+
+
+def test_written_keys_are_capped():
+    written = RedisWrittenKeys(sticky = 60, max_keys = 3)
+    written.mark([ 'svc/a', 'svc/b', 'bi/s/x', 'svc/c' ])
+
+    assert len(written) == 3
+    assert not written.contains('svc/a')
+    assert written.contains('svc/c')
+    assert written.has_prefix('bi/')
+
+    written.mark([ 't/1', 't/2', 't/3' ])
+    assert not written.has_prefix('svc/')
+    assert not written.has_prefix('bi/')
+    assert written.prefixes == {'': 3, 't/': 3}
+
+
+def test_no_sticky_window_keeps_nothing():
+    written = RedisWrittenKeys(sticky = 0)
+    written.mark([ 'svc/a' ])
+    assert not written.contains('svc/a')
+
+
+def test_get_scores_is_traced():
+    client = RedisClient()
+    client.client = fakeredis.FakeRedis()
+    client.update_scores(add = [ ('idx/created/svc', 'svc/a', 10) ])
+
+    t, token = start_trace('scores')
+    try:
+        assert client.get_scores('idx/created/svc') == [ ('svc/a', 10) ]
+    finally:
+        end_trace(t, token)
+
+    assert t.received == len('svc/a')
+
+
+def test_hash_swap_and_dropping_incr_are_atomic_scripts():
+    client = RedisClient()
+    client.client = fakeredis.FakeRedis()
+
+    assert client.hash_swap('bmap/t0/u0/vb0', 'e0', 'a') is None
+    assert client.hash_swap('bmap/t0/u0/vb0', 'e0', 'b') == 'a'
+    assert client.hash_swap('bmap/t0/u0/vb0', 'e0', None) == 'b'
+    assert client.hash_get('bmap/t0/u0/vb0', [ 'e0' ]) == [ None ]
+
+    assert client.hash_incr('counts', 'bi0', 2) == 2
+    assert client.hash_incr('counts', 'bi0', -1, drop = True) == 1
+    assert client.hash_incr('counts', 'bi0', -1, drop = True) == 0
+    assert client.hash_len('counts') == 0
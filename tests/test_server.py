@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.ocsn_types import *
+from ocsn.sqlite_client import SQLiteClient
+
+pytest.importorskip('flask')
+
+import server
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+    path = str(tmp_path / 'ocsn.db')
+    app = server.create_app('sqlite:///' + path, warm = False)
+    state = app.extensions['ocsn'].get()
+    yield app
+    state.watcher.stop()
+
+
+@pytest.fixture
+def other(tmp_path):
+    # a second process writing to the same catalog
+    return SQLiteClient(str(tmp_path / 'ocsn.db'))
+
+
+def poll(c, url):
+    return json.loads(c.get(url).data)
+
+
+def svc(id):
+    return OCSNService(id = id, name = id, endpoint = 'https://s3.example.com')
+
+
+def test_watch_long_poll_resumes_and_filters(app, other):
+    c = app.test_client()
+    svc('base').store(other)
+
+    r = poll(c, '/watch?timeout=0.05')
+    assert r['changes'] == []
+    since = r['version']
+
+    svc('svc0').store(other)
+    OCSNTenant(id = 't0', name = 't0').store(other)
+    OCSNTenant(id = 't1', name = 't1').store(other)
+
+    r = poll(c, '/watch?timeout=1&since=%s' % since)
+    assert [ (x['key'], x['op']) for x in r['changes'] ] == [ ('svc/svc0', 'store'), ('t/t0', 'store'), ('t/t1', 'store') ]
+
+    r = poll(c, '/watch?timeout=1&tenant=t1&since=%s' % since)
+    assert [ x['key'] for x in r['changes'] ] == [ 't/t1' ]
+
+    r = poll(c, '/watch?timeout=1&prefix=svc/&since=%s' % since)
+    assert [ x['key'] for x in r['changes'] ] == [ 'svc/svc0' ]
+
+    # the returned version moves past the changes already seen
+    r = poll(c, '/watch?timeout=0.05&since=%s' % r['version'])
+    assert r['changes'] == []
+
+
+def test_watch_without_since_starts_now(app, other):
+    svc('old').store(other)
+
+    c = app.test_client()
+    assert poll(c, '/watch?timeout=0.05')['changes'] == []
+
+
+def read_events(response, n):
+    # reads the SSE stream until n change events came in
+    events = []
+    buf = ''
+    for chunk in response.response:
+        buf += chunk.decode() if isinstance(chunk, bytes) else chunk
+        while '\n\n' in buf:
+            event, buf = buf.split('\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in event.splitlines() if not line.startswith(':'))
+            if fields.get('event') == 'change':
+                events.append((fields['id'], json.loads(fields['data'])))
+        if len(events) >= n:
+            return events
+
+
+def test_watch_sse_streams_and_resumes_from_last_event_id(app, other):
+    c = app.test_client()
+    svc('base').store(other)
+    base = poll(c, '/watch?timeout=0.05')['version']
+
+    svc('svc0').store(other)
+    svc('svc1').store(other)
+    svc('svc0').remove(other)
+
+    r = c.get('/watch?prefix=svc/&since=%s' % base, headers = { 'Accept': 'text/event-stream' },
+              buffered = False)
+    assert r.mimetype == 'text/event-stream'
+
+    events = read_events(r, 3)
+    r.close()
+    assert [ (e['key'], e['op']) for _, e in events ] == [ ('svc/svc0', 'store'), ('svc/svc1', 'store'), ('svc/svc0', 'remove') ]
+
+    # a reconnect sends the id of the last event it got
+    r = c.get('/watch', headers = { 'Accept': 'text/event-stream', 'Last-Event-ID': events[0][0] },
+              buffered = False)
+    assert [ e['key'] for _, e in read_events(r, 2) ] == [ 'svc/svc1', 'svc/svc0' ]
+    r.close()
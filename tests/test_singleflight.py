@@ -0,0 +1,175 @@
+import threading
+import time
+
+import pytest
+
+import ocsn.ocsn_types as ocsn_types
+
+from ocsn.changefeed import OCSNChangeWatcher
+from ocsn.ocsn_types import *
+from ocsn.singleflight import OCSNSingleFlight, OCSNHotKeyCache, OCSNReader
+from ocsn.sqlite_client import SQLiteClient
+
+
+@pytest.fixture(autouse = True)
+def listeners(monkeypatch):
+    monkeypatch.setattr(ocsn_types, 'mutation_listeners', [])
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = OCSNSingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+
+    results = []
+    threads = [ threading.Thread(target = lambda: results.append(flight.do('k', fn))) for i in range(8) ]
+    for t in threads:
+        t.start()
+
+    deadline = time.monotonic() + 5
+    while flight.stats()['shared'] < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert calls == [ 1 ]
+    assert results == [ 'value' ] * 8
+    assert flight.stats() == {'calls': 1, 'shared': 7, 'in_flight': 0}
+
+    # nothing is kept once the call completes
+    assert flight.do('k', lambda: 'again') == 'again'
+
+
+def test_waiters_get_the_error():
+    flight = OCSNSingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        raise ValueError('boom')
+
+    errors = []
+    def call():
+        try:
+            flight.do('k', fn)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target = call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target = call)
+    follower.start()
+    while flight.stats()['shared'] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hot_keys_are_promoted_and_decay(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    hot = OCSNHotKeyCache(ttl = 100, threshold = 4, window = 1.0)
+
+    for i in range(3):
+        assert hot.get('k') is None
+        hot.record('k', 'v', hot.version())
+    assert hot.stats()['promoted'] == 0
+
+    # the fourth read within the window promotes the key
+    hot.get('k')
+    hot.record('k', 'v', hot.version())
+    assert hot.stats()['promoted'] == 1
+    assert hot.get('k') == 'v'
+
+    # counts halve at the end of every window: 5 -> 2 -> 1 -> gone
+    clock.now += 1
+    hot.get('other')
+    assert hot.counts == {'k': 2, 'other': 1}
+
+    # a cooled off key is no longer cached once its value goes
+    hot.invalidate('k')
+    hot.record('k', 'v', hot.version())
+    assert hot.cache.get('k') is None
+
+    clock.now += 2
+    hot.get('other')
+    assert hot.counts == {'other': 1}
+
+
+def test_hot_key_value_loaded_before_invalidation_is_dropped():
+    hot = OCSNHotKeyCache(ttl = 100, threshold = 1)
+    hot.get('k')
+
+    version = hot.version()
+    hot.invalidate('k') # a store lands while the load is in flight
+    hot.record('k', 'stale', version)
+    assert hot.get('k') is None
+
+    hot.record('k', 'fresh', hot.version())
+    assert hot.get('k') == 'fresh'
+
+
+def svc(name):
+    return OCSNService(id = 'svc0', name = name, endpoint = 'https://s3.example.com')
+
+
+def test_reader_hands_out_copies():
+    client = SQLiteClient()
+    svc('svc 0').store(client)
+    reader = OCSNReader(client, OCSNHotKeyCache(ttl = 100, threshold = 1)).attach()
+
+    a = reader.load(OCSNService(id = 'svc0'))
+    a.name = 'changed'
+
+    b = reader.load(OCSNService(id = 'svc0')) # from the hot-key cache
+    assert b.name == 'svc 0'
+    assert b is not a
+    b.name = 'changed'
+    assert reader.load(OCSNService(id = 'svc0')).name == 'svc 0'
+
+
+def test_reader_is_evicted_by_writes_of_other_processes(tmp_path):
+    path = str(tmp_path / 'ocsn.db')
+    ours = SQLiteClient(path)
+    theirs = SQLiteClient(path)
+    svc('old').store(ours)
+
+    reader = OCSNReader(ours, OCSNHotKeyCache(ttl = 100, threshold = 1)).attach()
+    watcher = OCSNChangeWatcher(ours, block = 50).start()
+    try:
+        assert reader.load(OCSNService(id = 'svc0')).name == 'old'
+        assert reader.hot.get('svc/svc0') is not None
+
+        # stored by another process: no in-process notification
+        s = svc('new')
+        theirs.put(s.get_key(), s.encode_json())
+        theirs.append_changes([ change_record(s.get_key(), 'store') ])
+
+        deadline = time.monotonic() + 5
+        while reader.hot.get('svc/svc0') is not None and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+        assert reader.load(OCSNService(id = 'svc0')).name == 'new'
+    finally:
+        watcher.stop()
+        reader.detach()
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+import cli
+
+from ocsn.ocsn_types import *
+from ocsn.snapshot import *
+from ocsn.sqlite_client import SQLiteClient
+
+from conftest import setup_mappings, docs, hashes, refs, VB
+
+
+@pytest.mark.parametrize('name, args', [ ('snapshot.jsonl', []), ('snapshot.jsonl', [ '--compress' ]),
+                                          ('snapshot.jsonl.gz', []) ])
+def test_export_import_round_trip(ocsn, client, monkeypatch, tmp_path, name, args):
+    setup_mappings(ocsn, monkeypatch)
+    assert hashes(client, VBUCKET_MAP_PREFIX)
+    assert list(client.keys(OCSNDataFlow.get_prefix()))
+
+    info = ocsn('vbucket', 'info', *VB)
+    flows = [ ocsn('flow', 'info', '--group-id', g) for g in ('g0', 'g1') ]
+
+    path = str(tmp_path / name)
+    ocsn('export', '--output', path, *args)
+
+    imported = SQLiteClient()
+    monkeypatch.setattr(cli, 'redis_client', imported)
+    ocsn('import', '--input', path)
+
+    assert docs(imported) == docs(client)
+    assert hashes(imported, VBUCKET_MAP_PREFIX) == hashes(client, VBUCKET_MAP_PREFIX)
+    assert refs(imported) == refs(client)
+
+    assert len(info) == 4
+    assert ocsn('vbucket', 'info', *VB) == info
+    assert [ ocsn('flow', 'info', '--group-id', g) for g in ('g0', 'g1') ] == flows
+
+
+def test_open_snapshot_detects_gzip_and_closes(tmp_path):
+    records = [ ('svc/svc0', {'id': 'svc0'}), ('t/t0', {'id': 't0'}) ]
+
+    for name, compress in [ ('plain', False), ('packed', True) ]:
+        path = str(tmp_path / name)
+        with open_snapshot(path, 'w', compress) as out:
+            assert write_records(out, records) == 2
+
+        with open(path, 'rb') as f:
+            assert (f.read(2) == b'\x1f\x8b') == compress
+
+        with open_snapshot(path, 'r') as f:
+            lines = list(f)
+        assert f.closed
+        assert [ json.loads(line) for line in lines[1:] ] == [ {'k': k, 'v': v} for k, v in records ]
+
+
+def test_import_rejects_unknown_format(ocsn, client, tmp_path):
+    path = tmp_path / 'snapshot.jsonl'
+    path.write_text(json.dumps({'format': 'other', 'version': 1}) + '\n')
+
+    assert ocsn('import', '--input', str(path)).startswith('ERROR: unsupported snapshot format')
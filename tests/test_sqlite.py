@@ -0,0 +1,148 @@
+import threading
+
+from ocsn.backend import change_record
+from ocsn.sqlite_client import SQLiteClient
+
+
+def test_put_modes():
+    c = SQLiteClient()
+
+    assert not c.put('svc/a', '1', only_modify = True)
+    assert c.get('svc/a') is None
+
+    assert c.put('svc/a', '1', exclusive = True)
+    assert not c.put('svc/a', '2', exclusive = True)
+    assert c.put('svc/a', '3', only_modify = True)
+    assert c.put('svc/a', '4')
+    assert c.get('svc/a') == '4'
+
+    c.put_many([ ('svc/b', 'b'), ('svc/c', 'c') ])
+    assert c.get_many([ 'svc/c', 'svc/x', 'svc/a' ]) == [ 'c', None, '4' ]
+
+    c.remove('svc/a')
+    assert c.get('svc/a') is None
+
+
+def test_key_batches_merge_all_key_tables():
+    c = SQLiteClient()
+    c.put_many([ ('idx/z', '{}'), ('svc/a', '{}') ])
+    c.update_refs(add = [ ('idx/a', 'm1'), ('idx/a', 'm2'), ('idx/c', 'm') ])
+    c.update_scores(add = [ ('idx/b', 'm', 1) ])
+    c.hash_put('idx/d', {'f': '1'})
+    # the same key in two tables is listed once
+    c.hash_put('idx/c', {'f': '1'})
+
+    batches = list(c.key_batches('idx/', 2))
+    assert batches == [ [ 'idx/a', 'idx/b' ], [ 'idx/c', 'idx/d' ], [ 'idx/z' ] ]
+    assert list(c.keys('svc/')) == [ 'svc/a' ]
+    assert list(c.keys('idx/b')) == [ 'idx/b' ]
+
+
+def test_key_batches_allow_deleting_handed_out_keys():
+    c = SQLiteClient()
+    c.put_many([ ('b/t0/u0/vb%02d' % i, '{}') for i in range(25) ])
+
+    seen = []
+    for keys in c.key_batches('b/t0/', 10):
+        seen += keys
+        c.unlink(keys)
+
+    assert len(seen) == 25
+    assert list(c.keys('b/')) == []
+
+
+def test_unlink_drops_every_table():
+    c = SQLiteClient()
+    c.put('idx/x', '{}')
+    c.update_refs(add = [ ('idx/x', 'm') ])
+    c.update_scores(add = [ ('idx/x', 'm', 1) ])
+    c.hash_put('idx/x', {'f': 'v'})
+
+    c.unlink([ 'idx/x' ])
+    assert c.get('idx/x') is None
+    assert c.get_refs('idx/x') == []
+    assert c.get_scores('idx/x') == []
+    assert c.hash_len('idx/x') == 0
+
+
+def test_refs_and_scores():
+    c = SQLiteClient()
+    c.update_refs(add = [ ('i', 'b'), ('i', 'a'), ('i', 'a') ])
+    assert c.get_refs('i') == [ 'a', 'b' ]
+    c.update_refs(add = [ ('i', 'c') ], remove = [ ('i', 'a') ])
+    assert c.get_refs('i') == [ 'b', 'c' ]
+
+    c.update_scores(add = [ ('s', 'x', 30), ('s', 'y', 10), ('s', 'z', 20) ])
+    assert c.get_scores('s') == [ ('y', 10), ('z', 20), ('x', 30) ]
+    assert c.get_scores('s', 15, 30) == [ ('z', 20), ('x', 30) ]
+    assert c.get_scores('s', limit = 1) == [ ('y', 10) ]
+    c.update_scores(remove = [ ('s', 'y') ])
+    assert c.get_scores('s', high = 20) == [ ('z', 20) ]
+
+
+def test_hashes():
+    c = SQLiteClient()
+    c.hash_put('h', { 'f%d' % i: str(i) for i in range(5) })
+    assert c.hash_get('h', [ 'f3', 'nope', 'f0' ]) == [ '3', None, '0' ]
+    assert c.hash_len('h') == 5
+    assert [ len(b) for b in c.hash_batches('h', 2) ] == [ 2, 2, 1 ]
+
+    assert c.hash_incr('counts', 'a') == 1
+    assert c.hash_incr('counts', 'a', 4) == 5
+    assert c.hash_incr('counts', 'a', -5) == 0
+    assert c.hash_get('counts', [ 'a' ]) == [ '0' ]
+    assert c.hash_incr('counts', 'a', 2) == 2
+    assert c.hash_incr('counts', 'a', -2, drop = True) == 0
+    assert c.hash_get('counts', [ 'a' ]) == [ None ]
+
+    assert c.hash_swap('swap', 'f', 'x') is None
+    assert c.hash_swap('swap', 'f', 'y') == 'x'
+    assert c.hash_swap('swap', 'f', None) == 'y'
+    assert c.hash_get('swap', [ 'f' ]) == [ None ]
+
+    c.hash_remove('h', [ 'f0', 'f1' ])
+    assert sorted(f for b in c.hash_batches('h') for f, _ in b) == [ 'f2', 'f3', 'f4' ]
+
+
+def test_change_feed_and_groups():
+    c = SQLiteClient()
+    assert c.last_change() is None
+
+    versions = c.append_changes([ change_record('svc/a', 'store'), change_record('svc/a', 'remove') ])
+    assert c.last_change() == versions[-1]
+    assert c.read_changes() == [ (versions[0], {'type': 'svc', 'key': 'svc/a', 'op': 'store'}),
+                                 (versions[1], {'type': 'svc', 'key': 'svc/a', 'op': 'remove'}) ]
+    assert c.read_changes(versions[0]) == c.read_changes()[1:]
+    assert c.read_changes(versions[-1], block = 100) == []
+
+    c.create_change_group('g', start = '0')
+    got = c.read_change_group('g', 'w1', count = 1)
+    assert [ v for v, _ in got ] == versions[:1]
+    assert [ v for v, _ in c.read_change_group('g', 'w2') ] == versions[1:]
+
+    # delivered but not acked yet
+    assert [ v for v, _ in c.read_change_group('g', 'w1', pending_after = '0') ] == versions[:1]
+    c.ack_changes('g', versions[:1])
+    assert c.read_change_group('g', 'w1', pending_after = '0') == []
+
+
+def test_blocking_read_sees_a_later_append():
+    c = SQLiteClient()
+    last = c.last_change()
+
+    t = threading.Timer(0.1, lambda: c.append_changes([ change_record('t/t0', 'store') ]))
+    t.start()
+    try:
+        changes = c.read_changes(last, block = 2000)
+    finally:
+        t.join()
+
+    assert [ r['key'] for _, r in changes ] == [ 't/t0' ]
+
+
+def test_trims_the_change_feed():
+    c = SQLiteClient(changefeed_maxlen = 100)
+    for _ in range(3):
+        c.append_changes([ change_record('t/t%d' % i, 'store') for i in range(1000) ])
+
+    assert len(c.read_changes(count = 10000)) <= 1100
@@ -0,0 +1,65 @@
+from conftest import setup_catalog, docs, VB
+
+from ocsn.ocsn_types import *
+
+
+def setup_replicas(ocsn, svcs = 3):
+    # vb0 maps one bucket on each of svc0..svcN
+    setup_catalog(ocsn, bis = 1)
+    ocsn('vbucket', 'map', *VB, '--svci-id', 'svci0', '--bi-id', 'bi0', '--entry-id', 'e0')
+    for i in range(1, svcs):
+        ocsn('svc', 'create', '--svc-id', 'svc%d' % i, '--name', 'svc %d' % i, '--endpoint', 'https://s3.example.com')
+        ocsn('svci', 'create', '--svci-id', 'svci%d' % i, '--svc-id', 'svc%d' % i, '--name', 'svci %d' % i)
+        ocsn('bi', 'create', '--svci-id', 'svci%d' % i, '--bi-id', 'bi0', '--bucket', 'bucket0')
+        ocsn('vbucket', 'map', *VB, '--svci-id', 'svci%d' % i, '--bi-id', 'bi0', '--entry-id', 'e%d' % i)
+
+
+def missing(out):
+    # verify prints an 'Existing flows:' and a 'Missing flows:' document per vbucket
+    return json.loads(out.split('Missing flows:')[1])
+
+
+def test_group_is_stored_once(ocsn, client):
+    s = ocsn('flow', 'symmetric', '--group-id', 'g0',
+             *sum([ [ '--endpoint', 'svc%d:bucket0' % i ] for i in range(10) ], []))
+
+    stored = [ k for k in docs(client) if k.startswith('dflow/') ]
+    assert stored == [ 'dflow/' + s['id'] ]
+    assert len(s['flow']['entities']) == 10
+
+    info = ocsn('flow', 'info', '--group-id', 'g0')
+    assert info['flows'] == {}
+    assert list(info['symmetric']) == [ s['id'] ]
+
+
+def test_group_needs_two_endpoints(ocsn):
+    out = ocsn('flow', 'symmetric', '--endpoint', 'svc0:a')
+    assert 'at least two endpoints' in out
+
+
+def test_check_is_membership():
+    g = OCSNSymmetricFlow('g0', [ OCSNDataFlowEntity('svc%d' % i, 'b', '') for i in range(10) ])
+
+    assert g.check(OCSNDataFlowEntity('svc3', 'b', ''), OCSNDataFlowEntity('svc7', 'b', ''))
+    assert not g.check(OCSNDataFlowEntity('svc3', 'b', ''), OCSNDataFlowEntity('svc3', 'b', ''))
+    assert not g.check(OCSNDataFlowEntity('svc3', 'b', ''), OCSNDataFlowEntity('svc10', 'b', ''))
+
+
+def test_verify_uses_symmetric_group(ocsn):
+    setup_replicas(ocsn)
+
+    assert len(missing(ocsn('flow', 'verify'))) == 6
+
+    ocsn('flow', 'symmetric', '--group-id', 'g0',
+         '--endpoint', 'svc0:bucket0', '--endpoint', 'svc1:bucket0', '--endpoint', 'svc2:bucket0')
+    assert missing(ocsn('flow', 'verify')) == []
+    assert missing(ocsn('flow', 'verify', '--vectorized')) == []
+
+
+def test_verify_reports_pairs_outside_group(ocsn):
+    setup_replicas(ocsn)
+
+    ocsn('flow', 'symmetric', '--group-id', 'g0', '--endpoint', 'svc0:bucket0', '--endpoint', 'svc1:bucket0')
+
+    pairs = sorted((s['svc_id'], d['svc_id']) for s, d in missing(ocsn('flow', 'verify')))
+    assert pairs == [ ('svc0', 'svc2'), ('svc1', 'svc2'), ('svc2', 'svc0'), ('svc2', 'svc1') ]